@@ -0,0 +1,146 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import database
+import metrics
+
+# 按内容哈希缓存的派生文件目录
+CACHE_DIR = "output/cache"
+ARTIFACT_CACHE_BUDGET_MB = int(os.getenv("artifact_cache_budget_mb", "20480"))  # 缓存占用磁盘上限，超出后按最近最少使用淘汰
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# 每个缓存文件一行，记录大小与最近访问时间，用于 LRU 淘汰
+def create_cache_table():
+    with database.get_db() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS artifact_cache (
+                path TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_artifact_cache_last_access ON artifact_cache (last_access)")
+
+create_cache_table()
+
+
+# 计算文件内容的 sha256
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# 查询视频上传时记录的内容哈希，filename 可以带或不带 .mp4 后缀
+def video_content_hash(filename):
+    video = database.find_video_by_filename(filename)
+    return video["content_hash"] if video else None
+
+
+# 缓存目录由 内容哈希 + 产物类型 + 参数 决定，参数不同（模型、尺寸等）互不影响
+def cache_entry_dir(content_hash, kind, params):
+    params_digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, kind, content_hash[:2], content_hash, params_digest)
+
+
+# 音频、预览等媒体文件写出后不再修改，也不参与修改时间的新旧比较，与缓存共用同一份数据（硬链接）
+# 文本类产物的修改时间会与其他文件比较，仍然复制，恢复出的文件按新文件计
+HARDLINK_KINDS = ("audio", "preview")
+
+
+def _copy_file(src, dest, link=False):
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    temp_path = dest + ".part"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    linked = False
+    if link:
+        try:
+            os.link(src, temp_path)
+            linked = True
+        except OSError as e:
+            # 跨文件系统或不允许硬链接时改为复制
+            if e.errno not in (errno.EXDEV, errno.EPERM):
+                raise
+    if not linked:
+        shutil.copyfile(src, temp_path)
+    os.replace(temp_path, dest)
+
+
+# 从缓存恢复产物，targets 为 {缓存内文件名: 目标路径}；全部命中才返回 True
+def fetch(content_hash, kind, params, targets):
+    if not content_hash:
+        metrics.ARTIFACT_CACHE_EVENTS.labels(kind, "miss").inc()
+        return False
+    entry_dir = cache_entry_dir(content_hash, kind, params)
+    sources = {name: os.path.join(entry_dir, name) for name in targets}
+    if not all(os.path.exists(path) for path in sources.values()):
+        metrics.ARTIFACT_CACHE_EVENTS.labels(kind, "miss").inc()
+        return False
+    metrics.ARTIFACT_CACHE_EVENTS.labels(kind, "hit").inc()
+
+    for name, dest in targets.items():
+        _copy_file(sources[name], dest, link=kind in HARDLINK_KINDS)
+
+    with database.get_db() as conn:
+        conn.executemany("UPDATE artifact_cache SET last_access = ? WHERE path = ?",
+                         [(time.time(), path) for path in sources.values()])
+    return True
+
+
+# 将产物存入缓存，sources 为 {缓存内文件名: 源文件路径}
+def store(content_hash, kind, params, sources):
+    if not content_hash:
+        return
+    entry_dir = cache_entry_dir(content_hash, kind, params)
+    rows = []
+    for name, src in sources.items():
+        dest = os.path.join(entry_dir, name)
+        _copy_file(src, dest, link=kind in HARDLINK_KINDS)
+        rows.append((dest, content_hash, kind, os.path.getsize(dest), time.time()))
+
+    with database.get_db() as conn:
+        conn.executemany("INSERT OR REPLACE INTO artifact_cache (path, content_hash, kind, size, last_access) VALUES (?, ?, ?, ?, ?)", rows)
+    enforce_budget()
+
+
+# 仍与输出文件共用的缓存文件（硬链接数大于 1）不额外占用空间，不计入预算，删除它也释放不了空间
+def _unshared_size(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return 0
+    return stat.st_size if stat.st_nlink <= 1 else 0
+
+
+# 超出磁盘预算时删除最久未访问的缓存文件，返回释放的字节数
+def enforce_budget(budget_bytes=None):
+    if budget_bytes is None:
+        budget_bytes = ARTIFACT_CACHE_BUDGET_MB * 1024 * 1024
+    reclaimed = 0
+    with database.get_db() as conn:
+        if conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifact_cache").fetchone()[0] <= budget_bytes:
+            return 0
+        rows = conn.execute("SELECT path FROM artifact_cache ORDER BY last_access").fetchall()
+        sizes = [_unshared_size(row["path"]) for row in rows]
+        total = sum(sizes)
+        for row, size in zip(rows, sizes):
+            if total - reclaimed <= budget_bytes:
+                break
+            if size == 0 and os.path.exists(row["path"]):
+                continue
+            if os.path.exists(row["path"]):
+                os.remove(row["path"])
+            conn.execute("DELETE FROM artifact_cache WHERE path = ?", (row["path"],))
+            reclaimed += size
+    return reclaimed
@@ -0,0 +1,337 @@
+import glob
+import gzip
+import os
+import re
+import shutil
+import time
+
+import database
+import segment_store
+
+# 派生文件登记表：由视频生成的每个文件（或目录）一行，记录所属视频、类型、大小与最近访问时间
+# 删除视频时据此级联删除；定时任务按磁盘配额淘汰最久未访问、可以重新生成的文件，并压缩长期未访问的转录文本
+OUTPUT_QUOTA_MB = int(os.getenv("output_quota_mb", "0"))  # 派生文件占用磁盘上限，0 表示不限制
+ARTIFACT_MIN_IDLE_SECONDS = int(os.getenv("artifact_min_idle_seconds", "3600"))  # 最近这段时间内生成或访问过的文件不淘汰
+ARTIFACT_COMPRESS_AFTER_DAYS = float(os.getenv("artifact_compress_after_days", "0"))  # 视频多少天没有访问后压缩转录文本，0 表示不压缩
+ARTIFACT_REMOVE_ORPHANS = os.getenv("artifact_remove_orphans", "1") != "0"  # 删除视频已不存在的遗留派生文件
+ARTIFACT_TOUCH_INTERVAL = 300  # 同一文件的访问时间最多每隔这么久写一次数据库
+
+VIDEO_DIR = "output/videos"
+TRANSCRIPT_DIR = "output/transcripts"
+
+
+def _transcribed(filename):
+    return segment_store.exists(filename) or any(
+        os.path.exists(os.path.join(TRANSCRIPT_DIR, filename + suffix)) for suffix in (".txt", ".txt.gz"))
+
+
+# 派生文件类型：所在目录、文件名后缀（文件名 = 视频名去掉 .mp4 + 后缀，可含 *），directory 表示每个视频一个目录
+# policy：evict 可以重新生成，超出配额时删除；compress 长期未访问时 gzip 压缩；keep 只随视频一起删除
+# requires：满足条件时才可以淘汰，例如音频在转录完成后、旧格式文件在字幕存储中有对应的列时
+# 同一目录中后缀更具体的类型排在前面
+ARTIFACT_KINDS = [
+    {"kind": "audio", "dir": "output/audios", "suffixes": (".wav", ".mp3"), "policy": "evict", "requires": _transcribed},
+    {"kind": "preview", "dir": "output/previews", "suffixes": ("_preview.mp4",), "policy": "evict"},
+    {"kind": "wordcloud", "dir": "output/wordclouds", "suffixes": ("_wordcloud*.png",), "policy": "evict"},
+    {"kind": "freq", "dir": "output/wordclouds", "suffixes": ("_freq.json",), "policy": "evict"},
+    {"kind": "tokens", "dir": "output/wordclouds", "suffixes": ("_tokens.json",), "policy": "evict"},
+    {"kind": "summary", "dir": TRANSCRIPT_DIR, "suffixes": ("_summary.txt",), "policy": "keep"},
+    {"kind": "translation_export", "dir": TRANSCRIPT_DIR, "suffixes": ("_chinese.json", "_chinese.txt"), "policy": "evict",
+     "requires": segment_store.has_translation},
+    {"kind": "segments_stream", "dir": TRANSCRIPT_DIR, "suffixes": (".segments.jsonl",), "policy": "evict",
+     "requires": segment_store.exists},
+    {"kind": "sentiment_export", "dir": TRANSCRIPT_DIR, "suffixes": (".json",), "policy": "evict",
+     "requires": segment_store.has_sentiment},
+    {"kind": "transcript", "dir": TRANSCRIPT_DIR, "suffixes": (".txt", ".srt"), "policy": "compress"},
+    {"kind": "transcript_gz", "dir": TRANSCRIPT_DIR, "suffixes": (".txt.gz", ".srt.gz"), "policy": "keep"},
+    {"kind": "segment_store", "dir": segment_store.SEGMENT_STORE_DIR, "directory": True, "policy": "keep"},
+    {"kind": "chunks", "dir": "output/chunks", "directory": True, "policy": "evict", "requires": _transcribed},
+]
+KIND_SPECS = {spec["kind"]: spec for spec in ARTIFACT_KINDS}
+EVICTABLE_KINDS = [spec["kind"] for spec in ARTIFACT_KINDS if spec["policy"] == "evict"]
+_SUFFIX_PATTERNS = [(spec, suffix, re.compile("(.+?)" + re.escape(suffix).replace(r"\*", ".*") + r"\Z"))
+                    for spec in ARTIFACT_KINDS for suffix in spec.get("suffixes", ())]
+
+_last_touch = {}
+
+
+def create_registry_table():
+    with database.get_db() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS artifacts (
+                path TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_artifacts_filename ON artifacts (filename)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_artifacts_last_access ON artifacts (last_access)")
+
+create_registry_table()
+
+
+def video_stem(filename):
+    return filename[:-len(".mp4")] if filename.endswith(".mp4") else filename
+
+
+# 文件或目录占用的字节数与最后修改时间
+def _disk_usage(path):
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime
+    size, mtime = 0, os.path.getmtime(path)
+    for root, _, names in os.walk(path):
+        for name in names:
+            stat = os.stat(os.path.join(root, name))
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+# 某个视频的所有派生文件，返回 [(类型, 路径)]
+def video_artifacts(filename):
+    stem = video_stem(filename)
+    artifacts = []
+    for spec in ARTIFACT_KINDS:
+        if spec.get("directory"):
+            path = os.path.join(spec["dir"], stem)
+            if os.path.isdir(path):
+                artifacts.append((spec["kind"], path))
+            continue
+        for suffix in spec["suffixes"]:
+            for path in sorted(glob.glob(os.path.join(spec["dir"], glob.escape(stem) + suffix))):
+                artifacts.append((spec["kind"], path))
+    return artifacts
+
+
+# 数据库与视频目录中的所有视频名
+def known_videos():
+    with database.get_db() as conn:
+        names = {video_stem(row["filename"]) for row in conn.execute("SELECT filename FROM videos")}
+    if os.path.isdir(VIDEO_DIR):
+        names |= {video_stem(name) for name in os.listdir(VIDEO_DIR) if name.endswith(".mp4")}
+    return names
+
+
+# 按文件名判断属于哪个视频：文件名可能同时匹配多个后缀（例如 x_summary.txt 也匹配 .txt），取视频存在的那一个
+def _owner(name, is_dir, directory, known):
+    candidates = []
+    if is_dir:
+        candidates = [(name, spec) for spec in ARTIFACT_KINDS if spec.get("directory") and spec["dir"] == directory]
+    else:
+        for spec, _, pattern in _SUFFIX_PATTERNS:
+            match = pattern.match(name) if spec["dir"] == directory else None
+            if match:
+                candidates.append((match.group(1), spec))
+    if not candidates:
+        return None, None
+    for stem, spec in candidates:
+        if stem in known:
+            return stem, spec
+    return None, candidates[0][1]
+
+
+# 扫描输出目录（每个目录只列一次），返回 ({路径: (视频名, 类型)}, 遗留文件路径列表)
+def scan(known=None):
+    known = known_videos() if known is None else known
+    found, orphans = {}, []
+    for directory in dict.fromkeys(spec["dir"] for spec in ARTIFACT_KINDS):
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if name.endswith(".part"):
+                continue
+            path = os.path.join(directory, name)
+            stem, spec = _owner(name, os.path.isdir(path), directory, known)
+            if stem is not None:
+                found[path] = (stem, spec["kind"])
+            elif spec is not None:
+                orphans.append(path)
+    return found, orphans
+
+
+# existing 为已登记的 {路径: 最近访问时间}，重新登记时保留访问时间
+def _upsert(conn, entries, existing):
+    rows = []
+    for path, stem, kind in entries:
+        try:
+            size, mtime = _disk_usage(path)
+        except OSError:
+            continue
+        rows.append((path, stem, kind, size, max(mtime, existing.get(path, 0))))
+    conn.executemany("INSERT OR REPLACE INTO artifacts (path, filename, kind, size, last_access) VALUES (?, ?, ?, ?, ?)", rows)
+
+
+# 登记某个视频当前的全部派生文件，任务生成新文件后调用
+def register_video(filename):
+    stem = video_stem(filename)
+    artifacts = video_artifacts(stem)
+    with database.get_db() as conn:
+        existing = {row["path"]: row["last_access"] for row in
+                    conn.execute("SELECT path, last_access FROM artifacts WHERE filename = ?", (stem,))}
+        conn.execute("DELETE FROM artifacts WHERE filename = ?", (stem,))
+        _upsert(conn, [(path, stem, kind) for kind, path in artifacts], existing)
+
+
+# 以磁盘为准同步登记表：补登记新文件、更新大小、删除已不存在的记录；返回遗留文件列表
+def sync():
+    found, orphans = scan()
+    with database.get_db() as conn:
+        existing = {row["path"]: row["last_access"] for row in conn.execute("SELECT path, last_access FROM artifacts")}
+        conn.executemany("DELETE FROM artifacts WHERE path = ?", [(path,) for path in existing if path not in found])
+        _upsert(conn, [(path, stem, kind) for path, (stem, kind) in found.items()], existing)
+    return orphans
+
+
+def forget(paths):
+    with database.get_db() as conn:
+        conn.executemany("DELETE FROM artifacts WHERE path = ?", [(path,) for path in paths])
+
+
+# 记录访问时间，同一进程内同一文件每 ARTIFACT_TOUCH_INTERVAL 秒最多写一次
+def touch(path):
+    now = time.time()
+    if now - _last_touch.get(path, 0) < ARTIFACT_TOUCH_INTERVAL:
+        return
+    _last_touch[path] = now
+    with database.get_db() as conn:
+        conn.execute("UPDATE artifacts SET last_access = ? WHERE path = ?", (now, path))
+
+
+# 删除视频的全部派生文件与登记记录，返回 (文件数, 释放的字节数)
+def delete_video_artifacts(filename):
+    stem = video_stem(filename)
+    removed, reclaimed = 0, 0
+    for _, path in video_artifacts(stem):
+        try:
+            size, _ = _disk_usage(path)
+        except OSError:
+            continue
+        _remove(path)
+        removed += 1
+        reclaimed += size
+    with database.get_db() as conn:
+        conn.execute("DELETE FROM artifacts WHERE filename = ?", (stem,))
+    return removed, reclaimed
+
+
+# gzip 压缩文件，保留原文件的修改时间，返回节省的字节数
+def compress(path):
+    compressed_path = path + ".gz"
+    temp_path = compressed_path + ".part"
+    with open(path, "rb") as source, gzip.open(temp_path, "wb") as target:
+        shutil.copyfileobj(source, target)
+    shutil.copystat(path, temp_path)
+    os.replace(temp_path, compressed_path)
+    saved = os.path.getsize(path) - os.path.getsize(compressed_path)
+    os.remove(path)
+    with database.get_db() as conn:
+        row = conn.execute("SELECT filename, last_access FROM artifacts WHERE path = ?", (path,)).fetchone()
+        conn.execute("DELETE FROM artifacts WHERE path = ?", (path,))
+        if row:
+            conn.execute("INSERT OR REPLACE INTO artifacts (path, filename, kind, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                         (compressed_path, row["filename"], "transcript_gz", os.path.getsize(compressed_path), row["last_access"]))
+    return saved
+
+
+# 读取前调用：文件已被压缩时解压回原位置（修改时间不变，下游产物不会因此被判定为过期），返回文件是否可用
+def restore(path):
+    compressed_path = path + ".gz"
+    if os.path.exists(path):
+        if os.path.exists(compressed_path):
+            os.remove(compressed_path)  # 文件重新生成后遗留的旧压缩文件
+        touch(path)
+        return True
+    if not os.path.exists(compressed_path):
+        return False
+    temp_path = path + ".part"
+    with gzip.open(compressed_path, "rb") as source, open(temp_path, "wb") as target:
+        shutil.copyfileobj(source, target)
+    shutil.copystat(compressed_path, temp_path)
+    os.replace(temp_path, path)
+    os.remove(compressed_path)
+    with database.get_db() as conn:
+        conn.execute("UPDATE artifacts SET path = ?, kind = 'transcript', size = ?, last_access = ? WHERE path = ?",
+                     (path, os.path.getsize(path), time.time(), compressed_path))
+    return True
+
+
+def _evictable(kind, filename):
+    requires = KIND_SPECS[kind].get("requires")
+    return requires is None or requires(filename)
+
+
+# 同步登记表后依次：删除遗留文件、压缩长期未访问的视频的转录文本、超出配额时按最近最少访问淘汰可重新生成的文件
+# 返回各部分释放的空间
+def enforce_quota(quota_bytes=None, compress_after_seconds=None, min_idle_seconds=None):
+    quota_bytes = OUTPUT_QUOTA_MB * 1024 * 1024 if quota_bytes is None else quota_bytes
+    compress_after_seconds = ARTIFACT_COMPRESS_AFTER_DAYS * 86400 if compress_after_seconds is None else compress_after_seconds
+    min_idle_seconds = ARTIFACT_MIN_IDLE_SECONDS if min_idle_seconds is None else min_idle_seconds
+    idle_before = time.time() - min_idle_seconds
+    report = {"orphans_removed": 0, "compressed": 0, "evicted": 0,
+              "reclaimed_bytes": {"orphans": 0, "compressed": 0, "evicted": 0}}
+
+    orphans = sync()
+    if ARTIFACT_REMOVE_ORPHANS:
+        for path in orphans:
+            try:
+                size, mtime = _disk_usage(path)
+            except OSError:
+                continue
+            if mtime < idle_before:
+                _remove(path)
+                report["orphans_removed"] += 1
+                report["reclaimed_bytes"]["orphans"] += size
+
+    if compress_after_seconds > 0:
+        with database.get_db() as conn:
+            cold = conn.execute(
+                "SELECT path FROM artifacts WHERE kind = 'transcript' AND filename IN "
+                "(SELECT filename FROM artifacts GROUP BY filename HAVING MAX(last_access) < ?)",
+                (time.time() - compress_after_seconds,)).fetchall()
+        for row in cold:
+            try:
+                report["reclaimed_bytes"]["compressed"] += compress(row["path"])
+                report["compressed"] += 1
+            except OSError as e:
+                print(f"failed to compress {row['path']}: {e}")
+
+    with database.get_db() as conn:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+        candidates = conn.execute(
+            f"SELECT path, filename, kind, size FROM artifacts WHERE kind IN ({', '.join('?' for _ in EVICTABLE_KINDS)}) "
+            "AND last_access < ? ORDER BY last_access", EVICTABLE_KINDS + [idle_before]).fetchall() \
+            if 0 < quota_bytes < total else []
+    evicted = []
+    for row in candidates:
+        if total <= quota_bytes:
+            break
+        if not _evictable(row["kind"], row["filename"]):
+            continue
+        _remove(row["path"])
+        evicted.append(row["path"])
+        total -= row["size"]
+        report["reclaimed_bytes"]["evicted"] += row["size"]
+    forget(evicted)
+    report["evicted"] = len(evicted)
+
+    report["total_bytes"] = total
+    report["quota_bytes"] = quota_bytes
+    report["over_quota"] = 0 < quota_bytes < total
+    return report
+
+
+# 按类型汇总的占用空间
+def usage():
+    with database.get_db() as conn:
+        rows = conn.execute("SELECT kind, COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes FROM artifacts GROUP BY kind").fetchall()
+    return {row["kind"]: {"files": row["files"], "bytes": row["bytes"]} for row in rows}
@@ -1,33 +1,48 @@
-import jieba
-import requests
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Query
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from moviepy.editor import VideoFileClip
+import fcntl
+import hashlib
+import mimetypes
 import shutil
 import os
 from uuid import uuid4
 from datetime import datetime
-import sqlite3
-from typing import List
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional
+from collections import OrderedDict
 from fastapi.middleware.cors import CORSMiddleware
 import json
-from textblob import TextBlob
-from wordcloud import WordCloud
-
-from celery_server import transcribe_audio, simple_test, translate_json_task
+import time
+
+import artifact_cache
+import artifact_registry
+import database
+from database import save_video_info, find_video_by_hash
+import text_analysis
+import llm_cache
+import llm_client
+import metrics
+import search_index
+import segment_store
+
+from celery_server import transcribe_audio, transcribe_audio_chunked, simple_test, translate_json_task, segments_stream_path, \
+    extract_audio_task, extract_and_transcribe, audio_file_path, summarize_text_task, evaluate_speech_task, \
+    read_transcript_segments, render_wordcloud_task, wordcloud_paths, mask_file_path, \
+    render_preview_task, preview_file_path, run_sentiment_analysis, run_word_frequency, start_pipeline, \
+    pipeline_job_status, TASK_PRIORITY_DEFAULT, TRANSCRIBE_BACKENDS, rebuild_search_index, \
+    ensure_segment_store, export_legacy_file, LEGACY_FORMATS, collect_batch_sources, create_batch, resume_batch, batch_status, \
+    restore_transcript, enforce_disk_quota
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 
 
 # 加载环境变量
 load_dotenv()  # 加载 .env 文件中的变量
-API_KEY = os.getenv("api_key")  # 从环境变量读取 API 密钥
-API_URL = os.getenv("api_url")  # 从环境变量读取 API URL
-
 
-# 数据库文件位置
-DATABASE_URL = "sqlite.db"
 
 # 视频文件的存储目录
 VIDEO_DIR = "output/videos"
@@ -40,7 +55,17 @@ TRANSLATED_DIR = "output/translated"  # 翻译文件目录
 os.makedirs(VIDEO_DIR, exist_ok=True)
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
-app = FastAPI()
+# 应用生命周期内共享一个异步 HTTP 客户端，所有对外请求复用连接池
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.http_client = llm_client.create_http_client()
+    # 启动时加载 jieba 词典，避免首个分词请求的冷启动
+    await run_in_threadpool(text_analysis.init_jieba)
+    yield
+    await app.state.http_client.aclose()
+    database.close_pool()
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="output/wordclouds"), name="static")
 
 
@@ -53,27 +78,30 @@ app.add_middleware(
     allow_headers=["*"],  # 允许的头
 )
 
-# 数据库连接
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_URL)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-# 创建数据库表
-def create_videos_table():
-    conn = get_db_connection()
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS videos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT NOT NULL,
-            size REAL NOT NULL,
-            upload_time TEXT NOT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-create_videos_table()
+# 链路追踪（可选）：请求与其触发的 celery 任务串成一条链路
+metrics.init_tracing("backend", app, celery=True)
+
+
+# 按路由记录请求耗时；流式响应只统计到开始返回响应体为止
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.labels(request.method, route.path if route else "unmatched", str(status)) \
+            .observe(time.perf_counter() - start)
+
+
+# Prometheus 指标
+@app.get("/metrics")
+def get_metrics():
+    content, content_type = metrics.collect()
+    return Response(content=content, media_type=content_type)
 
 # 视频模型
 class Video(BaseModel):
@@ -81,85 +109,453 @@ class Video(BaseModel):
     filename: str
     size: float
     upload_time: datetime
+    content_hash: Optional[str] = None
+    audio_ready: bool = False
+    transcript_ready: bool = False
+    analysis_ready: bool = False
+
+# 单个视频的大小上限
+MAX_UPLOAD_BYTES = int(os.getenv("max_upload_mb", "4096")) * 1024 * 1024
+UPLOAD_WRITE_BUFFER = 4 * 1024 * 1024  # 攒够这么多数据再写盘和计算哈希，减少线程切换
+
+# 正在进行的断点续传上传的哈希状态：upload_id -> (sha256 对象, 已计算的字节数)
+_upload_hashers = {}
+
+
+# 上传完成后的统一处理：重复内容改为硬链接、写入数据库、按需排队 提取音频 → 转录 流水线
+def finalize_upload(file_location, unique_filename, content_hash, transcribe):
+    # 内容重复的视频改为硬链接到已有文件，后续各处理步骤会从缓存中直接恢复产物
+    duplicate = find_video_by_hash(content_hash)
+    if duplicate and os.path.exists(os.path.join(VIDEO_DIR, duplicate["filename"])):
+        try:
+            os.remove(file_location)
+            os.link(os.path.join(VIDEO_DIR, duplicate["filename"]), file_location)
+        except OSError:
+            shutil.copyfile(os.path.join(VIDEO_DIR, duplicate["filename"]), file_location)
 
-# 保存视频信息到数据库
-def save_video_info(filename, size, upload_time):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO videos (filename, size, upload_time) VALUES (?, ?, ?)",
-                   (filename, size, upload_time))
-    conn.commit()
-    conn.close()
-
-# 上传视频接口
+    file_size = os.path.getsize(file_location)
+    metrics.span_attributes(filename=unique_filename, content_hash=content_hash)
+    save_video_info(filename=unique_filename, size=file_size, upload_time=datetime.now().isoformat(), content_hash=content_hash)
+
+    response = {"filename": unique_filename, "size": file_size, "content_hash": content_hash}
+    if duplicate:
+        response["duplicate_of"] = duplicate["filename"]
+    if transcribe:
+        task = extract_and_transcribe(os.path.splitext(unique_filename)[0])
+        response["task_id"] = task.id
+    return response
+
+
+# 生成保存用的唯一文件名；需要转录时只接受 mp4（后缀统一为小写），在接收数据之前就返回 400
+def _unique_video_filename(filename, transcribe):
+    name, extension = os.path.splitext(os.path.basename(filename or ""))
+    if transcribe:
+        if extension.lower() != ".mp4":
+            raise HTTPException(status_code=400, detail="Only .mp4 videos can be transcribed")
+        extension = ".mp4"
+    return f"{uuid4()}-{name}{extension}"
+
+
+def _copy_and_hash(source, file_location):
+    digest = hashlib.sha256()
+    with open(file_location, "wb") as file_object:
+        for block in iter(lambda: source.read(artifact_cache.HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+            file_object.write(block)
+    return digest.hexdigest()
+
+
+def _write_and_hash(file_object, digest, data):
+    file_object.write(data)
+    digest.update(data)
+
+
+# 将请求体以流的方式追加写入文件，同时更新哈希；超过大小上限时抛出 413
+async def _receive_body(request: Request, file_object, digest, received, limit):
+    buffer = bytearray()
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise HTTPException(status_code=413, detail="File too large")
+        buffer += chunk
+        if len(buffer) >= UPLOAD_WRITE_BUFFER:
+            await run_in_threadpool(_write_and_hash, file_object, digest, bytes(buffer))
+            buffer.clear()
+    if buffer:
+        await run_in_threadpool(_write_and_hash, file_object, digest, bytes(buffer))
+    return received
+
+
+# 上传视频接口（multipart 表单，兼容原有前端）
+# transcribe=true 时上传完成后立即排队执行 提取音频 → 转录 流水线
 @app.post("/upload-video/")
-async def upload_video(file: UploadFile = File(...)):
-    unique_filename = f"{uuid4()}-{file.filename}"
+async def upload_video(file: UploadFile = File(...), transcribe: bool = False):
+    unique_filename = _unique_video_filename(file.filename, transcribe)
     file_location = os.path.join(VIDEO_DIR, unique_filename)
 
-    with open(file_location, "wb") as file_object:
-        shutil.copyfileobj(file.file, file_object)
+    # 边写入边计算内容哈希，在线程池中执行以免阻塞事件循环
+    content_hash = await run_in_threadpool(_copy_and_hash, file.file, file_location)
+    return await run_in_threadpool(finalize_upload, file_location, unique_filename, content_hash, transcribe)
 
-    file_size = os.path.getsize(file_location)
-    save_video_info(filename=unique_filename, size=file_size, upload_time=datetime.now().isoformat())
+# 流式上传接口：请求体即视频原始字节，直接写入视频目录，不经过临时文件中转
+# 上传过程中计算哈希与大小，完成后默认排队执行 提取音频 → 转录 流水线
+@app.put("/upload-stream/{filename}")
+async def upload_stream(filename: str, request: Request, transcribe: bool = True):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
 
-    return {"filename": unique_filename}
+    unique_filename = _unique_video_filename(filename, transcribe)
+    file_location = os.path.join(VIDEO_DIR, unique_filename)
+    part_location = file_location + ".part"
 
-# 获取所有视频接口
+    digest = hashlib.sha256()
+    try:
+        with open(part_location, "wb") as file_object:
+            await _receive_body(request, file_object, digest, 0, MAX_UPLOAD_BYTES)
+    except BaseException:
+        if os.path.exists(part_location):
+            os.remove(part_location)
+        raise
+    os.replace(part_location, file_location)
+
+    return await run_in_threadpool(finalize_upload, file_location, unique_filename, digest.hexdigest(), transcribe)
+
+# 断点续传：先创建上传会话，再用 PATCH 按偏移量（Upload-Offset 头）分片追加，
+# 连接中断后用 GET 查询已接收的字节数，从该位置继续上传；接收完 size 个字节后自动完成
+class UploadSession(BaseModel):
+    filename: str
+    size: Optional[int] = None
+    transcribe: bool = True
+
+def _upload_part_path(upload):
+    return os.path.join(VIDEO_DIR, upload["filename"] + ".part")
+
+@app.post("/uploads/")
+async def create_upload_session(session: UploadSession):
+    if session.size is not None and session.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    upload_id = uuid4().hex
+    unique_filename = _unique_video_filename(session.filename, session.transcribe)
+    database.create_upload(upload_id, unique_filename, session.size, session.transcribe, datetime.now().isoformat())
+    open(os.path.join(VIDEO_DIR, unique_filename + ".part"), "wb").close()
+    return {"upload_id": upload_id, "offset": 0}
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_session(upload_id: str):
+    upload = database.get_upload(upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    try:
+        offset = os.path.getsize(_upload_part_path(upload))
+    except FileNotFoundError:
+        # 长时间未完成的上传已被清理
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"upload_id": upload_id, "offset": offset, "size": upload["size"]}
+
+# 读取已接收部分的哈希状态；进程重启或由其他进程处理过分片时，从磁盘重新计算
+def _resume_hasher(upload_id, part_path, offset):
+    state = _upload_hashers.get(upload_id)
+    if state and state[1] == offset:
+        return state[0]
+    digest = hashlib.sha256()
+    with open(part_path, "rb") as file:
+        for block in iter(lambda: file.read(artifact_cache.HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest
+
+# 同一会话同一时刻只允许一个 PATCH 写入：对 .part 文件加排他锁（跨进程有效，进程退出时自动释放），
+# 已被其他请求持有时直接返回 409；加锁后再读取偏移量，保证偏移量检查与追加写入之间不会被其他请求插入
+@app.patch("/uploads/{upload_id}")
+async def append_upload_chunk(upload_id: str, request: Request, complete: bool = False):
+    upload = database.get_upload(upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+    part_path = _upload_part_path(upload)
+    try:
+        # 不使用追加模式打开，避免会话已完成（.part 已改名）时重新创建空文件
+        file_object = open(part_path, "r+b")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+    with file_object:
+        try:
+            fcntl.flock(file_object, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise HTTPException(status_code=409, detail={"message": "Upload in progress", "offset": os.path.getsize(part_path)})
+        # 等到锁时会话可能已被其他请求完成
+        if not database.get_upload(upload_id):
+            raise HTTPException(status_code=404, detail="Upload not found")
+
+        offset = file_object.seek(0, os.SEEK_END)
+        client_offset = request.headers.get("upload-offset")
+        if client_offset is None or not client_offset.isdigit() or int(client_offset) != offset:
+            raise HTTPException(status_code=409, detail={"message": "Upload-Offset mismatch", "offset": offset})
+
+        limit = min(MAX_UPLOAD_BYTES, upload["size"]) if upload["size"] is not None else MAX_UPLOAD_BYTES
+        digest = await run_in_threadpool(_resume_hasher, upload_id, part_path, offset)
+        try:
+            offset = await _receive_body(request, file_object, digest, offset, limit)
+        finally:
+            # 中途断开时已写入的数据保留，哈希状态与文件长度不一致时下次会从磁盘重新计算
+            file_object.flush()
+            _upload_hashers[upload_id] = (digest, os.fstat(file_object.fileno()).st_size)
+
+        if not complete and (upload["size"] is None or offset < upload["size"]):
+            return {"upload_id": upload_id, "offset": offset}
+        # 声明了大小的会话必须收齐全部字节才能完成
+        if upload["size"] is not None and offset != upload["size"]:
+            raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "offset": offset, "size": upload["size"]})
+
+        _upload_hashers.pop(upload_id, None)
+        file_location = os.path.join(VIDEO_DIR, upload["filename"])
+        os.replace(part_path, file_location)
+        database.delete_upload(upload_id)
+    return await run_in_threadpool(finalize_upload, file_location, upload["filename"], digest.hexdigest(), bool(upload["transcribe"]))
+
+# 获取视频列表接口，按 id 键集分页：下一页的游标通过响应头 X-Next-Cursor 返回，没有下一页时不返回该头
+# 可按文件名关键字、上传时间范围、内容哈希和处理状态过滤
 @app.get("/videos/", response_model=List[Video])
-def list_videos():
-    conn = get_db_connection()
-    videos = conn.execute("SELECT * FROM videos").fetchall()
-    conn.close()
-    return [{"id": video["id"], "filename": video["filename"], "size": video["size"], "upload_time": video["upload_time"]} for video in videos]
-
-# 删除视频接口
+def list_videos(response: Response, limit: int = Query(100, ge=1, le=1000), cursor: Optional[int] = None,
+                order: str = "asc", q: Optional[str] = None,
+                uploaded_after: Optional[str] = None, uploaded_before: Optional[str] = None,
+                content_hash: Optional[str] = None, audio_ready: Optional[bool] = None,
+                transcript_ready: Optional[bool] = None, analysis_ready: Optional[bool] = None):
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+
+    conditions = []
+    params = []
+    if cursor is not None:
+        conditions.append("id > ?" if order == "asc" else "id < ?")
+        params.append(cursor)
+    if q:
+        conditions.append("filename LIKE ? ESCAPE '\\'")
+        params.append("%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    if uploaded_after:
+        conditions.append("upload_time >= ?")
+        params.append(uploaded_after)
+    if uploaded_before:
+        conditions.append("upload_time < ?")
+        params.append(uploaded_before)
+    if content_hash:
+        conditions.append("content_hash = ?")
+        params.append(content_hash)
+    for column, value in (("audio_ready", audio_ready), ("transcript_ready", transcript_ready), ("analysis_ready", analysis_ready)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(int(value))
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with database.get_db() as conn:
+        videos = conn.execute(
+            f"SELECT id, filename, size, upload_time, content_hash, audio_ready, transcript_ready, analysis_ready "
+            f"FROM videos {where} ORDER BY id {order.upper()} LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+
+    if len(videos) > limit:
+        videos = videos[:limit]
+        response.headers["X-Next-Cursor"] = str(videos[-1]["id"])
+    return [dict(video) for video in videos]
+
+# 删除视频接口：同时删除音频、字幕、分析结果、词云等全部派生文件以及检索索引和作业记录
 @app.delete("/delete-video/{video_id}")
 def delete_video(video_id: int):
-    conn = get_db_connection()
-    video = conn.execute("SELECT * FROM videos WHERE id = ?", (video_id,)).fetchone()
+    with database.get_db() as conn:
+        video = conn.execute("SELECT * FROM videos WHERE id = ?", (video_id,)).fetchone()
+
+        if not video:
+            raise HTTPException(status_code=404, detail="Video not found")
+
+        video_path = os.path.join(VIDEO_DIR, video["filename"])
+        if os.path.exists(video_path):
+            os.remove(video_path)
+        conn.execute("DELETE FROM videos WHERE id = ?", (video_id,))
+    name = os.path.splitext(video["filename"])[0]
+    removed, reclaimed = artifact_registry.delete_video_artifacts(name)
+    search_index.remove(name)
+    database.delete_pipeline_jobs(name)
+    return {"status": "Video deleted", "artifacts_removed": removed, "reclaimed_bytes": reclaimed}
+
+# 文件下发的可选 sendfile 快速通道：设置 sendfile_header（X-Accel-Redirect 或 X-Sendfile）后，
+# 只返回带该头的空响应，由前置的 nginx/apache 直接用 sendfile 发送文件（包括 Range 请求）
+SENDFILE_HEADER = os.getenv("sendfile_header", "")
+SENDFILE_PREFIX = os.getenv("sendfile_prefix", "/protected/")  # X-Accel-Redirect 时 output 目录对应的 nginx internal location
+FILE_CHUNK_SIZE = 256 * 1024
+
+
+def _file_chunks(path, start, length):
+    with open(path, "rb") as file:
+        file.seek(start)
+        while length > 0:
+            block = file.read(min(FILE_CHUNK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+# 解析单个 Range 请求头，返回 (start, end)；格式不支持时返回 None，范围无法满足时抛出 ValueError
+def _parse_range(range_header, size):
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_text, _, end_text = ranges.strip().partition("-")
+    if not start_text:
+        # bytes=-N 表示最后 N 个字节
+        suffix = int(end_text)
+        if suffix <= 0:
+            raise ValueError("unsatisfiable range")
+        return max(0, size - suffix), size - 1
+    start = int(start_text)
+    end = min(int(end_text), size - 1) if end_text else size - 1
+    if start >= size or start > end:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+
+# 带 ETag / Last-Modified / Cache-Control 的文件响应：
+# 客户端缓存仍然有效时返回 304，带 Range 头时返回 206 部分内容，便于播放器拖动进度
+def conditional_file_response(request: Request, path: str, max_age: int = 3600):
+    stat = os.stat(path)
+    artifact_registry.touch(path)  # 记录访问时间，磁盘配额按最近最少访问淘汰
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": f"public, max-age={max_age}",
+               "Accept-Ranges": "bytes"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get("if-modified-since"):
+        try:
+            if int(stat.st_mtime) <= parsedate_to_datetime(request.headers["if-modified-since"]).timestamp():
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    if SENDFILE_HEADER:
+        if SENDFILE_HEADER.lower() == "x-accel-redirect":
+            target = SENDFILE_PREFIX + os.path.relpath(path, "output").replace(os.sep, "/")
+        else:
+            target = os.path.abspath(path)
+        return Response(headers=dict(headers, **{SENDFILE_HEADER: target}))
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range 与当前文件不一致时忽略 Range，返回完整文件
+    if range_header and (not if_range or if_range.strip() in (etag, last_modified)):
+        try:
+            byte_range = _parse_range(range_header, stat.st_size)
+        except ValueError:
+            return Response(status_code=416, headers=dict(headers, **{"Content-Range": f"bytes */{stat.st_size}"}))
+        if byte_range:
+            start, end = byte_range
+            headers.update({"Content-Range": f"bytes {start}-{end}/{stat.st_size}", "Content-Length": str(end - start + 1)})
+            media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            return StreamingResponse(_file_chunks(path, start, end - start + 1), status_code=206,
+                                     media_type=media_type, headers=headers)
+
+    # 完整文件交给 FileResponse，服务器支持时会走零拷贝发送
+    return FileResponse(path, headers=headers)
 
-    if not video:
+@app.get("/videos/{filename}")
+async def get_video(filename: str, request: Request):
+    video_path = os.path.join(VIDEO_DIR, filename)
+    if not os.path.isfile(video_path):
         raise HTTPException(status_code=404, detail="Video not found")
 
-    os.remove(os.path.join(VIDEO_DIR, video["filename"]))
-    conn.execute("DELETE FROM videos WHERE id = ?", (video_id,))
-    conn.commit()
-    conn.close()
-    return {"status": "Video deleted"}
+    # 上传的视频文件名唯一且内容不会变化，可以长时间缓存
+    return conditional_file_response(request, video_path, max_age=86400)
 
-@app.get("/videos/{filename}")
-async def get_video(filename: str):
+# 生成低码率预览版本（360p），在 worker 中转码，供浏览器内快速预览
+@app.post("/generate-preview/{filename}")
+async def generate_preview(filename: str, priority: int = Query(TASK_PRIORITY_DEFAULT, ge=0, le=9)):
     video_path = os.path.join(VIDEO_DIR, filename)
     if not os.path.isfile(video_path):
         raise HTTPException(status_code=404, detail="Video not found")
 
-    return FileResponse(video_path)
+    try:
+        task = render_preview_task.apply_async((filename,), priority=priority)
+        return {"task_id": task.id}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/preview/{filename}")
+async def get_preview(filename: str, request: Request):
+    file_path = preview_file_path(filename)
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="Preview not found")
+
+    return conditional_file_response(request, file_path, max_age=86400)
+
+TASK_WAIT_TIMEOUT_SECONDS = float(os.getenv("task_wait_timeout_seconds", "300"))  # wait=true 时最多等待的秒数
+TASK_POLL_INTERVAL_SECONDS = 0.5
+
+# 在事件循环中轮询任务状态，等待期间不占用线程池线程；超时返回 None，任务继续在 worker 中执行
+async def wait_for_task(task, timeout=TASK_WAIT_TIMEOUT_SECONDS):
+    deadline = time.monotonic() + timeout
+    while not await run_in_threadpool(task.ready):
+        if time.monotonic() >= deadline:
+            return None
+        await asyncio.sleep(TASK_POLL_INTERVAL_SECONDS)
+    return await run_in_threadpool(task.get)
 
 # 提取视频中的音频接口 请求这个接口需要对文件名url编码
+# 提取在 celery worker 中执行；wait=true（默认）时轮询等待完成，超过 task_wait_timeout_seconds 仍未完成则返回任务 ID
+# wait=false 时立即返回任务 ID，通过 /get-task-status 查询
 @app.post("/extract-audio/{filename}")
-async def extract_audio(filename: str):
+async def extract_audio(filename: str, wait: bool = True, priority: int = Query(TASK_PRIORITY_DEFAULT, ge=0, le=9)):
     video_path = os.path.join(VIDEO_DIR, filename+".mp4")
     if not os.path.isfile(video_path):
         raise HTTPException(status_code=404, detail="Video not found")
 
-    audio_path = os.path.join(AUDIO_DIR, filename + '.mp3')
     try:
-        video_clip = VideoFileClip(video_path)
-        audio_clip = video_clip.audio
-        audio_clip.write_audiofile(audio_path)
-        audio_clip.close()
-        video_clip.close()
+        task = extract_audio_task.apply_async((filename,), priority=priority)
+        result = await wait_for_task(task) if wait else None
+        if result is None:
+            return {"task_id": task.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    return {"audio_file": audio_path}
+    return {"audio_file": result["audio_file"]}
+
+# 提取音频并转录，返回一个任务 ID 即可查询整条流水线的结果
+@app.post("/extract-and-transcribe/{filename}")
+async def extract_and_transcribe_request(filename: str, model: str = None, priority: int = Query(TASK_PRIORITY_DEFAULT, ge=0, le=9),
+                                         backend: str = None):
+    video_path = os.path.join(VIDEO_DIR, filename+".mp4")
+    if not os.path.isfile(video_path):
+        raise HTTPException(status_code=404, detail="Video not found")
+
+    try:
+        task = extract_and_transcribe(filename, model, priority, backend)
+        return {"task_id": task.id}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 # 通过whisper将音频转录为文本 请求这个接口需要对文件名url编码
+# model 参数可选，用于指定 whisper 模型尺寸（tiny/base/small/medium/large 等）
+# chunked=true 时按静音切分音频，由多个 worker 并行转录后合并，适合长演讲
+# backend 可选 whisper / faster-whisper（int8 CPU 推理），beam_size、vad_filter、threads 覆盖该后端的默认参数
 @app.post("/transcribe-audio/{filename}")
-async def transcribe_audio_request(filename: str):
+async def transcribe_audio_request(filename: str, model: str = None, chunked: bool = False, chunk_seconds: float = 300,
+                                   priority: int = Query(TASK_PRIORITY_DEFAULT, ge=0, le=9), backend: str = None,
+                                   beam_size: Optional[int] = None, vad_filter: Optional[bool] = None, threads: Optional[int] = None):
+    if backend is not None and backend not in TRANSCRIBE_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Unknown transcription backend '{backend}'")
+    backend_options = {"beam_size": beam_size, "vad_filter": vad_filter, "threads": threads}
     try:
-        task = transcribe_audio.delay(filename)
+        if chunked:
+            task = transcribe_audio_chunked.apply_async((filename, model, chunk_seconds),
+                                                        {"backend": backend, "backend_options": backend_options}, priority=priority)
+        else:
+            task = transcribe_audio.apply_async((filename, model),
+                                                {"backend": backend, "backend_options": backend_options}, priority=priority)
         return {"task_id": task.id}
     except Exception as e:
         return {"error": str(e)}
@@ -178,6 +574,159 @@ async def get_task_status(task_id: str):
         return {"status": "failure", "error": str(task.info)}
 
 
+# 以 SSE 推送转录进度与新解码出的字幕，前端可通过 EventSource 订阅
+# 事件 id 为字幕序号，断线重连时浏览器会携带 Last-Event-ID，从下一条继续推送
+@app.get("/stream-transcript/{filename}")
+async def stream_transcript(filename: str, task_id: str, request: Request):
+    segments_path = segments_stream_path(filename)
+    last_event_id = request.headers.get("last-event-id", "")
+    skip = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+
+    def read_task_state():
+        task = transcribe_audio.AsyncResult(task_id)
+        return task.state, task.info
+
+    async def event_stream():
+        position = 0
+        index = 0
+        last_progress = None
+        while not await request.is_disconnected():
+            state, info = await run_in_threadpool(read_task_state)
+
+            # 从上次读到的位置继续读取新写入的完整行
+            if os.path.exists(segments_path):
+                with open(segments_path, "rb") as segments_file:
+                    segments_file.seek(position)
+                    while True:
+                        line = segments_file.readline()
+                        if not line.endswith(b"\n"):
+                            break
+                        position = segments_file.tell()
+                        if index >= skip:
+                            yield f"id: {index}\nevent: segment\ndata: {line.decode('utf-8').strip()}\n\n"
+                        index += 1
+
+            if state == "PROGRESS" and isinstance(info, dict) and info.get("progress") != last_progress:
+                last_progress = info.get("progress")
+                progress = {key: info.get(key) for key in ("progress", "processed_seconds", "duration", "segment_count")}
+                yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+            elif state == "SUCCESS":
+                yield f"event: done\ndata: {json.dumps(info, ensure_ascii=False)}\n\n"
+                break
+            elif state == "FAILURE":
+                yield f"event: error\ndata: {json.dumps({'error': str(info)}, ensure_ascii=False)}\n\n"
+                break
+
+            await asyncio.sleep(1)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# 端到端处理：提取音频 -> 转录 -> 情感分析/翻译、词频、词云、总结并行，返回一个作业 ID
+# stages 可只选部分阶段（逗号分隔，上游依赖会自动补上），已是最新的阶段会被跳过，force=true 时全部重新执行
+@app.post("/process/{filename}")
+async def process_video(filename: str, stages: Optional[str] = None, force: bool = False, model: str = None,
+                        scorer: str = text_analysis.DEFAULT_SENTIMENT_SCORER, priority: int = Query(TASK_PRIORITY_DEFAULT, ge=0, le=9),
+                        backend: str = None):
+    if not os.path.exists(os.path.join(VIDEO_DIR, filename + ".mp4")):
+        raise HTTPException(status_code=404, detail="Video file not found")
+    if scorer not in text_analysis.SENTIMENT_SCORERS:
+        raise HTTPException(status_code=400, detail=f"Unknown sentiment scorer '{scorer}'")
+    if backend is not None and backend not in TRANSCRIBE_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Unknown transcription backend '{backend}'")
+
+    stage_list = [stage.strip() for stage in stages.split(",") if stage.strip()] if stages else None
+    try:
+        job_id = start_pipeline(filename, stage_list, {"force": force, "model": model, "backend": backend, "scorer": scorer}, priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"job_id": job_id}
+
+
+# 查询流水线作业：整体状态以及每个阶段的状态、耗时和产物
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    status = pipeline_job_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+
+# 批量导入：服务器上 batch_import_root 目录下的视频目录或清单文件（也可以直接给出路径列表），
+# 一次请求登记整批视频，由 worker 按并发上限依次处理，通过一个批次 ID 查询整体进度与失败项
+BATCH_IMPORT_ROOT = os.getenv("batch_import_root", "output/imports")
+
+class BatchRequest(BaseModel):
+    directory: Optional[str] = None
+    manifest: Optional[str] = None
+    paths: Optional[List[str]] = None
+    stages: Optional[List[str]] = None
+    model: Optional[str] = None
+    backend: Optional[str] = None
+    scorer: str = text_analysis.DEFAULT_SENTIMENT_SCORER
+    force: bool = False
+    priority: int = TASK_PRIORITY_DEFAULT
+    max_in_flight: Optional[int] = None
+    link: bool = True
+
+# 相对于导入根目录解析路径，不允许访问根目录之外的文件
+def _import_path(path):
+    root = os.path.realpath(BATCH_IMPORT_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise HTTPException(status_code=403, detail=f"Path outside of import root: {path}")
+    return resolved
+
+@app.post("/batches/")
+async def create_batch_request(request: BatchRequest):
+    if len([value for value in (request.directory, request.manifest, request.paths) if value]) != 1:
+        raise HTTPException(status_code=400, detail="Specify exactly one of directory, manifest or paths")
+    if request.scorer not in text_analysis.SENTIMENT_SCORERS:
+        raise HTTPException(status_code=400, detail=f"Unknown sentiment scorer '{request.scorer}'")
+    if request.backend is not None and request.backend not in TRANSCRIBE_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Unknown transcription backend '{request.backend}'")
+    if not 0 <= request.priority <= 9:
+        raise HTTPException(status_code=400, detail="priority must be between 0 and 9")
+
+    if request.paths:
+        source = "paths"
+        sources = [_import_path(path) for path in request.paths]
+    else:
+        source = _import_path(request.directory or request.manifest)
+        if (request.directory and not os.path.isdir(source)) or (request.manifest and not os.path.isfile(source)):
+            raise HTTPException(status_code=404, detail="Import source not found")
+        sources = await run_in_threadpool(collect_batch_sources, source)
+        sources = [_import_path(path) for path in sources]
+    if not sources:
+        raise HTTPException(status_code=400, detail="No videos found")
+
+    options = {"force": request.force, "model": request.model, "backend": request.backend, "scorer": request.scorer}
+    try:
+        batch_id = await run_in_threadpool(create_batch, source, sources, request.stages, options, request.priority,
+                                           request.max_in_flight, request.link)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    resume_batch(batch_id)
+    return {"batch_id": batch_id, "total": len(sources)}
+
+# 批次进度：各状态数量、完成百分比与失败的视频
+@app.get("/batches/{batch_id}")
+async def get_batch_status(batch_id: str, failure_limit: int = Query(100, ge=0, le=1000)):
+    status = await run_in_threadpool(batch_status, batch_id, failure_limit)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return status
+
+# 重新启动调度（例如 worker 全部重启后），retry_failed=true 时失败的视频重新处理
+@app.post("/batches/{batch_id}/resume")
+async def resume_batch_request(batch_id: str, retry_failed: bool = False):
+    if database.get_batch(batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    resume_batch(batch_id, retry_failed)
+    return {"batch_id": batch_id}
+
+
 @app.post("/test-celery")
 async def test_celery():
     try:
@@ -187,299 +736,258 @@ async def test_celery():
         return {"error": str(e)}
 
 
+# 生成词云：渲染在 celery worker 中进行，不阻塞事件循环
+# 已有比转录文本新的同参数图片时立即返回；wait=false 或等待超时时返回任务 ID
 @app.post("/generate-wordcloud/{filename}")
-async def generate_wordcloud(filename: str):
+async def generate_wordcloud(filename: str, width: int = 800, height: int = 600, background_color: str = "white",
+                             mask: Optional[str] = None, wait: bool = True,
+                             priority: int = Query(TASK_PRIORITY_DEFAULT, ge=0, le=9)):
     transcript_path = os.path.join(TRANSCRIPT_DIR, filename + ".txt")
-    wordcloud_path = os.path.join(WORDCLOUD_DIR, filename + "_wordcloud.png")
+    wordcloud_path, thumbnail_paths = wordcloud_paths(filename, width, height, background_color, mask)
 
-    if not os.path.exists(transcript_path):
+    if not await run_in_threadpool(restore_transcript, filename):
         raise HTTPException(status_code=404, detail="Transcript file not found")
+    if mask and not os.path.isfile(mask_file_path(mask)):
+        raise HTTPException(status_code=404, detail="Mask file not found")
+
+    if os.path.exists(wordcloud_path) and os.path.getmtime(wordcloud_path) >= os.path.getmtime(transcript_path):
+        return {"message": "Wordcloud generated successfully", "wordcloud_file": wordcloud_path, "thumbnails": thumbnail_paths}
 
     try:
-        with open(transcript_path, "r", encoding="utf-8") as file:
-            text = file.read()
-
-        text = " ".join(jieba.cut(text))
-        wordcloud = WordCloud(
-            font_path='C:/Windows/Fonts/simhei.ttf',  # 根据实际情况调整字体路径
-            background_color='white',
-            width=800,
-            height=600,
-            margin=2
-        ).generate(text)
-
-        os.makedirs(os.path.dirname(wordcloud_path), exist_ok=True)
-        wordcloud.to_file(wordcloud_path)
-
-        return {"message": "Wordcloud generated successfully", "wordcloud_file": wordcloud_path}
+        task = render_wordcloud_task.apply_async((filename, width, height, background_color, mask), priority=priority)
+        result = await wait_for_task(task) if wait else None
+        if result is None:
+            return {"task_id": task.id}
+        return {"message": "Wordcloud generated successfully", "wordcloud_file": result["wordcloud_file"], "thumbnails": result["thumbnails"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# 请求单个词云图片
+# 请求单个词云图片，size 可选缩略图尺寸（如 200x150），其余参数需与生成时一致
 @app.get("/get-wordcloud/{filename}")
-async def get_wordcloud(filename: str):
-    wordcloud_path = f"output/wordclouds/{filename}_wordcloud.png"
-
-    if os.path.exists(wordcloud_path):
-        return FileResponse(wordcloud_path)
+async def get_wordcloud(filename: str, request: Request, width: int = 800, height: int = 600,
+                        background_color: str = "white", mask: Optional[str] = None, size: Optional[str] = None):
+    wordcloud_path, thumbnail_paths = wordcloud_paths(filename, width, height, background_color, mask)
+    if size:
+        wordcloud_path = thumbnail_paths.get(size, "")
+
+    if wordcloud_path and os.path.exists(wordcloud_path):
+        return conditional_file_response(request, wordcloud_path)
     else:
         raise HTTPException(status_code=404, detail="Wordcloud image not found")
 
 
-# 删除指定的创建词云文件
+# 删除词云图片及其缩略图，参数需与生成时一致
 @app.delete("/delete-wordcloud/{filename}")
-async def delete_wordcloud(filename: str):
-    wordcloud_path = os.path.join(WORDCLOUD_DIR, filename + "_wordcloud.json")
+async def delete_wordcloud(filename: str, width: int = 800, height: int = 600, background_color: str = "white",
+                           mask: Optional[str] = None):
+    wordcloud_path, thumbnail_paths = wordcloud_paths(filename, width, height, background_color, mask)
+    paths = [path for path in [wordcloud_path] + list(thumbnail_paths.values()) if os.path.exists(path)]
+    if not paths:
+        raise HTTPException(status_code=404, detail="Wordcloud image not found")
 
-    if os.path.exists(wordcloud_path):
-        os.remove(wordcloud_path)
-        return {"message": "Wordcloud json deleted successfully"}
-    else:
-        raise HTTPException(status_code=404, detail="Wordcloud json not found")
+    for path in paths:
+        os.remove(path)
+    artifact_registry.forget(paths)
+    return {"message": "Wordcloud deleted successfully", "deleted": paths}
 
 
-# 情感分析
-def analyze_sentiment(text):
-    analysis = TextBlob(text)
-    return 'positive' if analysis.sentiment.polarity > 0 else 'negative' if analysis.sentiment.polarity < 0 else 'neutral'
+# 情感分析结果的进程内缓存：字幕文件未变化（mtime/大小相同）时直接返回，无需重新读取
+SENTIMENT_MEMO_SIZE = 64
+_sentiment_memo = OrderedDict()
 
+# 情感分析，scorer 可选 textblob / snownlp（中文）/ auto
 @app.get("/analyze-sentiment/{filename}")
-async def analyze_subtitle(filename: str):
+async def analyze_subtitle(filename: str, scorer: str = text_analysis.DEFAULT_SENTIMENT_SCORER):
     file_path = os.path.join(TRANSCRIPT_DIR, filename + ".srt")
 
+    await run_in_threadpool(restore_transcript, filename)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Subtitle file not found")
+    if scorer not in text_analysis.SENTIMENT_SCORERS:
+        raise HTTPException(status_code=400, detail=f"Unknown sentiment scorer '{scorer}'")
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
-
-        subtitles = []
-        for i in range(0, len(lines), 3):  # 三行一循环
-            if i + 1 < len(lines):
-                time = lines[i].strip()
-                content = lines[i + 1].strip()
-
-                subtitle = {
-                    'time': time,
-                    'content': content,
-                    'sentiment': analyze_sentiment(content)
-                }
-                subtitles.append(subtitle)
-
-        # 保存 JSON 数据到文件
-        save_path = os.path.join(TRANSCRIPT_DIR, f"{filename}.json")
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        with open(save_path, 'w', encoding='utf-8') as json_file:
-            json.dump(subtitles, json_file, ensure_ascii=False, indent=4)
-
+        stat = os.stat(file_path)
+        memo_key = (file_path, stat.st_mtime_ns, stat.st_size, scorer)
+        if memo_key in _sentiment_memo and segment_store.sentiment_scorer(filename) == scorer:
+            _sentiment_memo.move_to_end(memo_key)
+            return _sentiment_memo[memo_key]
+
+        # 相同字幕已分析过时直接从缓存恢复
+        subtitles = await run_in_threadpool(run_sentiment_analysis, filename, scorer)
+        _sentiment_memo[memo_key] = subtitles
+        while len(_sentiment_memo) > SENTIMENT_MEMO_SIZE:
+            _sentiment_memo.popitem(last=False)
         return subtitles
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# 读取字幕：start/end（秒）按时间范围读取，offset/limit 按下标读取，只读取需要的部分
+# format 为 json 时返回字幕列表（包含已有的情感分析与翻译），其他格式按需从字幕存储生成
+# save=true 时同时把生成的旧格式文件写入转录目录
+@app.get("/transcript/{filename}")
+async def get_transcript(filename: str, format: str = "json", start: Optional[float] = None, end: Optional[float] = None,
+                         offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1), save: bool = False):
+    if format != "json" and format not in LEGACY_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{format}'")
+    if not await run_in_threadpool(ensure_segment_store, filename):
+        raise HTTPException(status_code=404, detail="Subtitle file not found")
+    artifact_registry.touch(segment_store.store_dir(filename))
+
+    if start is not None or end is not None:
+        lo, hi = segment_store.time_range(filename, start, end)
+    else:
+        lo, hi = 0, segment_store.count(filename)
+    lo = min(lo + offset, hi)
+    if limit is not None:
+        hi = min(hi, lo + limit)
+    segments = segment_store.read_slice(filename, lo, hi)
+
+    if save and format != "json":
+        await run_in_threadpool(export_legacy_file, filename, format)
+    if format == "json":
+        return segments
+    if format == "sentiment":
+        return segment_store.sentiment_entries(segments)
+    if format == "translation":
+        return segment_store.translation_entries(segments)
+    render = {"txt": segment_store.format_txt, "srt": segment_store.format_srt,
+              "translation_txt": segment_store.format_translation_txt}[format]
+    return Response(content=render(segments), media_type="text/plain; charset=utf-8")
+
+
 @app.get("/get-audio/{filename}")
-async def get_audio(filename: str):
-    file_path = os.path.join(AUDIO_DIR, filename+".mp3")
+async def get_audio(filename: str, request: Request):
+    file_path = audio_file_path(filename)
 
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Audio file not found")
 
-    return FileResponse(file_path)
+    return conditional_file_response(request, file_path)
 
 
 @app.post("/gpt-request")
 async def gpt_request(prompt: str, text: str):
     try:
-        data = {
-            "model": "gpt-4-1106-preview",  # 或其他适用的 GPT 模型
-            "messages": [
-                {
-                    "role": "system",
-                    "content": prompt
-                },
-                {
-                    "role": "user",
-                    "content": text
-                }
-            ]
-        }
-
-        response = requests.post(API_URL, headers={"Authorization": f"Bearer {API_KEY}"}, json=data)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"API request failed with status code {response.status_code}")
+        return await llm_client.chat_completion_response(app.state.http_client, "gpt-4-1106-preview", prompt, text)  # 或其他适用的 GPT 模型
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# 全文检索所有字幕，返回视频、时间点和高亮片段，按相关度排序
+# language 可选 en（转录原文）/ zh（中文翻译），filename 只在某个视频中检索
+@app.get("/search")
+def search_transcripts(q: str, limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0),
+                       filename: Optional[str] = None, language: Optional[str] = None):
+    results, has_more = search_index.search(q, limit, offset, filename, language)
+    return {"query": q, "results": results, "next_offset": offset + limit if has_more else None}
+
+
+# 为已有的字幕重建检索索引
+@app.post("/search/rebuild")
+async def rebuild_search(priority: int = Query(TASK_PRIORITY_DEFAULT, ge=0, le=9)):
+    try:
+        task = rebuild_search_index.apply_async(priority=priority)
+        return {"task_id": task.id}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# 派生文件按类型统计的磁盘占用
+@app.get("/storage")
+def get_storage_usage():
+    usage = artifact_registry.usage()
+    return {"kinds": usage, "total_bytes": sum(entry["bytes"] for entry in usage.values()),
+            "quota_bytes": artifact_registry.OUTPUT_QUOTA_MB * 1024 * 1024}
+
+
+# 立即执行一次磁盘配额清理（平时由 celery beat 定期执行），结果通过 /get-task-status 查询
+@app.post("/storage/enforce-quota")
+async def enforce_quota_request():
+    try:
+        task = enforce_disk_quota.delay()
+        return {"task_id": task.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# 大模型回复缓存的命中统计
+@app.get("/llm-cache/stats")
+def get_llm_cache_stats():
+    return llm_cache.stats()
+
+
 @app.get("/translate-json/{filename}")
-async def translate_json(filename: str):
+async def translate_json(filename: str, priority: int = Query(TASK_PRIORITY_DEFAULT, ge=0, le=9)):
     try:
-        task = translate_json_task.delay(filename)  # 启动后台任务
+        task = translate_json_task.apply_async((filename,), priority=priority)  # 启动后台任务
         return {"task_id": task.id}  # 返回任务 ID，用于稍后查询任务状态
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# background=true 时在 celery worker 中执行，立即返回任务 ID
 @app.get("/summarize-text/{filename}")
-async def summarize_text(filename: str):
+async def summarize_text(filename: str, background: bool = False, priority: int = Query(TASK_PRIORITY_DEFAULT, ge=0, le=9)):
     file_path = os.path.join(TRANSCRIPT_DIR, filename+".txt")
 
-    if not os.path.exists(file_path):
+    if not await run_in_threadpool(restore_transcript, filename):
         raise HTTPException(status_code=404, detail=file_path+"TXT file not found")
 
     try:
-        with open(file_path, "r", encoding="utf-8") as file:
-            text = file.read()
-
-        # 构建 GPT 请求数据
-        data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "你现在是一个文本总结接口，请使用中文总结这段文字:"
-                },
-                {
-                    "role": "user",
-                    "content": text
-                }
-            ]
-        }
-
-        response = requests.post(API_URL, headers={"Authorization": f"Bearer {API_KEY}"}, json=data)
-        if response.status_code == 200:
-            summary = response.json()['choices'][0]['message']['content']
-            return {"summary": summary}
-        else:
-            raise Exception(f"API request failed with status code {response.status_code}")
+        if background:
+            task = summarize_text_task.apply_async((filename,), priority=priority)
+            return {"task_id": task.id}
+
+        # 超长文本会按字幕分块并行总结后再归并
+        segments = await run_in_threadpool(read_transcript_segments, filename)
+        summary = await llm_client.summarize_segments(app.state.http_client, segments)
+        return {"summary": summary}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# background=true 时在 celery worker 中执行，立即返回任务 ID
 @app.get("/evaluate-speech/{filename}")
-async def evaluate_speech(filename: str):
-    file_path = os.path.join(TRANSCRIPT_DIR, filename+".txt")
-
-    if not os.path.exists(file_path):
+async def evaluate_speech(filename: str, background: bool = False, priority: int = Query(TASK_PRIORITY_DEFAULT, ge=0, le=9)):
+    if not await run_in_threadpool(restore_transcript, filename):
         raise HTTPException(status_code=404, detail="TXT file not found")
 
     try:
-        with open(file_path, "r", encoding="utf-8") as file:
-            text = file.read()
-
-        # 构建 GPT 请求数据
-        prompt = """
-        我们的评分标准包括以下几个维度：
-        内容分析：研究演讲的主题，信息的详细程度，以及其传递的核心信息和观点。也可以考察其是否涉及特定的政治、社会或文化议题。
-        语言风格：分析演讲者使用的语言特点，如词汇的选择、句式结构、修辞手法（比如比喻、反问、排比）等，以及这些元素如何影响信息的传达。
-        逻辑结构：评估演讲的组织结构，包括论点的提出、论据的支持、结论的得出，以及这些元素如何协同工作以加强演讲的说服力。
-        情感表达：分析演讲中的情感色彩，例如热情、愤怒、同情等，以及这些情感如何与听众的共鸣和反应相联系。
-        目标受众：考虑演讲是如何针对特定听众群体的需求和期望进行定制的，包括使用的语言、内容的选择以及呈现方式。
-        文化和历史背景：考虑演讲在特定的文化和历史背景下的意义，以及它如何反映或影响当时的社会环境。
-        批判性分析：从批判性角度审视演讲的内容，包括其可能的偏见、误导性陈述或遗漏的重要视角。
-        
-        您需要在每个维度上进行0到10分的打分，并给出您的中文评语
-        
-        返回格式为json，示例如下
-        
-        {
-            “内容分析”:{
-                score:,
-                comments:
-            },
-            “语言风格”:{
-                score:,
-                comments:
-            },
-            “逻辑结构”:{
-                score:,
-                comments:
-            },
-            “情感表达”:{
-                score:,
-                comments:
-            },
-            “目标受众”:{
-                score:,
-                comments:
-            },
-            “文化和历史背景”:{
-                score:,
-                comments:
-            },
-            “批判性分析”:{
-                score:,
-                comments:
-            },		
-        }
-        """
-
-        data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": prompt
-                },
-                {
-                    "role": "user",
-                    "content": text
-                }
-            ]
-        }
-
-        response = requests.post(API_URL, headers={"Authorization": f"Bearer {API_KEY}"}, json=data)
-        if response.status_code == 200:
-            evaluation_str = response.json()['choices'][0]['message']['content']
-            try:
-                # 尝试将字符串解析为 JSON 对象
-                evaluation_json = json.loads(evaluation_str)
-            except json.JSONDecodeError:
-                raise Exception("Failed to parse the evaluation string into JSON")
-
-            return {"evaluation": evaluation_json}
-        else:
-            raise Exception(f"API request failed with status code {response.status_code}")
+        if background:
+            task = evaluate_speech_task.apply_async((filename,), priority=priority)
+            return {"task_id": task.id}
+
+        # 超长文本会按字幕分块并行评分后再综合
+        segments = await run_in_threadpool(read_transcript_segments, filename)
+        evaluation_json = await llm_client.evaluate_segments(app.state.http_client, segments)
+        return {"evaluation": evaluation_json}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # 生成单个词频
+# stopwords=true 时去掉停用词与标点，top_n 只保留出现次数最多的前 N 个词
 @app.post("/generate-freq/{filename}")
-async def generate_wordcloud(filename: str):
+async def generate_freq(filename: str, stopwords: bool = False, top_n: Optional[int] = None):
     transcript_path = os.path.join(TRANSCRIPT_DIR, filename + ".txt")
     freq_path = os.path.join(WORDCLOUD_DIR, filename + "_freq.json")
 
-    if not os.path.exists(transcript_path):
+    if not await run_in_threadpool(restore_transcript, filename):
         raise HTTPException(status_code=404, detail="Transcript file not found")
 
     try:
-        # 如果词频文件存在，则直接返回该文件
-        if os.path.exists(freq_path):
+        # 如果词频文件存在且比转录文本新，并且没有指定过滤参数，则直接返回该文件
+        if not stopwords and top_n is None and os.path.exists(freq_path) \
+                and os.path.getmtime(freq_path) >= os.path.getmtime(transcript_path):
             with open(freq_path, "r", encoding="utf-8") as freq_file:
                 freq_data = json.load(freq_file)
             return freq_data
 
-        # 否则，处理文本，计算词频
-        with open(transcript_path, "r", encoding="utf-8") as file:
-            text = file.read()
-
-        # 使用jieba进行分词
-        words = jieba.cut(text)
-        word_freq = {}
-        for word in words:
-            if word not in word_freq:
-                word_freq[word] = 0
-            word_freq[word] += 1
-
-        # 保存词频数据为JSON文件
-        os.makedirs(os.path.dirname(freq_path), exist_ok=True)
-        with open(freq_path, "w", encoding="utf-8") as freq_file:
-            json.dump(word_freq, freq_file, ensure_ascii=False)
+        # 否则，从共享的分词结果生成词频，不再重复分词
+        freq_path = await run_in_threadpool(run_word_frequency, filename, stopwords, top_n)
 
         return {"message": "Word frequency data generated successfully", "frequency_file": freq_path}
     except Exception as e:
@@ -0,0 +1,124 @@
+# 批量导入整个视频归档：登记视频后由 celery worker 按并发上限处理，需要在项目根目录运行（与 worker 共用数据库和 output 目录）
+#   用法: python batch_cli.py ingest <目录或清单文件> [--stages transcribe,sentiment] [--max-in-flight 8] [--priority 5]
+#   中断后用同样的来源重新运行，会从该来源最近一个批次停止的位置继续，--new 则总是新建批次
+#   查询进度: python batch_cli.py status <batch_id>
+#   重新调度（worker 重启后或重试失败项）: python batch_cli.py resume <batch_id> [--retry-failed]
+import argparse
+import json
+import os
+import time
+
+import database
+import text_analysis
+from celery_server import collect_batch_sources, create_batch, ingest_batch_chunk, resume_batch, batch_status, \
+    TASK_PRIORITY_DEFAULT
+
+
+def print_progress(status):
+    counts = " ".join(f"{state.lower()}={count}" for state, count in sorted(status["counts"].items()))
+    print(f"[{time.strftime('%H:%M:%S')}] {status['batch_id']} {status['progress']:.1f}% ({status['total']} videos) {counts}", flush=True)
+
+
+def watch(batch_id, interval):
+    try:
+        while True:
+            status = batch_status(batch_id, failure_limit=0)
+            print_progress(status)
+            if status["finished_at"]:
+                return batch_status(batch_id)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print(f"Stopped watching; workers keep processing. Rerun or use 'status {batch_id}' to check progress.")
+        return batch_status(batch_id)
+
+
+def command_ingest(args):
+    source = os.path.abspath(args.source)
+    batch = None if args.new else database.find_latest_batch(source)
+    if batch and batch["finished_at"] and not args.retry_failed:
+        print(f"Batch {batch['id']} already finished at {batch['finished_at']}; use --retry-failed or --new")
+        return batch_status(batch["id"])
+    if batch:
+        batch_id = batch["id"]
+        print(f"Resuming batch {batch_id} created at {batch['created_at']}")
+    else:
+        sources = collect_batch_sources(source)
+        if not sources:
+            raise SystemExit(f"No videos found in {source}")
+        stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()] if args.stages else None
+        options = {"force": args.force, "model": args.model, "backend": args.backend, "scorer": args.scorer}
+        batch_id = create_batch(source, sources, stages, options, args.priority, args.max_in_flight, not args.copy)
+        print(f"Created batch {batch_id} with {len(sources)} videos")
+
+    if args.retry_failed:
+        database.retry_failed_batch_items(batch_id)
+
+    # 导入在本进程中分块完成，每块一个事务，中断后已登记的视频不会重复导入
+    total_imported = total_failed = 0
+    while True:
+        imported, failed = ingest_batch_chunk(batch_id)
+        if not imported and not failed:
+            break
+        total_imported += imported
+        total_failed += failed
+        print(f"Imported {total_imported} videos, {total_failed} failed", flush=True)
+
+    resume_batch(batch_id, ingest=False)
+    if args.no_wait:
+        return batch_status(batch_id)
+    return watch(batch_id, args.interval)
+
+
+def command_status(args):
+    status = batch_status(args.batch_id)
+    if status is None:
+        raise SystemExit(f"Batch {args.batch_id} not found")
+    return status
+
+
+def command_resume(args):
+    if database.get_batch(args.batch_id) is None:
+        raise SystemExit(f"Batch {args.batch_id} not found")
+    resume_batch(args.batch_id, retry_failed=args.retry_failed)
+    if args.no_wait:
+        return batch_status(args.batch_id)
+    return watch(args.batch_id, args.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch ingestion of video archives")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="register a directory or manifest of videos and process them")
+    ingest_parser.add_argument("source", help="directory of .mp4 files or a manifest with one path per line")
+    ingest_parser.add_argument("--stages", default=None, help="comma separated pipeline stages (default: all)")
+    ingest_parser.add_argument("--model", default=None)
+    ingest_parser.add_argument("--backend", default=None)
+    ingest_parser.add_argument("--scorer", default=text_analysis.DEFAULT_SENTIMENT_SCORER)
+    ingest_parser.add_argument("--force", action="store_true", help="rerun stages that are already up to date")
+    ingest_parser.add_argument("--priority", type=int, default=TASK_PRIORITY_DEFAULT, choices=range(10))
+    ingest_parser.add_argument("--max-in-flight", type=int, default=None, help="videos of this batch processed at the same time")
+    ingest_parser.add_argument("--copy", action="store_true", help="copy videos instead of hard linking them")
+    ingest_parser.add_argument("--new", action="store_true", help="always create a new batch")
+    ingest_parser.add_argument("--retry-failed", action="store_true", help="when resuming, retry failed videos")
+    ingest_parser.add_argument("--no-wait", action="store_true", help="return after scheduling instead of watching progress")
+    ingest_parser.add_argument("--interval", type=float, default=30, help="seconds between progress reports")
+    ingest_parser.set_defaults(func=command_ingest)
+
+    status_parser = subparsers.add_parser("status", help="show batch progress and failures")
+    status_parser.add_argument("batch_id")
+    status_parser.set_defaults(func=command_status)
+
+    resume_parser = subparsers.add_parser("resume", help="restart scheduling of a batch")
+    resume_parser.add_argument("batch_id")
+    resume_parser.add_argument("--retry-failed", action="store_true")
+    resume_parser.add_argument("--no-wait", action="store_true")
+    resume_parser.add_argument("--interval", type=float, default=30)
+    resume_parser.set_defaults(func=command_resume)
+
+    args = parser.parse_args()
+    print(json.dumps(args.func(args), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+# 性能基准测试
+# chunked: 单次转录与分段并行转录对比，需要 redis 与 celery worker 已经启动，音频文件需已存在于 output/audios 目录
+#   用法: python benchmark.py chunked <filename> [--model medium] [--chunk-seconds 300]
+# backends: 在当前进程中用不同转录后端转录同一段音频，对比实时率（转录耗时 / 音频时长）与词错误率
+#   用法: python benchmark.py backends <filename> [--backends whisper,faster-whisper] [--model small] [--reference ref.txt]
+#   未提供参考文本时以第一个后端的结果作为参考
+# sentiment: 逐行 TextBlob 与批量情感分析对比，使用合成字幕
+#   用法: python benchmark.py sentiment [--lines 10000]
+# suite: 离线运行整条处理流程的基准测试（合成音视频与字幕、本地模拟大模型接口），结果输出为 JSON 便于对比
+#   用法: python benchmark.py suite [--media-seconds 60] [--segments 1000,10000,100000] [--llm-latency-ms 200] [--output bench.json]
+#   转录使用 tiny 模型，需要事先下载到本地缓存；每个阶段在独立的子进程中运行以统计峰值内存
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 计算词错误率（编辑距离 / 参考文本词数）
+def word_error_rate(reference, hypothesis):
+    ref = reference.lower().split()
+    hyp = hypothesis.lower().split()
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def run_task(task, timeout):
+    start = time.perf_counter()
+    result = task.get(timeout=timeout)
+    return result, time.perf_counter() - start
+
+
+def read_transcript(filename):
+    from celery_server import TRANSCRIPT_DIR
+    with open(os.path.join(TRANSCRIPT_DIR, filename + ".txt"), "r", encoding="utf-8") as file:
+        return file.read()
+
+
+# 单次转录与分段并行转录的速度、准确度对比
+def bench_chunked(args):
+    from celery_server import transcribe_audio, transcribe_audio_chunked
+    single_result, single_time = run_task(transcribe_audio.delay(args.filename, args.model), args.timeout)
+    single_text = read_transcript(args.filename)
+
+    chunked_result, chunked_time = run_task(
+        transcribe_audio_chunked.delay(args.filename, args.model, args.chunk_seconds), args.timeout)
+    chunked_text = read_transcript(args.filename)
+
+    return {
+        "filename": args.filename,
+        "model": args.model,
+        "single_pass": {"wall_time": round(single_time, 3), "result": single_result},
+        "chunked": {"wall_time": round(chunked_time, 3), "result": chunked_result},
+        "speedup": round(single_time / chunked_time, 2) if chunked_time else None,
+        "wer_vs_single_pass": round(word_error_rate(single_text, chunked_text), 4)
+    }
+
+
+# 各转录后端的实时率与词错误率对比
+def bench_backends(args):
+    from whisper.audio import SAMPLE_RATE
+    from celery_server import load_audio_array, get_transcription_model, transcribe_backend_options, transcribe_with_backend
+
+    audio = load_audio_array(args.filename)
+    if args.seconds:
+        audio = audio[:int(args.seconds * SAMPLE_RATE)]
+    duration = len(audio) / SAMPLE_RATE
+
+    reference = None
+    if args.reference:
+        with open(args.reference, "r", encoding="utf-8") as file:
+            reference = file.read()
+
+    results = {}
+    for backend in [name.strip() for name in args.backends.split(",") if name.strip()]:
+        overrides = {"beam_size": args.beam_size, "vad_filter": args.vad_filter, "threads": args.threads}
+        options = transcribe_backend_options(backend, overrides)
+        load_time = get_transcription_model(backend, args.model, options)[1]
+        start = time.perf_counter()
+        text = transcribe_with_backend(audio, args.model, backend, overrides)[0]
+        transcribe_time = time.perf_counter() - start
+        if reference is None:
+            reference = text
+        results[backend] = {
+            "options": options,
+            "model_load_time": round(load_time, 3),
+            "transcribe_time": round(transcribe_time, 3),
+            "real_time_factor": round(transcribe_time / duration, 4) if duration else None,
+            "wer": round(word_error_rate(reference, text), 4)
+        }
+    return {"filename": args.filename, "model": args.model, "audio_seconds": round(duration, 2),
+            "reference": args.reference or "first backend", "backends": results}
+
+
+SAMPLE_WORDS = ("good great terrible bad happy sad the speech people country future hope fear "
+                "we will never always strong weak economy freedom challenge wonderful awful").split()
+
+
+# 生成合成字幕，部分句子重复出现，接近真实演讲中的口头禅与重复
+def synthetic_subtitles(count, seed=0):
+    rng = random.Random(seed)
+    pool = [" ".join(rng.choice(SAMPLE_WORDS) for _ in range(rng.randint(4, 16))) for _ in range(max(1, count // 2))]
+    return [rng.choice(pool) for _ in range(count)]
+
+
+# 逐行 TextBlob（原实现，极性计算两次）与批量打分对比
+def bench_sentiment(args):
+    from textblob import TextBlob
+    import text_analysis
+
+    texts = synthetic_subtitles(args.lines)
+
+    start = time.perf_counter()
+    baseline = []
+    for text in texts:
+        analysis = TextBlob(text)
+        baseline.append('positive' if analysis.sentiment.polarity > 0 else 'negative' if analysis.sentiment.polarity < 0 else 'neutral')
+    baseline_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = text_analysis.score_sentiment_batch(texts)
+    batch_time = time.perf_counter() - start
+
+    mismatches = sum(1 for label, result in zip(baseline, batch) if label != result["sentiment"])
+    return {
+        "lines": args.lines,
+        "per_line_textblob": round(baseline_time, 3),
+        "batch": round(batch_time, 3),
+        "speedup": round(baseline_time / batch_time, 2) if batch_time else None,
+        "label_mismatches": mismatches
+    }
+
+
+# ---------------- 整体流程基准测试 ----------------
+SAMPLE_CHINESE_WORDS = "我们 经济 未来 希望 人民 国家 发展 自由 挑战 团结 改革 创新 教育 科技 和平 合作".split()
+
+
+def synthetic_segments(count, seed=0, chinese_ratio=0.5):
+    rng = random.Random(seed)
+    segments = []
+    position = 0.0
+    for text in synthetic_subtitles(count, seed):
+        if rng.random() < chinese_ratio:
+            text = "".join(rng.choice(SAMPLE_CHINESE_WORDS) for _ in range(rng.randint(3, 10)))
+        duration = round(rng.uniform(1.0, 5.0), 2)
+        segments.append({"start": round(position, 2), "end": round(position + duration, 2), "text": " " + text})
+        position += duration + round(rng.uniform(0.0, 0.5), 2)
+    return segments
+
+
+# 写入合成字幕：txt/srt/jsonl 与字幕存储，和真实转录结果的格式一致
+def write_synthetic_transcript(name, segments):
+    import segment_store
+    from celery_server import TRANSCRIPT_DIR, write_transcript_files, segments_stream_path
+    os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+    write_transcript_files(os.path.join(TRANSCRIPT_DIR, name + ".txt"), os.path.join(TRANSCRIPT_DIR, name + ".srt"),
+                           "".join(segment["text"] for segment in segments), segments)
+    with open(segments_stream_path(name), "w", encoding="utf-8") as file:
+        for index, segment in enumerate(segments):
+            file.write(json.dumps(dict(segment, index=index), ensure_ascii=False) + "\n")
+    segment_store.write_segments(name, segments)
+
+
+# 合成演讲视频：有 espeak 时用语音合成，否则用间隔出现的音调模拟有停顿的语音
+def synthetic_video(path, seconds, seed=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    espeak = shutil.which("espeak-ng") or shutil.which("espeak")
+    if espeak:
+        speech_path = path + ".speech.wav"
+        text = " ".join(synthetic_subtitles(max(1, int(seconds / 4)), seed))
+        subprocess.run([espeak, "-w", speech_path, text], check=True, capture_output=True)
+        audio_input = ["-stream_loop", "-1", "-i", speech_path]
+    else:
+        speech_path = None
+        frequency = 180 + seed % 1000 / 10
+        audio_input = ["-f", "lavfi", "-i", f"aevalsrc=0.3*sin(2*PI*{frequency}*t)*gt(mod(t\\,4)\\,1):s=16000:d={seconds}"]
+    command = ["ffmpeg", "-nostdin", "-y", "-loglevel", "error",
+               "-f", "lavfi", "-i", f"color=c=black:s=320x240:r=10:d={seconds}"] + audio_input + \
+              ["-t", str(seconds), "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest", path]
+    subprocess.run(command, check=True, capture_output=True)
+    if speech_path:
+        os.remove(speech_path)
+
+
+# 本地模拟的大模型接口：返回 OpenAI 格式的响应，翻译批量请求按 id 逐行返回
+class MockLLMHandler(BaseHTTPRequestHandler):
+    latency = 0.2
+    jitter = 0.0
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))))
+        user_content = data["messages"][-1]["content"]
+        if data.get("response_format", {}).get("type") == "json_object":
+            try:
+                lines = json.loads(user_content)["lines"]
+                content = json.dumps({"translations": [{"id": line["id"], "text": "译文" + line["text"][:20]} for line in lines]},
+                                     ensure_ascii=False)
+            except (ValueError, KeyError):
+                content = "{}"
+        else:
+            content = "模拟回复：" + user_content[:40]
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        body = json.dumps({
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": len(user_content) // 4, "completion_tokens": len(content) // 4}
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_llm_server(latency, jitter):
+    MockLLMHandler.latency = latency
+    MockLLMHandler.jitter = jitter
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockLLMHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def current_rss_mb():
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+# 在子进程中执行一个阶段的所有轮次，峰值内存只反映该阶段（ffmpeg 等子进程单独统计）
+def _stage_worker(run, jobs, queue):
+    try:
+        baseline = current_rss_mb()
+        latencies, units = [], 0
+        for job in jobs:
+            start = time.perf_counter()
+            units += run(job)
+            latencies.append(time.perf_counter() - start)
+        queue.put({
+            "latencies": latencies,
+            "units": units,
+            "baseline_rss_mb": round(baseline, 1),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "peak_child_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+        })
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def run_stage(run, jobs, unit):
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=_stage_worker, args=(run, jobs, queue))
+    wall_start = time.perf_counter()
+    process.start()
+    result = queue.get()
+    process.join()
+    wall_time = time.perf_counter() - wall_start
+    if "error" in result:
+        return result
+
+    latencies = result.pop("latencies")
+    busy = sum(latencies)
+    return dict(result, **{
+        "iterations": len(latencies),
+        "unit": unit,
+        "units": result.pop("units"),
+        "throughput_per_s": round(result["units"] / busy, 3) if busy else None,
+        "latency_p50_s": round(percentile(latencies, 50), 4),
+        "latency_p99_s": round(percentile(latencies, 99), 4),
+        "latency_mean_s": round(busy / len(latencies), 4),
+        "wall_time_s": round(wall_time, 3)
+    })
+
+
+def bench_suite(args):
+    output_path = os.path.abspath(args.output) if args.output else None
+    workdir = os.path.abspath(args.workdir)
+    if args.clean and os.path.isdir(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(workdir, exist_ok=True)
+
+    server = start_mock_llm_server(args.llm_latency_ms / 1000, args.llm_jitter_ms / 1000)
+    # 必须在导入项目模块之前设置：数据库、缓存与输出目录都在工作目录下，大模型请求发往本地模拟接口，关闭回复缓存与限速
+    os.environ.update({
+        "api_url": f"http://127.0.0.1:{server.server_port}/v1/chat/completions",
+        "api_key": "benchmark",
+        "llm_cache_enabled": "0",
+        "llm_tokens_per_minute": "0",
+        "whisper_model": args.whisper_model,
+        "whisper_preload_models": "",
+    })
+    os.chdir(workdir)
+
+    import segment_store
+    import text_analysis
+    from celery_server import VIDEO_DIR, extract_audio_task, run_transcription, run_sentiment_analysis, \
+        run_word_frequency, render_wordcloud_task, run_translation
+    if not os.path.exists(text_analysis.WORDCLOUD_FONT_PATH or ""):
+        text_analysis.WORDCLOUD_FONT_PATH = None  # 使用 wordcloud 自带字体
+
+    sizes = [int(size) for size in args.segments.split(",") if size]
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "func"},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "stages": {}
+    }
+
+    # 合成数据：每一轮、每次运行使用不同内容，避免命中产物缓存；指定 --seed 可复现同一组数据
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    report["config"]["seed"] = seed
+    media_jobs = [f"bench_media_{seed}_{i}" for i in range(args.iterations)]
+    for i, name in enumerate(media_jobs):
+        synthetic_video(os.path.join(VIDEO_DIR, name + ".mp4"), args.media_seconds, seed=seed + i)
+    transcript_jobs = {}
+    for size in sizes:
+        transcript_jobs[size] = []
+        for i in range(args.iterations):
+            name = f"bench_transcript_{seed}_{size}_{i}"
+            write_synthetic_transcript(name, synthetic_segments(size, seed=seed + size * 1000 + i))
+            transcript_jobs[size].append(name)
+
+    def extract(name):
+        extract_audio_task(name)
+        return args.media_seconds
+
+    def transcribe(name):
+        run_transcription(name, args.whisper_model)
+        return args.media_seconds
+
+    stages = report["stages"]
+    stages["extract_audio"] = run_stage(extract, media_jobs, "audio_seconds")
+    if not args.skip_transcription:
+        stages["transcription"] = run_stage(transcribe, media_jobs, "audio_seconds")
+
+    for size in sizes:
+        jobs = transcript_jobs[size]
+        stages[f"sentiment@{size}"] = run_stage(lambda name: len(run_sentiment_analysis(name)), jobs, "segments")
+        stages[f"word_frequency@{size}"] = run_stage(lambda name: run_word_frequency(name) and segment_store.count(name), jobs, "segments")
+        stages[f"wordcloud@{size}"] = run_stage(lambda name: render_wordcloud_task(name) and 1, jobs, "images")
+        if size <= args.translate_max_segments:
+            stages[f"translation@{size}"] = run_stage(lambda name: run_translation(name)["translated"], jobs, "segments")
+
+    server.shutdown()
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Visible Speech System benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    chunked_parser = subparsers.add_parser("chunked", help="single-pass vs chunked transcription")
+    chunked_parser.add_argument("filename")
+    chunked_parser.add_argument("--model", default=None)
+    chunked_parser.add_argument("--chunk-seconds", type=float, default=300)
+    chunked_parser.add_argument("--timeout", type=float, default=4 * 3600)
+    chunked_parser.set_defaults(func=bench_chunked)
+
+    backends_parser = subparsers.add_parser("backends", help="real-time factor and WER across transcription backends")
+    backends_parser.add_argument("filename")
+    backends_parser.add_argument("--backends", default="whisper,faster-whisper")
+    backends_parser.add_argument("--model", default=None)
+    backends_parser.add_argument("--reference", default=None, help="reference transcript for WER")
+    backends_parser.add_argument("--seconds", type=float, default=0, help="only use the first N seconds of audio")
+    backends_parser.add_argument("--beam-size", type=int, default=None)
+    backends_parser.add_argument("--vad-filter", type=lambda v: v.lower() in ("1", "true", "yes"), default=None)
+    backends_parser.add_argument("--threads", type=int, default=None)
+    backends_parser.set_defaults(func=bench_backends)
+
+    suite_parser = subparsers.add_parser("suite", help="offline end-to-end pipeline benchmark with synthetic data")
+    suite_parser.add_argument("--workdir", default="bench_workdir", help="scratch directory for media, database and caches")
+    suite_parser.add_argument("--clean", action="store_true", help="remove the work directory before running")
+    suite_parser.add_argument("--output", default=None, help="also write the JSON report to this file")
+    suite_parser.add_argument("--iterations", type=int, default=3)
+    suite_parser.add_argument("--seed", type=int, default=None, help="fixed seed for the synthetic data (caches will hit on reruns)")
+    suite_parser.add_argument("--media-seconds", type=int, default=60)
+    suite_parser.add_argument("--segments", default="1000,10000", help="comma separated synthetic transcript sizes")
+    suite_parser.add_argument("--translate-max-segments", type=int, default=10000, help="skip translation for larger transcripts")
+    suite_parser.add_argument("--whisper-model", default="tiny")
+    suite_parser.add_argument("--skip-transcription", action="store_true")
+    suite_parser.add_argument("--llm-latency-ms", type=float, default=200)
+    suite_parser.add_argument("--llm-jitter-ms", type=float, default=50)
+    suite_parser.set_defaults(func=bench_suite)
+
+    sentiment_parser = subparsers.add_parser("sentiment", help="per-line vs batch sentiment analysis")
+    sentiment_parser.add_argument("--lines", type=int, default=10000)
+    sentiment_parser.set_defaults(func=bench_sentiment)
+
+    args = parser.parse_args()
+    print(json.dumps(args.func(args), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,33 @@
-from celery import Celery
+from celery import Celery, chain, chord, group
+from celery.signals import worker_process_init, worker_process_shutdown, worker_init, before_task_publish, task_prerun, task_postrun
+from kombu import Queue
 import whisper
+from whisper.audio import SAMPLE_RATE
+import numpy as np
+from PIL import Image
 import os
+import gc
+import shutil
+import subprocess
+import hashlib
+import wave
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from uuid import uuid4
 from pathlib import Path
 from dotenv import load_dotenv
 import json
-import requests
+import asyncio
+import artifact_cache
+import artifact_registry
+import database
+import llm_client
+import metrics
+import search_index
+import segment_store
+import text_analysis
 
 CELERY_BROKER_URL = "redis://localhost:6379/0"  # 您的 Redis 服务器地址
 CELERY_RESULT_BACKEND = "redis://localhost:6379/0"
@@ -13,105 +36,1493 @@ celery_app = Celery('tasks', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BAC
 
 # 加载环境变量
 load_dotenv()  # 加载 .env 文件中的变量
-API_KEY = os.getenv("api_key")  # 从环境变量读取 API 密钥
-API_URL = os.getenv("api_url")  # 从环境变量读取 API URL
 
+# 任务队列：耗时的 Whisper 转录、ffmpeg/词云等本地计算、大模型请求（I/O 密集）与其他轻量任务分开，
+# 由不同的 worker 消费，短任务不会排在长时间的转录后面
+TRANSCRIPTION_QUEUE = "transcription"
+MEDIA_QUEUE = "media"
+LLM_QUEUE = "llm"
+DEFAULT_QUEUE = "default"
 
+TASK_PRIORITY_DEFAULT = 5  # 优先级 0~9，Redis 作为 broker 时数字越小越先执行
+TRANSCRIBE_TIME_LIMIT = int(os.getenv("transcribe_time_limit", str(4 * 3600)))  # 转录任务硬超时（秒）
+MEDIA_TIME_LIMIT = int(os.getenv("media_time_limit", "1800"))  # ffmpeg/词云任务硬超时（秒）
+LLM_TIME_LIMIT = int(os.getenv("llm_time_limit", "900"))  # 大模型任务硬超时（秒）
+WORKER_MAX_TASKS_PER_CHILD = int(os.getenv("worker_max_tasks_per_child", "0"))  # 子进程执行多少个任务后重启，0 表示不限制
+WORKER_MAX_MEMORY_PER_CHILD_MB = int(os.getenv("worker_max_memory_per_child_mb", "0"))  # 子进程常驻内存超过该值后重启，0 表示不限制
+
+# 流水线各阶段按执行内容分配到对应队列，由该队列的阶段任务执行（见 pipeline_stage_task）
+PIPELINE_STAGE_QUEUES = {
+    "transcribe": TRANSCRIPTION_QUEUE,
+    "translate": LLM_QUEUE,
+    "summary": LLM_QUEUE,
+}
+
+
+celery_app.conf.update(
+    task_queues=[Queue(name) for name in (TRANSCRIPTION_QUEUE, MEDIA_QUEUE, LLM_QUEUE, DEFAULT_QUEUE)],
+    task_default_queue=DEFAULT_QUEUE,
+    task_default_priority=TASK_PRIORITY_DEFAULT,
+    task_inherit_parent_priority=True,  # 链式任务的后续步骤沿用发起请求的优先级
+    # Redis 没有原生优先级，按优先级拆分为多个列表模拟
+    broker_transport_options={"priority_steps": list(range(10)), "sep": ":", "queue_order_strategy": "priority"},
+    # 每个子进程一次只预取一个任务，避免一个 worker 囤积多个长时间转录
+    worker_prefetch_multiplier=int(os.getenv("worker_prefetch_multiplier", "1")),
+    worker_max_tasks_per_child=WORKER_MAX_TASKS_PER_CHILD or None,
+    worker_max_memory_per_child=WORKER_MAX_MEMORY_PER_CHILD_MB * 1024 or None,
+)
+
+# 各类任务的公共参数；计算任务在执行完成后才确认，worker 崩溃时任务会重新投递
+TRANSCRIPTION_TASK_OPTIONS = {"queue": TRANSCRIPTION_QUEUE, "acks_late": True, "reject_on_worker_lost": True,
+                              "time_limit": TRANSCRIBE_TIME_LIMIT, "soft_time_limit": TRANSCRIBE_TIME_LIMIT - 60}
+MEDIA_TASK_OPTIONS = {"queue": MEDIA_QUEUE, "acks_late": True, "reject_on_worker_lost": True,
+                      "time_limit": MEDIA_TIME_LIMIT, "soft_time_limit": MEDIA_TIME_LIMIT - 30}
+LLM_TASK_OPTIONS = {"queue": LLM_QUEUE, "time_limit": LLM_TIME_LIMIT, "soft_time_limit": LLM_TIME_LIMIT - 30}
+
+
+VIDEO_DIR = "output/videos"
 AUDIO_DIR = "output/audios"
 TRANSCRIPT_DIR = "output/transcripts"
-AUDIO_DIR = "output/audios"
 WORDCLOUD_DIR = "output/wordclouds"    # 词云图像保存目录
+MASK_DIR = "output/masks"  # 词云形状蒙版图片目录
+PREVIEW_DIR = "output/previews"  # 低码率预览视频目录
 TRANSLATED_DIR = "output/translated"  # 翻译文件目录
+CHUNK_DIR = "output/chunks"  # 分段转录时的临时音频片段目录
+
+# Whisper 模型配置
+WHISPER_DEFAULT_MODEL = os.getenv("whisper_model", "medium")  # 默认模型尺寸
+WHISPER_PRELOAD_MODELS = [size.strip() for size in os.getenv("whisper_preload_models", WHISPER_DEFAULT_MODEL).split(",") if size.strip()]  # 子进程启动时预加载的模型
+WHISPER_MAX_LOADED_MODELS = int(os.getenv("whisper_max_loaded_models", "2"))  # 每个子进程最多同时驻留的模型数
+WHISPER_MODEL_MEMORY_LIMIT_MB = int(os.getenv("whisper_model_memory_limit_mb", "0"))  # 驻留模型的内存上限，0 表示不限制
+WHISPER_MODEL_IDLE_SECONDS = int(os.getenv("whisper_model_idle_seconds", "0"))  # 模型空闲多久后释放，0 表示不释放
+WORDCLOUD_THUMBNAIL_SIZES = [tuple(int(v) for v in size.split("x")) for size in os.getenv("wordcloud_thumbnail_sizes", "200x150").split(",") if size]  # 词云缩略图尺寸
+WORDCLOUD_MAX_WORDS = 200
+STREAM_WINDOW_SECONDS = float(os.getenv("stream_window_seconds", "0"))  # 流式转录时每个窗口的目标长度，默认 0 整段一次转录；设为正数时按静音切窗口逐段输出
+
+
+TRANSCRIBE_BACKEND = os.getenv("transcribe_backend", "whisper")  # 默认转录后端：whisper（PyTorch）或 faster-whisper（CTranslate2 int8）
+
+# 各转录后端的默认参数，每个任务可以单独覆盖
+# beam_size 为 0 时使用贪心解码，threads 为 0 时使用库的默认线程数
+TRANSCRIBE_BACKEND_OPTIONS = {
+    "whisper": {
+        "beam_size": int(os.getenv("whisper_beam_size", "0")),
+        "vad_filter": False,  # openai-whisper 没有 VAD，忽略该参数
+        "threads": int(os.getenv("whisper_threads", "0")),
+    },
+    "faster-whisper": {
+        "beam_size": int(os.getenv("faster_whisper_beam_size", "5")),
+        "vad_filter": os.getenv("faster_whisper_vad_filter", "1") != "0",
+        "threads": int(os.getenv("faster_whisper_threads", "0")),
+        "compute_type": os.getenv("faster_whisper_compute_type", "int8"),
+    },
+}
+
+
+def _whisper_load(size, options):
+    if size not in whisper.available_models():
+        raise ValueError(f"Unknown whisper model '{size}'")
+    return whisper.load_model(size)
+
+
+def _whisper_transcribe(model, audio, options, initial_prompt=None):
+    if options["threads"]:
+        import torch
+        torch.set_num_threads(options["threads"])
+    decode_options = {"beam_size": options["beam_size"]} if options["beam_size"] else {}
+    result = model.transcribe(audio, language="English", initial_prompt=initial_prompt, **decode_options)
+    segments = [{"start": segment["start"], "end": segment["end"], "text": segment["text"]} for segment in result["segments"]]
+    return result["text"], segments
+
+
+# CTranslate2 int8 量化推理，CPU 上通常比 PyTorch FP32 快数倍
+def _faster_whisper_load(size, options):
+    from faster_whisper import WhisperModel
+    return WhisperModel(size, device="cpu", compute_type=options["compute_type"], cpu_threads=options["threads"])
+
+
+def _faster_whisper_transcribe(model, audio, options, initial_prompt=None):
+    result, _ = model.transcribe(audio, language="en", beam_size=options["beam_size"] or 1,
+                                 vad_filter=options["vad_filter"], initial_prompt=initial_prompt)
+    segments = [{"start": segment.start, "end": segment.end, "text": segment.text} for segment in result]
+    return "".join(segment["text"] for segment in segments), segments
+
+
+# 可插拔的转录后端：load(size, options) 返回模型，transcribe(model, audio, options, initial_prompt) 返回 (全文, 字幕列表)
+# load_options 为影响模型加载的参数，参数不同的模型分别缓存
+TRANSCRIBE_BACKENDS = {
+    "whisper": {"load": _whisper_load, "transcribe": _whisper_transcribe, "load_options": ()},
+    "faster-whisper": {"load": _faster_whisper_load, "transcribe": _faster_whisper_transcribe,
+                       "load_options": ("compute_type", "threads")},
+}
+
+
+def register_transcribe_backend(name, load, transcribe, defaults, load_options=()):
+    TRANSCRIBE_BACKENDS[name] = {"load": load, "transcribe": transcribe, "load_options": tuple(load_options)}
+    TRANSCRIBE_BACKEND_OPTIONS[name] = dict(defaults)
+
+
+# 合并后端默认参数与任务指定的参数，值为 None 的参数沿用默认值
+def transcribe_backend_options(backend, overrides=None):
+    if backend not in TRANSCRIBE_BACKENDS:
+        raise ValueError(f"Unknown transcription backend '{backend}'")
+    options = dict(TRANSCRIBE_BACKEND_OPTIONS[backend])
+    options.update({key: value for key, value in (overrides or {}).items() if value is not None and key in options})
+    return options
+
+
+# 每个 worker 子进程内的模型缓存，按最近使用顺序排列
+_loaded_models = OrderedDict()
+_models_lock = threading.Lock()
+_idle_reaper_started = False
+_models_in_use = 0  # 正在转录的调用数，由 transcribe_with_backend 维护，与模型缓存共用 _models_lock
+
+
+def _model_size_bytes(model):
+    # CTranslate2 模型不暴露参数，按 0 计，不参与内存上限的计算
+    if not hasattr(model, "parameters"):
+        return 0
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+def _release_model(key):
+    entry = _loaded_models.pop(key)
+    del entry["model"]
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+    print(f"transcription model '{key}' released")
+
+
+def _evict_idle_models(keep=None):
+    now = time.time()
+    for key in list(_loaded_models):
+        if key != keep and now - _loaded_models[key]["last_used"] > WHISPER_MODEL_IDLE_SECONDS:
+            _release_model(key)
+
+
+def _evict_models(keep):
+    if WHISPER_MODEL_IDLE_SECONDS > 0:
+        _evict_idle_models(keep)
+
+    limit_bytes = WHISPER_MODEL_MEMORY_LIMIT_MB * 1024 * 1024
+    while len(_loaded_models) > 1:
+        total_bytes = sum(entry["bytes"] for entry in _loaded_models.values())
+        over_count = len(_loaded_models) > WHISPER_MAX_LOADED_MODELS
+        over_memory = limit_bytes > 0 and total_bytes > limit_bytes
+        if not (over_count or over_memory):
+            break
+        # 淘汰最久未使用、且不是本次请求的模型
+        victim = next(key for key in _loaded_models if key != keep)
+        _release_model(victim)
+
+
+# 后台线程定期释放空闲超时的模型，worker 长时间没有新任务时也能归还显存/内存；有模型正在转录时不释放
+def _idle_reaper():
+    while True:
+        time.sleep(min(WHISPER_MODEL_IDLE_SECONDS, 60))
+        with _models_lock:
+            if _models_in_use == 0:
+                _evict_idle_models()
+
+
+def _start_idle_reaper():
+    global _idle_reaper_started
+    if WHISPER_MODEL_IDLE_SECONDS > 0 and not _idle_reaper_started:
+        _idle_reaper_started = True
+        threading.Thread(target=_idle_reaper, name="whisper-idle-reaper", daemon=True).start()
+
+
+def _model_key(backend, size, options):
+    return ":".join([backend, size] + [str(options[name]) for name in TRANSCRIBE_BACKENDS[backend]["load_options"]])
+
+
+# 获取已加载的模型，未加载时才从磁盘读取；acquire=True 时同时登记为正在使用，用完后调用 _finish_model_use
+# 返回 (model, 加载耗时秒数, 是否命中缓存)
+def get_transcription_model(backend=None, size=None, options=None, acquire=False):
+    global _models_in_use
+    backend = backend or TRANSCRIBE_BACKEND
+    size = size or WHISPER_DEFAULT_MODEL
+    options = options or transcribe_backend_options(backend)
+    spec = TRANSCRIBE_BACKENDS[backend]
+    key = _model_key(backend, size, options)
+
+    with _models_lock:
+        entry = _loaded_models.get(key)
+        cache_hit = entry is not None
+        load_time = 0.0
+        if not cache_hit:
+            start = time.perf_counter()
+            model = spec["load"](size, options)
+            load_time = time.perf_counter() - start
+            metrics.MODEL_LOAD_SECONDS.labels(backend, size).observe(load_time)
+            entry = {"model": model, "bytes": _model_size_bytes(model), "load_time": load_time}
+            _loaded_models[key] = entry
+            print(f"transcription model '{key}' loaded in {load_time:.2f}s")
+        entry["last_used"] = time.time()
+        _loaded_models.move_to_end(key)
+        _evict_models(keep=key)
+        _start_idle_reaper()
+        if acquire:
+            _models_in_use += 1
+        return entry["model"], load_time, cache_hit
+
+
+# 用指定后端转录一段音频，返回 (全文, 字幕列表)，同时返回模型加载信息
+def transcribe_with_backend(audio, model_size=None, backend=None, backend_options=None, initial_prompt=None):
+    backend = backend or TRANSCRIBE_BACKEND
+    options = transcribe_backend_options(backend, backend_options)
+    model, load_time, cache_hit = get_transcription_model(backend, model_size, options, acquire=True)
+    try:
+        text, segments = TRANSCRIBE_BACKENDS[backend]["transcribe"](model, audio, options, initial_prompt)
+    finally:
+        _finish_model_use(_model_key(backend, model_size or WHISPER_DEFAULT_MODEL, options))
+    return text, segments, load_time, cache_hit
+
+
+# 转录结束：空闲时间从用完时开始计算
+def _finish_model_use(key):
+    global _models_in_use
+    with _models_lock:
+        _models_in_use -= 1
+        if key in _loaded_models:
+            _loaded_models[key]["last_used"] = time.time()
+
+
+# 转录结果的缓存参数；默认后端的参数保持原样，已有缓存仍然有效
+def transcription_cache_params(model_size, backend=None, backend_options=None, **params):
+    backend = backend or TRANSCRIBE_BACKEND
+    options = transcribe_backend_options(backend, backend_options)
+    cache_params = dict({"model": model_size or WHISPER_DEFAULT_MODEL, "language": "English"}, **params)
+    if backend != "whisper" or options["beam_size"]:
+        cache_params["backend"] = backend
+        # 线程数不影响结果
+        cache_params.update({key: value for key, value in options.items() if key != "threads"})
+    return cache_params
+
+
+# worker 是否消费转录队列；未指定 -Q 时消费所有队列
+def consumes_transcription_queue():
+    consume_from = celery_app.amqp.queues.consume_from
+    return not consume_from or TRANSCRIPTION_QUEUE in consume_from
+
+
+# worker 子进程启动时加载 jieba 词典，并在转录 worker 上预加载常用模型，避免第一个任务承担加载时间
+# media/llm/default worker 不执行转录，不加载模型，否则按内存上限回收子进程后每次都要重新加载
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    metrics.init_tracing("celery-worker", celery=True)
+    text_analysis.init_jieba()
+    if not consumes_transcription_queue():
+        return
+    for size in WHISPER_PRELOAD_MODELS:
+        try:
+            get_transcription_model(TRANSCRIBE_BACKEND, size)
+        except Exception as e:
+            print(f"failed to preload {TRANSCRIBE_BACKEND} model '{size}': {e}")
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    metrics.mark_process_dead(os.getpid())
+
+
+# worker 主进程启动时开启指标端口
+@worker_init.connect
+def init_worker(**kwargs):
+    metrics.start_worker_server()
+
+
+# ---------------- 任务指标 ----------------
+# 发布任务时在消息头记录发布时间，开始执行时据此计算排队等待时间
+_task_started = {}
+
+
+@before_task_publish.connect
+def record_publish_time(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault("published_at", time.time())
+
+
+def _task_queue(task):
+    delivery_info = task.request.delivery_info or {}
+    return delivery_info.get("routing_key") or task.queue or DEFAULT_QUEUE
+
+
+@task_prerun.connect
+def record_task_start(task_id=None, task=None, **kwargs):
+    queue = _task_queue(task)
+    published_at = getattr(task.request, "published_at", None)
+    if published_at:
+        metrics.TASK_QUEUE_WAIT_SECONDS.labels(task.name, queue).observe(max(0.0, time.time() - published_at))
+    _task_started[task_id] = (time.perf_counter(), queue)
+
+
+@task_postrun.connect
+def record_task_end(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is None:
+        return
+    start, queue = started
+    metrics.TASK_RUN_SECONDS.labels(task.name, queue, state or "UNKNOWN").observe(time.perf_counter() - start)
+    metrics.TASKS_TOTAL.labels(task.name, state or "UNKNOWN").inc()
+    if state == "SUCCESS" and task.name in ARTIFACT_TASK_FILENAME_ARGS:
+        register_task_artifacts(task.name, kwargs.get("args") or (), kwargs.get("kwargs") or {})
+
+
+# 生成派生文件的任务及其视频文件名参数的位置，任务成功后登记该视频的派生文件
+ARTIFACT_TASK_FILENAME_ARGS = {
+    "celery_server.extract_audio_task": 0,
+    "celery_server.render_preview_task": 0,
+    "celery_server.transcribe_audio": 0,
+    "celery_server.merge_chunk_transcripts": 1,
+    "celery_server.render_wordcloud_task": 0,
+    "celery_server.translate_json_task": 0,
+    "celery_server.run_pipeline_stage": 2,
+    "celery_server.run_media_pipeline_stage": 2,
+    "celery_server.run_llm_pipeline_stage": 2,
+}
+
+
+def register_task_artifacts(task_name, args, kwargs):
+    position = ARTIFACT_TASK_FILENAME_ARGS[task_name]
+    filename = args[position] if len(args) > position else kwargs.get("filename")
+    if not filename:
+        return
+    try:
+        artifact_registry.register_video(filename)
+    except Exception as e:
+        print(f"failed to register artifacts of {filename}: {e}")
+
+
+# 音频文件路径：优先使用提取出的 16kHz PCM wav，兼容旧版本提取的 mp3
+def audio_file_path(filename):
+    wav_path = os.path.join(AUDIO_DIR, filename + '.wav')
+    if os.path.exists(wav_path):
+        return wav_path
+    return os.path.join(AUDIO_DIR, filename + '.mp3')
+
+
+# 读取音频为 whisper 使用的 float32 数组；wav 已是 16kHz 单声道 PCM，直接读取无需再经 ffmpeg 解码
+def load_audio_array(filename):
+    audio_path = audio_file_path(filename)
+    if audio_path.endswith('.wav'):
+        with wave.open(audio_path, "rb") as wav_file:
+            if wav_file.getframerate() == SAMPLE_RATE and wav_file.getnchannels() == 1 and wav_file.getsampwidth() == 2:
+                pcm = wav_file.readframes(wav_file.getnframes())
+                return np.frombuffer(pcm, np.int16).astype(np.float32) / 32768.0
+    return whisper.load_audio(audio_path)
+
+
+# 提取视频中的音频：ffmpeg 直接把音频流解码为 16kHz 单声道 PCM，不再经过 mp3 编码再解码
+@celery_app.task(**MEDIA_TASK_OPTIONS)
+def extract_audio_task(filename: str):
+    video_path = os.path.join(VIDEO_DIR, filename + ".mp4")
+    audio_path = os.path.join(AUDIO_DIR, filename + '.wav')
+    temp_path = audio_path + ".part"
+    os.makedirs(AUDIO_DIR, exist_ok=True)
+
+    # 相同内容的视频已经提取过音频时直接从缓存恢复
+    content_hash = artifact_cache.video_content_hash(filename)
+    cache_params = {"format": "wav", "sample_rate": SAMPLE_RATE}
+    if artifact_cache.fetch(content_hash, "audio", cache_params, {"audio.wav": audio_path}):
+        database.set_video_state(filename, audio_ready=True)
+        return {"audio_file": audio_path, "cached": True}
+
+    command = [
+        "ffmpeg", "-nostdin", "-y", "-loglevel", "error",
+        "-i", video_path,
+        "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-acodec", "pcm_s16le",
+        "-f", "wav", temp_path
+    ]
+    with metrics.timed(metrics.MEDIA_COMMAND_SECONDS, kind="extract_audio"):
+        process = subprocess.run(command, capture_output=True)
+    if process.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise RuntimeError(f"ffmpeg failed: {process.stderr.decode('utf-8', errors='ignore').strip()}")
+    os.replace(temp_path, audio_path)
+    artifact_cache.store(content_hash, "audio", cache_params, {"audio.wav": audio_path})
+    database.set_video_state(filename, audio_ready=True)
+
+    return {"audio_file": audio_path}
+
+
+# 预览视频路径，filename 为完整的视频文件名
+def preview_file_path(filename):
+    return os.path.join(PREVIEW_DIR, os.path.splitext(filename)[0] + "_preview.mp4")
+
+
+# 转码生成 360p 低码率预览视频，moov 前置以便浏览器边下边播
+@celery_app.task(**MEDIA_TASK_OPTIONS)
+def render_preview_task(filename: str):
+    video_path = os.path.join(VIDEO_DIR, filename)
+    preview_path = preview_file_path(filename)
+    temp_path = preview_path + ".part"
+    os.makedirs(PREVIEW_DIR, exist_ok=True)
+
+    content_hash = artifact_cache.video_content_hash(filename)
+    cache_params = {"height": 360, "crf": 30, "audio_bitrate": "64k"}
+    if artifact_cache.fetch(content_hash, "preview", cache_params, {"preview.mp4": preview_path}):
+        return {"preview_file": preview_path, "cached": True}
+
+    command = [
+        "ffmpeg", "-nostdin", "-y", "-loglevel", "error",
+        "-i", video_path,
+        "-vf", "scale=-2:360", "-c:v", "libx264", "-preset", "veryfast", "-crf", "30",
+        "-c:a", "aac", "-b:a", "64k", "-ac", "1",
+        "-movflags", "+faststart", "-f", "mp4", temp_path
+    ]
+    with metrics.timed(metrics.MEDIA_COMMAND_SECONDS, kind="preview"):
+        process = subprocess.run(command, capture_output=True)
+    if process.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise RuntimeError(f"ffmpeg failed: {process.stderr.decode('utf-8', errors='ignore').strip()}")
+    os.replace(temp_path, preview_path)
+    artifact_cache.store(content_hash, "preview", cache_params, {"preview.mp4": preview_path})
+
+    return {"preview_file": preview_path}
+
+
+# 提取音频后直接转录，返回的任务 ID 即整条流水线最后一步的 ID
+def extract_and_transcribe(filename, model_size=None, priority=None, backend=None):
+    return chain(extract_audio_task.si(filename), transcribe_audio.si(filename, model_size, backend=backend)).apply_async(priority=priority)
+
+
+# 将字幕写入 srt 文件
+def write_srt_segments(srt_file, segments):
+    for segment in segments:
+        start = segment["start"]
+        end = segment["end"]
+        text = segment["text"]
+        srt_file.write(f"{start} --> {end}\n{text}\n\n")
+
+
+# 写出 txt 与 srt 转录文件
+def write_transcript_files(txt_path, srt_path, text, segments):
+    # 确保存储转录文件的目录存在
+    Path(os.path.dirname(txt_path)).mkdir(parents=True, exist_ok=True)
+    Path(os.path.dirname(srt_path)).mkdir(parents=True, exist_ok=True)
+
+    with open(txt_path, "w", encoding='utf-8') as txt_file:
+        txt_file.write(text)
+
+    with open(srt_path, "w", encoding='utf-8') as srt_file:
+        write_srt_segments(srt_file, segments)
+
+
+# 流式转录时逐段写出的字幕文件，每行一个 JSON，供 SSE 接口增量读取
+def segments_stream_path(filename):
+    return os.path.join(TRANSCRIPT_DIR, filename + '.segments.jsonl')
+
+
+# 旧的转录结果没有按列存储的字幕：优先读取逐段写出的 jsonl，其次解析 srt
+def _legacy_timed_segments(filename):
+    segments_path = segments_stream_path(filename)
+    if os.path.exists(segments_path):
+        with open(segments_path, "r", encoding="utf-8") as segments_file:
+            return [json.loads(line) for line in segments_file if line.strip()]
+    entries = text_analysis.read_srt_entries(os.path.join(TRANSCRIPT_DIR, filename + '.srt'))
+    return search_index.entries_to_segments(entries)
+
+
+# 确保字幕存储存在且不旧于 jsonl/srt，旧数据在第一次读取时转换；没有任何带时间的字幕时返回 False
+def ensure_segment_store(filename):
+    sources = [path for path in (segments_stream_path(filename), os.path.join(TRANSCRIPT_DIR, filename + '.srt'))
+               if os.path.exists(path)]
+    if segment_store.exists(filename):
+        store_mtime = os.path.getmtime(segment_store.column_path(filename, "start.npy"))
+        if all(os.path.getmtime(path) <= store_mtime for path in sources):
+            return True
+    if not sources:
+        return False
+    segment_store.write_segments(filename, _legacy_timed_segments(filename))
+    return True
+
+
+# 长期未访问的转录文本会被压缩，读取前先解压；返回 txt 是否存在
+def restore_transcript(filename):
+    artifact_registry.restore(os.path.join(TRANSCRIPT_DIR, filename + '.srt'))
+    return artifact_registry.restore(os.path.join(TRANSCRIPT_DIR, filename + '.txt'))
+
+
+# 按字幕分段读取转录文本，没有分段信息时退回整段 txt
+def read_transcript_segments(filename):
+    restore_transcript(filename)
+    if ensure_segment_store(filename):
+        return segment_store.texts(filename)
+    with open(os.path.join(TRANSCRIPT_DIR, filename + '.txt'), "r", encoding="utf-8") as txt_file:
+        return [txt_file.read()]
+
+
+# 读取带起止时间的字幕，包含已有的情感分析与翻译
+def read_timed_segments(filename, start=None, end=None):
+    if not ensure_segment_store(filename):
+        return []
+    return segment_store.read_range(filename, start, end)
+
+
+# 更新字幕的全文检索索引，language 为 en（转录原文）或 zh（中文翻译）；索引失败不影响转录与翻译结果
+def update_search_index(filename, language):
+    try:
+        segments = read_timed_segments(filename)
+        if language == "zh":
+            segments = [dict(segment, text=segment.get("translation", "")) for segment in segments]
+        search_index.index_segments(filename, language, segments)
+    except Exception as e:
+        print(f"search index update failed for {filename} ({language}): {e}")
+
+
+# 为已有的全部字幕重建检索索引
+@celery_app.task(**MEDIA_TASK_OPTIONS)
+def rebuild_search_index():
+    names = {name[:-len(".srt")] for name in os.listdir(TRANSCRIPT_DIR) if name.endswith(".srt")} \
+        if os.path.isdir(TRANSCRIPT_DIR) else set()
+    names |= set(segment_store.list_stores())
+    for name in sorted(names):
+        update_search_index(name, "en")
+        if segment_store.has_translation(name):
+            update_search_index(name, "zh")
+    return {"indexed": len(names)}
+
+
+# 转录产物在缓存中的文件名与实际路径
+def transcript_cache_targets(filename):
+    return {
+        "transcript.txt": os.path.join(TRANSCRIPT_DIR, filename + '.txt'),
+        "transcript.srt": os.path.join(TRANSCRIPT_DIR, filename + '.srt'),
+        "segments.jsonl": segments_stream_path(filename)
+    }
 
 
 # 创建转录子进程并加入任务队列
-@celery_app.task(bind=True)
-def transcribe_audio(self, filename: str):
+# 通过 update_state 发布进度，前端无需等待整段转录结束即可看到字幕
+@celery_app.task(bind=True, **TRANSCRIPTION_TASK_OPTIONS)
+def transcribe_audio(self, filename: str, model_size: str = None, stream_seconds: float = None,
+                     backend: str = None, backend_options: dict = None):
     print("start subprocess")
-    audio_path = os.path.join(AUDIO_DIR, filename+'.mp3')
+    return run_transcription(filename, model_size, stream_seconds,
+                             progress_callback=lambda meta: self.update_state(state="PROGRESS", meta=meta),
+                             backend=backend, backend_options=backend_options)
+
+
+def record_transcription_metrics(backend, model_size, audio_seconds, transcribe_time):
+    labels = (backend or TRANSCRIBE_BACKEND, model_size or WHISPER_DEFAULT_MODEL)
+    metrics.TRANSCRIBED_AUDIO_SECONDS.labels(*labels).inc(audio_seconds)
+    if audio_seconds > 0:
+        metrics.TRANSCRIPTION_RTF.labels(*labels).observe(transcribe_time / audio_seconds)
+
+
+# 转录音频：按静音切分为若干窗口依次转录，每个窗口完成后立即追加写入 txt/srt/jsonl 并回调进度
+# backend 与 backend_options 选择转录后端及其 beam_size、vad_filter、threads 等参数
+def run_transcription(filename, model_size=None, stream_seconds=None, progress_callback=None, backend=None, backend_options=None):
     transcript_txt_path = os.path.join(TRANSCRIPT_DIR, filename + '.txt')
     transcript_srt_path = os.path.join(TRANSCRIPT_DIR, filename + '.srt')
+    segments_path = segments_stream_path(filename)
+    if stream_seconds is None:
+        stream_seconds = STREAM_WINDOW_SECONDS
+
+    # 相同内容、相同参数转录过时直接从缓存恢复
+    content_hash = artifact_cache.video_content_hash(filename)
+    backend = backend or TRANSCRIBE_BACKEND
+    cache_params = transcription_cache_params(model_size, backend, backend_options, stream_seconds=stream_seconds)
+    if artifact_cache.fetch(content_hash, "transcript", cache_params, transcript_cache_targets(filename)):
+        database.set_video_state(filename, transcript_ready=True)
+        update_search_index(filename, "en")
+        return {
+            "txt_file": transcript_txt_path,
+            "srt_file": transcript_srt_path,
+            "segments_file": segments_path,
+            "model": model_size or WHISPER_DEFAULT_MODEL,
+            "backend": backend,
+            "cached": True
+        }
+
+    # 先加载模型，加载耗时单独统计
+    model_load_time, model_cache_hit = get_transcription_model(
+        backend, model_size, transcribe_backend_options(backend, backend_options))[1:]
+    audio = load_audio_array(filename)
+    duration = len(audio) / SAMPLE_RATE
+    cuts = find_silence_cuts(audio, stream_seconds) if stream_seconds > 0 else []
+    bounds = [0.0] + cuts + [duration]
 
     # 确保存储转录文件的目录存在
-    Path(os.path.dirname(transcript_txt_path)).mkdir(parents=True, exist_ok=True)
-    Path(os.path.dirname(transcript_srt_path)).mkdir(parents=True, exist_ok=True)
+    Path(TRANSCRIPT_DIR).mkdir(parents=True, exist_ok=True)
+
+    transcribe_start = time.perf_counter()
+    all_segments = []
+    segment_count = 0
+    prompt = None
+    with open(transcript_txt_path, "w", encoding='utf-8') as txt_file, \
+            open(transcript_srt_path, "w", encoding='utf-8') as srt_file, \
+            open(segments_path, "w", encoding='utf-8') as segments_file:
+        for window_start, window_end in zip(bounds, bounds[1:]):
+            window = audio[int(window_start * SAMPLE_RATE):int(window_end * SAMPLE_RATE)]
+            # 用上一个窗口的结尾文本作为提示，保持窗口之间的上下文连贯
+            text, window_segments = transcribe_with_backend(window, model_size, backend, backend_options, prompt)[:2]
+
+            segments = []
+            for segment in window_segments:
+                segments.append({
+                    "index": segment_count + len(segments),
+                    "start": round(segment["start"] + window_start, 2),
+                    "end": round(segment["end"] + window_start, 2),
+                    "text": segment["text"]
+                })
+
+            txt_file.write("".join(segment["text"] for segment in segments))
+            write_srt_segments(srt_file, segments)
+            for segment in segments:
+                segments_file.write(json.dumps(segment, ensure_ascii=False) + "\n")
+            for stream in (txt_file, srt_file, segments_file):
+                stream.flush()
+
+            all_segments.extend(segments)
+            segment_count += len(segments)
+            prompt = text[-200:] or prompt
+            if progress_callback:
+                progress_callback({
+                    "progress": round(window_end / duration * 100, 2) if duration else 100.0,
+                    "processed_seconds": round(window_end, 2),
+                    "duration": round(duration, 2),
+                    "segment_count": segment_count,
+                    "segments": segments,
+                    "segments_file": segments_path
+                })
+    transcribe_time = time.perf_counter() - transcribe_start
+    record_transcription_metrics(backend, model_size, duration, transcribe_time)
+    segment_store.write_segments(filename, all_segments)
+    artifact_cache.store(content_hash, "transcript", cache_params, transcript_cache_targets(filename))
+    database.set_video_state(filename, transcript_ready=True)
+    update_search_index(filename, "en")
+
+    return {
+        "txt_file": transcript_txt_path,
+        "srt_file": transcript_srt_path,
+        "segments_file": segments_path,
+        "segment_count": segment_count,
+        "model": model_size or WHISPER_DEFAULT_MODEL,
+        "backend": backend,
+        "model_load_time": round(model_load_time, 3),
+        "model_cache_hit": model_cache_hit,
+        "transcribe_time": round(transcribe_time, 3)
+    }
+
+
+# 在目标切分点附近寻找能量最低（最安静）的位置作为切分点，返回秒数列表
+def find_silence_cuts(audio, chunk_seconds, search_seconds=5.0, frame_seconds=0.03):
+    frame = int(frame_seconds * SAMPLE_RATE)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return []
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    energy = np.sqrt(np.mean(frames ** 2, axis=1))
+    frame_seconds = frame / SAMPLE_RATE
+    duration = len(audio) / SAMPLE_RATE
 
-    model = whisper.load_model("medium")
-    result = model.transcribe(audio_path, language="English")
+    cuts = []
+    last_cut = 0.0
+    while True:
+        target = last_cut + chunk_seconds
+        # 剩余部分不足四分之一片段时直接并入最后一段
+        if target >= duration - chunk_seconds * 0.25:
+            break
+        lo = int(max(last_cut + 1.0, target - search_seconds) / frame_seconds)
+        hi = int(min(duration, target + search_seconds) / frame_seconds)
+        if hi <= lo:
+            break
+        cut = (lo + int(np.argmin(energy[lo:hi]))) * frame_seconds
+        cuts.append(cut)
+        last_cut = cut
+    return cuts
 
-    with open(transcript_txt_path, "w", encoding='utf-8') as txt_file:
-        txt_file.write(result["text"])
 
-    with open(transcript_srt_path, "w", encoding='utf-8') as srt_file:
-        for segment in result["segments"]:
-            start = segment["start"]
-            end = segment["end"]
-            text = segment["text"]
-            srt_file.write(f"{start} --> {end}\n{text}\n\n")
+# 将音频切分为带重叠的片段并保存到磁盘，供多个 worker 并行转录
+# 每个片段只“拥有” [keep_start, keep_end) 范围内的字幕，重叠部分用于合并时去重
+def split_audio_chunks(filename, audio, chunk_seconds, overlap_seconds):
+    duration = len(audio) / SAMPLE_RATE
+    bounds = [0.0] + find_silence_cuts(audio, chunk_seconds) + [duration]
+
+    chunk_dir = os.path.join(CHUNK_DIR, filename)
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    chunks = []
+    for index in range(len(bounds) - 1):
+        keep_start, keep_end = bounds[index], bounds[index + 1]
+        start = max(0.0, keep_start - overlap_seconds)
+        end = min(duration, keep_end + overlap_seconds)
+        chunk_path = os.path.join(chunk_dir, f"{index}.npy")
+        np.save(chunk_path, audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)])
+        chunks.append({
+            "index": index,
+            "path": chunk_path,
+            "offset": start,
+            "keep_start": keep_start,
+            "keep_end": keep_end,
+            "last": index == len(bounds) - 2
+        })
+    return chunks
+
+
+def chunked_cache_params(model_size, chunk_seconds, overlap_seconds, backend=None, backend_options=None):
+    return transcription_cache_params(model_size, backend, backend_options,
+                                      chunk_seconds=chunk_seconds, overlap_seconds=overlap_seconds)
+
+
+# 长音频分段并行转录：按静音切分后以 chord 分发到多个 worker，最后合并字幕
+@celery_app.task(bind=True, **TRANSCRIPTION_TASK_OPTIONS)
+def transcribe_audio_chunked(self, filename: str, model_size: str = None, chunk_seconds: float = 300, overlap_seconds: float = 1.0,
+                             backend: str = None, backend_options: dict = None):
+    content_hash = artifact_cache.video_content_hash(filename)
+    if artifact_cache.fetch(content_hash, "transcript",
+                            chunked_cache_params(model_size, chunk_seconds, overlap_seconds, backend, backend_options),
+                            transcript_cache_targets(filename)):
+        database.set_video_state(filename, transcript_ready=True)
+        update_search_index(filename, "en")
+        return {
+            "txt_file": os.path.join(TRANSCRIPT_DIR, filename + '.txt'),
+            "srt_file": os.path.join(TRANSCRIPT_DIR, filename + '.srt'),
+            "model": model_size or WHISPER_DEFAULT_MODEL,
+            "cached": True
+        }
+
+    audio = load_audio_array(filename)
+    chunks = split_audio_chunks(filename, audio, chunk_seconds, overlap_seconds)
+    print(f"split {filename} into {len(chunks)} chunks")
+
+    workflow = chord(
+        group(transcribe_chunk.s(chunk, model_size, backend, backend_options) for chunk in chunks),
+        merge_chunk_transcripts.s(filename, model_size, chunk_seconds, overlap_seconds, backend, backend_options)
+    )
+    # 用 chord 替换当前任务，调用方仍然只需要查询这一个任务 ID
+    return self.replace(workflow)
+
+
+@celery_app.task(**TRANSCRIPTION_TASK_OPTIONS)
+def transcribe_chunk(chunk: dict, model_size: str = None, backend: str = None, backend_options: dict = None):
+    audio = np.load(chunk["path"])
+    model_load_time, model_cache_hit = get_transcription_model(
+        backend, model_size, transcribe_backend_options(backend or TRANSCRIBE_BACKEND, backend_options))[1:]
+    transcribe_start = time.perf_counter()
+    chunk_segments = transcribe_with_backend(audio, model_size, backend, backend_options)[1]
+    transcribe_time = time.perf_counter() - transcribe_start
+    record_transcription_metrics(backend, model_size, len(audio) / SAMPLE_RATE, transcribe_time)
+
+    segments = []
+    for segment in chunk_segments:
+        segments.append({
+            "start": round(segment["start"] + chunk["offset"], 2),
+            "end": round(segment["end"] + chunk["offset"], 2),
+            "text": segment["text"]
+        })
+    return {
+        "chunk": chunk,
+        "segments": segments,
+        "model_load_time": model_load_time,
+        "model_cache_hit": model_cache_hit,
+        "transcribe_time": transcribe_time
+    }
+
+
+# 合并各片段的字幕：按片段顺序拼接，只保留中点落在本片段拥有范围内的字幕，并去掉重叠处重复的句子
+def merge_segments(chunk_results):
+    merged = []
+    for item in sorted(chunk_results, key=lambda r: r["chunk"]["index"]):
+        chunk = item["chunk"]
+        for segment in item["segments"]:
+            middle = (segment["start"] + segment["end"]) / 2
+            if middle < chunk["keep_start"] or (middle >= chunk["keep_end"] and not chunk["last"]):
+                continue
+            if merged and merged[-1]["text"].strip() == segment["text"].strip() and segment["start"] < merged[-1]["end"]:
+                continue
+            merged.append(segment)
+    return merged
+
+
+@celery_app.task(**MEDIA_TASK_OPTIONS)
+def merge_chunk_transcripts(chunk_results: list, filename: str, model_size: str = None, chunk_seconds: float = 300, overlap_seconds: float = 1.0,
+                            backend: str = None, backend_options: dict = None):
+    transcript_txt_path = os.path.join(TRANSCRIPT_DIR, filename + '.txt')
+    transcript_srt_path = os.path.join(TRANSCRIPT_DIR, filename + '.srt')
+
+    segments = merge_segments(chunk_results)
+    text = "".join(segment["text"] for segment in segments)
+    write_transcript_files(transcript_txt_path, transcript_srt_path, text, segments)
+    with open(segments_stream_path(filename), "w", encoding='utf-8') as segments_file:
+        for index, segment in enumerate(segments):
+            segments_file.write(json.dumps(dict(segment, index=index), ensure_ascii=False) + "\n")
+    segment_store.write_segments(filename, segments)
+
+    shutil.rmtree(os.path.join(CHUNK_DIR, filename), ignore_errors=True)
+    artifact_cache.store(artifact_cache.video_content_hash(filename), "transcript",
+                         chunked_cache_params(model_size, chunk_seconds, overlap_seconds, backend, backend_options),
+                         transcript_cache_targets(filename))
+    database.set_video_state(filename, transcript_ready=True)
+    update_search_index(filename, "en")
 
     return {
         "txt_file": transcript_txt_path,
-        "srt_file": transcript_srt_path
+        "srt_file": transcript_srt_path,
+        "model": model_size or WHISPER_DEFAULT_MODEL,
+        "backend": backend or TRANSCRIBE_BACKEND,
+        "chunks": len(chunk_results),
+        "model_load_time": round(sum(r["model_load_time"] for r in chunk_results), 3),
+        "model_cache_hits": sum(1 for r in chunk_results if r["model_cache_hit"]),
+        "transcribe_time": round(sum(r["transcribe_time"] for r in chunk_results), 3)
+    }
+
+
+# 对字幕做情感分析，结果作为一列写入字幕存储；相同字幕已分析过时直接从缓存恢复
+def run_sentiment_analysis(filename, scorer=text_analysis.DEFAULT_SENTIMENT_SCORER):
+    if not ensure_segment_store(filename):
+        raise FileNotFoundError(f"No subtitles for {filename}")
+
+    # 字幕存储中已有同一打分器的结果时直接使用（文本变化时这些列会被清除），不再计算文本哈希、访问缓存
+    if segment_store.sentiment_scorer(filename) != scorer:
+        content_hash = segment_store.text_digest(filename)
+        cache_params = {"scorer": scorer}
+        cache_targets = {name: segment_store.column_path(filename, name) for name in segment_store.SENTIMENT_COLUMNS}
+        segment_store.set_sentiment_scorer(filename, None)
+        if not artifact_cache.fetch(content_hash, "sentiment_columns", cache_params, cache_targets):
+            scores = text_analysis.score_sentiment_batch([text.strip() for text in segment_store.texts(filename)], scorer)
+            segment_store.write_sentiment(filename, scores)
+            artifact_cache.store(content_hash, "sentiment_columns", cache_params, cache_targets)
+        segment_store.set_sentiment_scorer(filename, scorer)
+
+    database.set_video_state(filename, analysis_ready=True)
+    return segment_store.sentiment_entries(segment_store.read_slice(filename))
+
+
+# 词频文件
+def freq_json_path(filename):
+    return os.path.join(WORDCLOUD_DIR, filename + "_freq.json")
+
+
+# 从共享的分词结果生成词频文件
+def run_word_frequency(filename, stopwords=False, top_n=None):
+    restore_transcript(filename)
+    transcript_path = os.path.join(TRANSCRIPT_DIR, filename + ".txt")
+    freq_path = freq_json_path(filename)
+
+    counts = text_analysis.get_token_counts(transcript_path, token_artifact_path(filename))
+    word_freq = text_analysis.filter_counts(counts, stopwords=stopwords, top_n=top_n)
+
+    # 保存词频数据为JSON文件
+    os.makedirs(os.path.dirname(freq_path), exist_ok=True)
+    with open(freq_path, "w", encoding="utf-8") as freq_file:
+        json.dump(word_freq, freq_file, ensure_ascii=False)
+    return freq_path
+
+
+# 总结结果文件
+def summary_text_path(filename):
+    return os.path.join(TRANSCRIPT_DIR, f"{filename}_summary.txt")
+
+
+# 生成文本总结并保存
+def run_summary(filename):
+    segments = read_transcript_segments(filename)
+    summary = asyncio.run(llm_client.run_with_client(llm_client.summarize_segments, segments))
+    with open(summary_text_path(filename), "w", encoding="utf-8") as file:
+        file.write(summary)
+    return summary
+
+
+# 文本总结与演讲评价也可以作为后台任务执行
+@celery_app.task(**LLM_TASK_OPTIONS)
+def summarize_text_task(filename: str):
+    segments = read_transcript_segments(filename)
+    return {"summary": asyncio.run(llm_client.run_with_client(llm_client.summarize_segments, segments))}
+
+
+@celery_app.task(**LLM_TASK_OPTIONS)
+def evaluate_speech_task(filename: str):
+    segments = read_transcript_segments(filename)
+    return {"evaluation": asyncio.run(llm_client.run_with_client(llm_client.evaluate_segments, segments))}
+
+
+# 转录文本分词结果（词/次数），供词频与词云共用
+def token_artifact_path(filename):
+    return os.path.join(WORDCLOUD_DIR, filename + "_tokens.json")
+
+
+# 蒙版只能是 MASK_DIR 下的文件名，去掉目录部分，防止通过 ../ 读取其他文件
+def mask_file_path(mask):
+    return os.path.join(MASK_DIR, os.path.basename(mask)) if mask else None
+
+
+# 词云图片路径：默认参数沿用 {filename}_wordcloud.png，其他参数组合带上参数摘要，缩略图追加尺寸后缀
+def wordcloud_paths(filename, width=800, height=600, background_color="white", mask=None):
+    mask = os.path.basename(mask) if mask else None
+    suffix = ""
+    if (width, height, background_color, mask) != (800, 600, "white", None):
+        params = json.dumps([width, height, background_color, mask])
+        suffix = "_" + hashlib.sha256(params.encode("utf-8")).hexdigest()[:8]
+    base = os.path.join(WORDCLOUD_DIR, f"{filename}_wordcloud{suffix}")
+    thumbnails = {f"{w}x{h}": f"{base}_{w}x{h}.png" for w, h in WORDCLOUD_THUMBNAIL_SIZES}
+    return base + ".png", thumbnails
+
+
+def _save_image(image, path):
+    temp_path = path + ".part"
+    image.save(temp_path, format="PNG")
+    os.replace(temp_path, path)
+
+
+# 渲染词云：排版一次，缩略图从同一张图缩放得到；按 转录文本哈希 + 尺寸/颜色/蒙版 缓存
+@celery_app.task(**MEDIA_TASK_OPTIONS)
+def render_wordcloud_task(filename: str, width: int = 800, height: int = 600, background_color: str = "white", mask: str = None):
+    restore_transcript(filename)
+    transcript_path = os.path.join(TRANSCRIPT_DIR, filename + ".txt")
+    wordcloud_path, thumbnail_paths = wordcloud_paths(filename, width, height, background_color, mask)
+    mask_path = mask_file_path(mask)
+    os.makedirs(WORDCLOUD_DIR, exist_ok=True)
+
+    content_hash = artifact_cache.file_digest(transcript_path)
+    cache_params = {
+        "width": width, "height": height, "background_color": background_color, "margin": 2,
+        "max_words": WORDCLOUD_MAX_WORDS, "font": text_analysis.WORDCLOUD_FONT_PATH,
+        "mask": artifact_cache.file_digest(mask_path) if mask_path else None,
+        "thumbnails": sorted(thumbnail_paths)
     }
+    cache_targets = {"wordcloud.png": wordcloud_path}
+    cache_targets.update({f"thumb_{size}.png": path for size, path in thumbnail_paths.items()})
+    result = {"wordcloud_file": wordcloud_path, "thumbnails": thumbnail_paths}
+    if artifact_cache.fetch(content_hash, "wordcloud", cache_params, cache_targets):
+        return dict(result, cached=True)
+
+    counts = text_analysis.get_token_counts(transcript_path, token_artifact_path(filename))
+    # 去掉停用词、标点和单字后取出现次数最多的词
+    frequencies = text_analysis.filter_counts(counts, stopwords=True, top_n=WORDCLOUD_MAX_WORDS, min_length=2)
+    image = text_analysis.render_wordcloud(frequencies, width, height, background_color, mask_path)
+
+    _save_image(image, wordcloud_path)
+    for size, path in thumbnail_paths.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail(tuple(int(v) for v in size.split("x")), Image.LANCZOS)
+        _save_image(thumbnail, path)
+    artifact_cache.store(content_hash, "wordcloud", cache_params, cache_targets)
+
+    return result
+
 
 @celery_app.task
 def simple_test():
     return "Hello, World!"
 
 
-@celery_app.task
-def translate_json_task(filename: str):
-    input_path = os.path.join(TRANSCRIPT_DIR, filename+".json")
-    output_json_path = os.path.join(TRANSCRIPT_DIR, f"{filename}_chinese.json")
-    output_txt_path = os.path.join(TRANSCRIPT_DIR, f"{filename}_chinese.txt")
-
-    with open(input_path, "r", encoding="utf-8") as file:
-        subtitles = json.load(file)
-
-    translated_subtitles = []
-    translated_text = ""
-
-    total_items = len(subtitles)
-
-    for index, item in enumerate(subtitles):
-        progress = (index + 1) / total_items * 100
-        print(f"Processing item {index + 1}/{total_items} ({progress:.2f}%)")
-        data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "你现在是一个翻译接口，请将用户给你的内容翻译成中文"
-                },
-                {
-                    "role": "user",
-                    "content": item["content"]
-                }
-            ]
-        }
+# 翻译字幕：分批打包多行字幕，通过连接复用的异步客户端并发请求，并限速与重试
+@celery_app.task(bind=True, **LLM_TASK_OPTIONS)
+def translate_json_task(self, filename: str):
+    return run_translation(filename, progress_callback=lambda meta: self.update_state(state="PROGRESS", meta=meta))
+
+
+def run_translation(filename, progress_callback=None):
+    if not ensure_segment_store(filename):
+        raise FileNotFoundError(f"No subtitles for {filename}")
+
+    # 以字幕文本的哈希为键，相同字幕翻译过时直接从缓存恢复
+    content_hash = segment_store.text_digest(filename)
+    cache_params = {"model": llm_client.TRANSLATE_MODEL, "target": "zh"}
+    cache_targets = {name: segment_store.column_path(filename, name) for name in segment_store.TRANSLATION_COLUMNS}
+    if artifact_cache.fetch(content_hash, "translation_columns", cache_params, cache_targets):
+        update_search_index(filename, "zh")
+        return {"segment_store": segment_store.store_dir(filename), "cached": True}
+
+    lines = [text.strip() for text in segment_store.texts(filename)]
+
+    def report_progress(done, total):
+        if progress_callback:
+            progress_callback({
+                "translated": done,
+                "total": total,
+                "progress": round(done / total * 100, 2) if total else 100.0
+            })
+
+    translations = asyncio.run(llm_client.translate_lines(lines, report_progress))
+    segment_store.write_translation(filename, translations)
+
+    artifact_cache.store(content_hash, "translation_columns", cache_params, cache_targets)
+    update_search_index(filename, "zh")
+
+    return {"segment_store": segment_store.store_dir(filename), "translated": len(lines)}
+
+
+# 按需生成旧格式的字幕文件：txt、srt、情感分析 json、中文翻译 json/txt
+LEGACY_FORMATS = {
+    "txt": lambda f: (os.path.join(TRANSCRIPT_DIR, f + ".txt"), segment_store.format_txt),
+    "srt": lambda f: (os.path.join(TRANSCRIPT_DIR, f + ".srt"), segment_store.format_srt),
+    "sentiment": lambda f: (os.path.join(TRANSCRIPT_DIR, f + ".json"),
+                            lambda segments: json.dumps(segment_store.sentiment_entries(segments), ensure_ascii=False, indent=4)),
+    "translation": lambda f: (os.path.join(TRANSCRIPT_DIR, f"{f}_chinese.json"),
+                              lambda segments: json.dumps(segment_store.translation_entries(segments), ensure_ascii=False, indent=4)),
+    "translation_txt": lambda f: (os.path.join(TRANSCRIPT_DIR, f"{f}_chinese.txt"), segment_store.format_translation_txt),
+}
 
-        response = requests.post(API_URL, headers={"Authorization": f"Bearer {API_KEY}"}, json=data)
-        if response.status_code == 200:
-            translated_content = response.json()['choices'][0]['message']['content']
-            translated_item = {
-                "time": item["time"],
-                "content": translated_content,
-                "sentiment": item["sentiment"]
-            }
-            translated_subtitles.append(translated_item)
-            translated_text += translated_content + "\n"
-
-    # Save translated JSON
-    os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
-    with open(output_json_path, "w", encoding="utf-8") as file:
-        json.dump(translated_subtitles, file, ensure_ascii=False, indent=4)
-
-    # Save translated text as TXT
-    os.makedirs(os.path.dirname(output_txt_path), exist_ok=True)
-    with open(output_txt_path, "w", encoding="utf-8") as file:
-        file.write(translated_text)
 
+def export_legacy_file(filename, fmt):
+    if not ensure_segment_store(filename):
+        raise FileNotFoundError(f"No subtitles for {filename}")
+    path, render = LEGACY_FORMATS[fmt](filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".part", "w", encoding="utf-8") as file:
+        file.write(render(segment_store.read_slice(filename)))
+    # 修改时间与字幕存储一致：由存储生成的文件不能被 ensure_segment_store 当作更新的字幕来源而触发重建
+    store_mtime = os.path.getmtime(segment_store.column_path(filename, "start.npy"))
+    os.utime(path + ".part", (store_mtime, store_mtime))
+    os.replace(path + ".part", path)
+    return path
+
+
+# ---------------- 端到端处理流水线 ----------------
+# 每个阶段：依赖的上游阶段、输入文件、输出文件以及执行函数
+# 输出文件都存在且不早于输入文件时视为已是最新，直接跳过
+PIPELINE_STAGES = {
+    "extract": {
+        "depends": (),
+        "inputs": lambda f: [os.path.join(VIDEO_DIR, f + ".mp4")],
+        "outputs": lambda f: [os.path.join(AUDIO_DIR, f + ".wav")],
+        "run": lambda f, options: extract_audio_task(f),
+    },
+    "transcribe": {
+        "depends": ("extract",),
+        "inputs": lambda f: [audio_file_path(f)],
+        "outputs": lambda f: [os.path.join(TRANSCRIPT_DIR, f + ".txt"), os.path.join(TRANSCRIPT_DIR, f + ".srt")],
+        "run": lambda f, options: run_transcription(f, options.get("model"), backend=options.get("backend")),
+    },
+    "sentiment": {
+        "depends": ("transcribe",),
+        "inputs": lambda f: [os.path.join(TRANSCRIPT_DIR, f + ".srt"), segment_store.column_path(f, "text.bin")],
+        "outputs": lambda f: [segment_store.column_path(f, name) for name in segment_store.SENTIMENT_COLUMNS],
+        "run": lambda f, options: run_sentiment_analysis(f, options.get("scorer", text_analysis.DEFAULT_SENTIMENT_SCORER)),
+    },
+    "translate": {
+        "depends": ("transcribe",),
+        "inputs": lambda f: [os.path.join(TRANSCRIPT_DIR, f + ".srt"), segment_store.column_path(f, "text.bin")],
+        "outputs": lambda f: [segment_store.column_path(f, name) for name in segment_store.TRANSLATION_COLUMNS],
+        "run": lambda f, options: run_translation(f),
+    },
+    "freq": {
+        "depends": ("transcribe",),
+        "inputs": lambda f: [os.path.join(TRANSCRIPT_DIR, f + ".txt")],
+        "outputs": lambda f: [freq_json_path(f)],
+        "run": lambda f, options: run_word_frequency(f),
+    },
+    "wordcloud": {
+        "depends": ("transcribe",),
+        "inputs": lambda f: [os.path.join(TRANSCRIPT_DIR, f + ".txt")],
+        "outputs": lambda f: [wordcloud_paths(f)[0]],
+        "run": lambda f, options: render_wordcloud_task(f),
+    },
+    "summary": {
+        "depends": ("transcribe",),
+        "inputs": lambda f: [os.path.join(TRANSCRIPT_DIR, f + ".txt")],
+        "outputs": lambda f: [summary_text_path(f)],
+        "run": lambda f, options: run_summary(f),
+    },
+}
+
+# 提取与转录依次执行，之后的分支并行执行，分支内部按顺序执行
+PIPELINE_HEAD = ("extract", "transcribe")
+PIPELINE_BRANCHES = (("sentiment",), ("translate",), ("freq",), ("wordcloud",), ("summary",))
+
+
+# 补全所选阶段依赖的上游阶段，并按流水线顺序返回
+def resolve_pipeline_stages(stages=None):
+    if not stages:
+        return list(PIPELINE_STAGES)
+    unknown = [stage for stage in stages if stage not in PIPELINE_STAGES]
+    if unknown:
+        raise ValueError(f"Unknown pipeline stage(s): {', '.join(unknown)}")
+    selected = set()
+    pending = list(stages)
+    while pending:
+        stage = pending.pop()
+        if stage not in selected:
+            selected.add(stage)
+            pending.extend(PIPELINE_STAGES[stage]["depends"])
+    return [stage for stage in PIPELINE_STAGES if stage in selected]
+
+
+def stage_up_to_date(stage, filename):
+    inputs = [path for path in PIPELINE_STAGES[stage]["inputs"](filename) if os.path.exists(path)]
+    outputs = PIPELINE_STAGES[stage]["outputs"](filename)
+    if not all(os.path.exists(path) for path in outputs):
+        return False
+    if not inputs:
+        return True
+    return min(os.path.getmtime(path) for path in outputs) >= max(os.path.getmtime(path) for path in inputs)
+
+
+# 下游阶段：失败时这些阶段不会再执行
+def _downstream_stages(stage):
+    result = set()
+    for name, spec in PIPELINE_STAGES.items():
+        if stage in spec["depends"]:
+            result |= {name} | _downstream_stages(name)
+    return result
+
+
+# 执行流水线中的一个阶段，并把状态、起止时间和产物写入作业记录
+def _run_pipeline_stage(job_id, stage, filename, options):
+    spec = PIPELINE_STAGES[stage]
+    started_at = time.time()
+    restore_transcript(filename)
+    if not options.get("force") and stage_up_to_date(stage, filename):
+        database.update_pipeline_stage(job_id, stage, state="SKIPPED", started_at=started_at, finished_at=started_at,
+                                       artifacts=spec["outputs"](filename))
+        return {"stage": stage, "skipped": True}
+
+    # worker 丢失后重新投递时沿用第一次开始的时间，卡住的阶段从第一次开始计算超时
+    previous = next((row for row in database.get_pipeline_job(job_id)[1] if row["stage"] == stage), None)
+    if previous is not None and previous["state"] == "RUNNING" and previous["started_at"]:
+        started_at = previous["started_at"]
+    database.update_pipeline_stage(job_id, stage, state="RUNNING", started_at=started_at)
+    try:
+        with metrics.span(f"pipeline.{stage}", job_id=job_id, filename=filename):
+            spec["run"](filename, options)
+    except Exception as e:
+        finished_at = time.time()
+        metrics.PIPELINE_STAGE_SECONDS.labels(stage, "FAILURE").observe(finished_at - started_at)
+        database.update_pipeline_stage(job_id, stage, state="FAILURE", finished_at=finished_at, error=str(e))
+        for name in _downstream_stages(stage):
+            database.update_pipeline_stage(job_id, name, state="CANCELLED")
+        raise
+    finished_at = time.time()
+    metrics.PIPELINE_STAGE_SECONDS.labels(stage, "SUCCESS").observe(finished_at - started_at)
+    database.update_pipeline_stage(job_id, stage, state="SUCCESS", finished_at=finished_at,
+                                   artifacts=[path for path in spec["outputs"](filename) if os.path.exists(path)])
+    return {"stage": stage, "skipped": False}
+
+
+# 每类队列一个阶段任务，沿用该类任务的超时与确认方式：大模型阶段不会按转录的 4 小时超时执行，也不会在 worker 丢失后反复重新投递
+@celery_app.task(**TRANSCRIPTION_TASK_OPTIONS)
+def run_pipeline_stage(job_id: str, stage: str, filename: str, options: dict):
+    return _run_pipeline_stage(job_id, stage, filename, options)
+
+
+@celery_app.task(**MEDIA_TASK_OPTIONS)
+def run_media_pipeline_stage(job_id: str, stage: str, filename: str, options: dict):
+    return _run_pipeline_stage(job_id, stage, filename, options)
+
+
+@celery_app.task(**LLM_TASK_OPTIONS)
+def run_llm_pipeline_stage(job_id: str, stage: str, filename: str, options: dict):
+    return _run_pipeline_stage(job_id, stage, filename, options)
+
+
+PIPELINE_QUEUE_TASKS = {
+    TRANSCRIPTION_QUEUE: run_pipeline_stage,
+    MEDIA_QUEUE: run_media_pipeline_stage,
+    LLM_QUEUE: run_llm_pipeline_stage,
+}
+
+
+def pipeline_stage_task(stage):
+    return PIPELINE_QUEUE_TASKS[PIPELINE_STAGE_QUEUES.get(stage, MEDIA_QUEUE)]
+
+
+# 阶段开始后超过其任务的硬超时仍为 RUNNING：执行它的子进程已被超时或内存不足杀死、或 worker 丢失，
+# 任务中的异常处理没有机会执行，这里标记为失败并取消下游阶段，返回更新后的阶段列表
+PIPELINE_STAGE_GRACE_SECONDS = 300
+
+
+def fail_stale_stages(job_id, stages):
+    now = time.time()
+    stale = [stage["stage"] for stage in stages if stage["state"] == "RUNNING" and stage["started_at"]
+             and now - stage["started_at"] > pipeline_stage_task(stage["stage"]).time_limit + PIPELINE_STAGE_GRACE_SECONDS]
+    for name in stale:
+        database.update_pipeline_stage(job_id, name, state="FAILURE", finished_at=now,
+                                       error="worker lost or time limit exceeded")
+        for downstream in _downstream_stages(name):
+            database.update_pipeline_stage(job_id, downstream, state="CANCELLED")
+    return database.get_pipeline_job(job_id)[1] if stale else stages
+
+
+# 创建作业并提交流水线，返回作业 ID；options 可包含 model、backend、scorer、force
+def start_pipeline(filename, stages=None, options=None, priority=None):
+    options = dict(options or {})
+    stages = resolve_pipeline_stages(stages)
+    job_id = str(uuid4())
+    database.create_pipeline_job(job_id, filename, options, stages, datetime.now().isoformat())
+
+    def signature(stage):
+        return pipeline_stage_task(stage).si(job_id, stage, filename, options)
+
+    steps = [signature(stage) for stage in PIPELINE_HEAD if stage in stages]
+    branches = [chain(*[signature(stage) for stage in branch if stage in stages])
+                for branch in PIPELINE_BRANCHES if any(stage in stages for stage in branch)]
+    if len(branches) == 1:
+        steps.append(branches[0])
+    elif branches:
+        steps.append(group(branches))
+    chain(*steps).apply_async(priority=priority)
+    return job_id
+
+
+# 作业状态：由各阶段状态汇总得到
+def pipeline_job_status(job_id):
+    job, stages = database.get_pipeline_job(job_id)
+    if job is None:
+        return None
+    states = [stage["state"] for stage in stages]
+    if "FAILURE" in states:
+        status = "FAILURE"
+    elif all(state in ("SUCCESS", "SKIPPED") for state in states):
+        status = "SUCCESS"
+    elif all(state == "PENDING" for state in states):
+        status = "PENDING"
+    else:
+        status = "RUNNING"
+
+    stage_list = []
+    for stage in stages:
+        duration = None
+        if stage["started_at"] is not None and stage["finished_at"] is not None:
+            duration = round(stage["finished_at"] - stage["started_at"], 3)
+        stage_list.append({
+            "stage": stage["stage"],
+            "state": stage["state"],
+            "started_at": stage["started_at"],
+            "finished_at": stage["finished_at"],
+            "duration": duration,
+            "artifacts": json.loads(stage["artifacts"]) if stage["artifacts"] else [],
+            "error": stage["error"]
+        })
     return {
-        "json_file": output_json_path,
-        "txt_file": output_txt_path
-    }
\ No newline at end of file
+        "job_id": job["id"],
+        "filename": job["filename"],
+        "created_at": job["created_at"],
+        "options": json.loads(job["options"]),
+        "status": status,
+        "stages": stage_list
+    }
+
+
+# ---------------- 批量导入与处理 ----------------
+# 目录或清单中的视频先登记入库，再由调度任务按并发上限分批提交流水线：
+# 正在处理的视频数达到上限时新的视频留在数据库中等待，队列里不会堆积成百上千条转录任务
+BATCH_MAX_IN_FLIGHT = int(os.getenv("batch_max_in_flight", "8"))  # 所有批次同时在处理的视频数上限，建议为转录 worker 进程数的 1~2 倍
+BATCH_POLL_SECONDS = int(os.getenv("batch_poll_seconds", "10"))  # 调度任务检查进度的间隔
+BATCH_INGEST_CHUNK = int(os.getenv("batch_ingest_chunk", "50"))  # 每个事务登记的视频数
+BATCH_CLAIM_TIMEOUT = 300  # 领取后这么久还没有作业 ID 的条目视为调度中断，重新排队
+PIPELINE_FINISHED_STATES = ("SUCCESS", "SKIPPED", "FAILURE", "CANCELLED")
+
+
+# 目录中的所有 mp4（含子目录），或清单文件中每行一个路径（# 开头为注释，相对路径相对于清单所在目录）
+def collect_batch_sources(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(root, name) for root, _, names in os.walk(path)
+                      for name in names if name.lower().endswith(".mp4"))
+    base = os.path.dirname(os.path.abspath(path))
+    sources = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                sources.append(os.path.normpath(os.path.join(base, line)))
+    return sources
+
+
+# 创建批次，返回批次 ID；stages/options 与 start_pipeline 相同，link=True 时视频以硬链接导入，不复制数据
+def create_batch(source, sources, stages=None, options=None, priority=None, max_in_flight=None, link=True):
+    stages = resolve_pipeline_stages(stages)
+    batch_id = str(uuid4())
+    batch_options = {"stages": stages, "pipeline": dict(options or {}), "link": link}
+    database.create_batch(batch_id, source, batch_options, TASK_PRIORITY_DEFAULT if priority is None else priority,
+                          max_in_flight or BATCH_MAX_IN_FLIGHT, sources, datetime.now().isoformat())
+    return batch_id
+
+
+# 导入一个视频：文件名由批次与序号决定，中断后重新导入会覆盖同一个文件
+def import_batch_video(batch_id, position, source_path, link=True):
+    if not source_path.lower().endswith(".mp4"):
+        raise ValueError("Only .mp4 videos are supported")
+    # 后缀统一为小写 .mp4，后续各阶段按 <视频名>.mp4 查找视频
+    filename = f"{batch_id[:8]}-{position:05d}-{os.path.splitext(os.path.basename(source_path))[0]}.mp4"
+    file_location = os.path.join(VIDEO_DIR, filename)
+    temp_path = file_location + ".part"
+    os.makedirs(VIDEO_DIR, exist_ok=True)
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    linked = False
+    if link:
+        try:
+            os.link(source_path, temp_path)
+            linked = True
+        except OSError:
+            pass  # 跨文件系统无法硬链接时改为复制
+    if not linked:
+        shutil.copyfile(source_path, temp_path)
+    content_hash = artifact_cache.file_digest(temp_path)
+    os.replace(temp_path, file_location)
+    return filename, os.path.getsize(file_location), content_hash
+
+
+# 导入一组待导入的视频并在一个事务中登记，返回 (成功数, 失败数)；没有待导入的视频时返回 (0, 0)
+def ingest_batch_chunk(batch_id):
+    batch = database.get_batch(batch_id)
+    link = json.loads(batch["options"]).get("link", True)
+    registered, failures = [], []
+    for item in database.list_batch_items(batch_id, ("PENDING",), BATCH_INGEST_CHUNK):
+        try:
+            registered.append((item["position"],) + import_batch_video(batch_id, item["position"], item["source_path"], link))
+        except (OSError, ValueError) as e:
+            failures.append((item["position"], {"state": "FAILURE", "error": f"import: {e}"}))
+    database.register_batch_videos(batch_id, registered, datetime.now().isoformat())
+    database.update_batch_items(batch_id, failures)
+    return len(registered), len(failures)
+
+
+# 分块导入，每个任务处理一块后重新排队，单个任务不会超过时间限制
+@celery_app.task(**MEDIA_TASK_OPTIONS)
+def ingest_batch_task(batch_id: str):
+    imported, failed = ingest_batch_chunk(batch_id)
+    if imported or failed:
+        ingest_batch_task.delay(batch_id)
+    return {"imported": imported, "failed": failed}
+
+
+# 更新正在处理的条目：流水线所有阶段都结束后按结果标记成功或失败；卡住的阶段超时后按失败处理，不会一直占用并发名额
+def refresh_batch_items(batch_id):
+    updates = []
+    for item in database.list_batch_items(batch_id, ("RUNNING",)):
+        if item["job_id"] is None:
+            if time.time() - (item["dispatched_at"] or 0) > BATCH_CLAIM_TIMEOUT:
+                updates.append((item["position"], {"state": "READY"}))
+            continue
+        stages = fail_stale_stages(item["job_id"], database.get_pipeline_job(item["job_id"])[1])
+        if not all(stage["state"] in PIPELINE_FINISHED_STATES for stage in stages):
+            continue
+        errors = [f"{stage['stage']}: {stage['error']}" for stage in stages if stage["state"] == "FAILURE"]
+        updates.append((item["position"], {"state": "FAILURE", "error": "; ".join(errors)} if errors else {"state": "SUCCESS"}))
+    database.update_batch_items(batch_id, updates)
+
+
+# 在并发上限内为等待中的条目提交流水线
+def start_batch_items(batch):
+    options = json.loads(batch["options"])
+    started = 0
+    for item in database.claim_batch_items(batch["id"], batch["max_in_flight"], BATCH_MAX_IN_FLIGHT, time.time()):
+        try:
+            job_id = start_pipeline(os.path.splitext(item["filename"])[0], options["stages"], options["pipeline"], batch["priority"])
+        except Exception as e:
+            database.update_batch_items(batch["id"], [(item["position"], {"state": "READY", "dispatched_at": None})])
+            print(f"Failed to start pipeline for batch {batch['id']} item {item['position']}: {e}")
+            break
+        database.update_batch_items(batch["id"], [(item["position"], {"job_id": job_id})])
+        started += 1
+    return started
+
+
+# 批次的调度循环：每隔 BATCH_POLL_SECONDS 更新进度并补充新的流水线，全部结束后停止
+# 进度由 worker 轮询，客户端只需查询一次批次状态
+@celery_app.task(queue=DEFAULT_QUEUE)
+def dispatch_batch(batch_id: str, token: str):
+    batch = database.get_batch(batch_id)
+    if batch is None or batch["dispatch_token"] != token or batch["finished_at"]:
+        return {"stopped": True}
+
+    refresh_batch_items(batch_id)
+    started = start_batch_items(batch)
+    counts = database.batch_state_counts(batch_id)
+    if not any(counts.get(state) for state in ("PENDING", "READY", "RUNNING")):
+        database.finish_batch(batch_id, datetime.now().isoformat())
+        return {"finished": True, "counts": counts}
+    dispatch_batch.apply_async((batch_id, token), countdown=BATCH_POLL_SECONDS)
+    return {"started": started, "counts": counts}
+
+
+# 启动或重新启动批次的调度（以及未完成的导入），retry_failed=True 时失败的条目重新处理
+def resume_batch(batch_id, retry_failed=False, ingest=True):
+    if retry_failed:
+        database.retry_failed_batch_items(batch_id)
+    token = str(uuid4())
+    database.set_batch_dispatch_token(batch_id, token)
+    if ingest and database.batch_state_counts(batch_id).get("PENDING"):
+        ingest_batch_task.delay(batch_id)
+    dispatch_batch.delay(batch_id, token)
+
+
+# 批次状态：各状态的数量、整体进度与失败的条目
+def batch_status(batch_id, failure_limit=100):
+    batch = database.get_batch(batch_id)
+    if batch is None:
+        return None
+    counts = database.batch_state_counts(batch_id)
+    total = sum(counts.values())
+    done = counts.get("SUCCESS", 0) + counts.get("FAILURE", 0)
+    failures = [{
+        "position": item["position"],
+        "source_path": item["source_path"],
+        "filename": item["filename"],
+        "job_id": item["job_id"],
+        "error": item["error"]
+    } for item in database.list_batch_items(batch_id, ("FAILURE",), failure_limit)]
+    return {
+        "batch_id": batch["id"],
+        "source": batch["source"],
+        "created_at": batch["created_at"],
+        "finished_at": batch["finished_at"],
+        "status": "FINISHED" if batch["finished_at"] else "RUNNING",
+        "options": json.loads(batch["options"]),
+        "max_in_flight": batch["max_in_flight"],
+        "total": total,
+        "counts": counts,
+        "progress": round(done / total * 100, 2) if total else 100.0,
+        "failures": failures
+    }
+
+
+# ---------------- 磁盘配额 ----------------
+# 由 celery beat 定期执行：同步派生文件登记表，删除遗留文件、压缩冷数据、超出 output_quota_mb 时按 LRU 淘汰，
+# 同时按 artifact_cache_budget_mb 清理产物缓存，并删除超过 upload_ttl_hours 的未完成上传
+DISK_QUOTA_INTERVAL_SECONDS = int(os.getenv("disk_quota_interval_seconds", "3600"))
+UPLOAD_TTL_HOURS = float(os.getenv("upload_ttl_hours", "24"))  # 未完成的上传超过这么久没有写入新数据即视为放弃
+
+celery_app.conf.beat_schedule = {
+    "enforce-disk-quota": {"task": "celery_server.enforce_disk_quota", "schedule": DISK_QUOTA_INTERVAL_SECONDS},
+}
+
+
+# 清理放弃的上传：视频目录中长时间未写入的 .part 文件（断点续传会话或中断的流式上传）直接删除，
+# 文件已不存在的过期会话一并删除；登记表扫描会跳过 .part 文件，只能在这里回收。返回释放的字节数
+def sweep_abandoned_uploads(ttl_seconds=None):
+    ttl_seconds = UPLOAD_TTL_HOURS * 3600 if ttl_seconds is None else ttl_seconds
+    stale_before = time.time() - ttl_seconds
+    reclaimed = 0
+    if os.path.isdir(VIDEO_DIR):
+        for entry in os.scandir(VIDEO_DIR):
+            if not entry.name.endswith(".part") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+                if stat.st_mtime < stale_before:
+                    os.remove(entry.path)
+                    reclaimed += stat.st_size
+            except FileNotFoundError:
+                continue
+
+    for upload in database.list_uploads_created_before(datetime.fromtimestamp(stale_before).isoformat()):
+        if not os.path.exists(os.path.join(VIDEO_DIR, upload["filename"] + ".part")):
+            database.delete_upload(upload["id"])
+    return reclaimed
+
+
+@celery_app.task(**MEDIA_TASK_OPTIONS)
+def enforce_disk_quota():
+    report = artifact_registry.enforce_quota()
+    report["reclaimed_bytes"]["artifact_cache"] = artifact_cache.enforce_budget()
+    report["reclaimed_bytes"]["abandoned_uploads"] = sweep_abandoned_uploads()
+    for reason, size in report["reclaimed_bytes"].items():
+        metrics.ARTIFACT_RECLAIMED_BYTES.labels(reason).inc(size)
+    report["reclaimed_total_bytes"] = sum(report["reclaimed_bytes"].values())
+    print(f"disk quota: reclaimed {report['reclaimed_total_bytes'] / 1024 / 1024:.1f} MB "
+          f"({report['evicted']} evicted, {report['compressed']} compressed, {report['orphans_removed']} orphans), "
+          f"{report['total_bytes'] / 1024 / 1024:.1f} MB in use")
+    return report
@@ -0,0 +1,341 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# 数据库文件位置
+DATABASE_URL = "sqlite.db"
+DB_POOL_SIZE = int(os.getenv("db_pool_size", "8"))  # 每个进程的连接池大小
+DB_BUSY_TIMEOUT_MS = int(os.getenv("db_busy_timeout_ms", "10000"))  # 写锁等待时间
+
+# 视频处理状态列
+VIDEO_STATE_COLUMNS = ("audio_ready", "transcript_ready", "analysis_ready")
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _connect():
+    conn = sqlite3.connect(DATABASE_URL, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # WAL 模式下读写互不阻塞，多个 worker 并发写入时由 busy_timeout 排队
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    # celery prefork 会在 fork 后的子进程中使用，连接不能跨进程共享，按进程重新创建连接池
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+# 从连接池借出连接，正常结束时提交，出错时回滚
+@contextmanager
+def get_db():
+    pool = _get_pool()
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+# 关闭当前进程连接池中的所有连接
+def close_pool():
+    pool = _get_pool()
+    while True:
+        try:
+            pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+
+# 创建数据库表，并为旧数据库补充新增的列和索引
+def init_db():
+    with get_db() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS videos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL,
+                size REAL NOT NULL,
+                upload_time TEXT NOT NULL
+            )
+        """)
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(videos)")]
+        # 内容哈希，用于识别重复上传的视频
+        if "content_hash" not in columns:
+            conn.execute("ALTER TABLE videos ADD COLUMN content_hash TEXT")
+        # 各处理阶段是否已完成
+        for column in VIDEO_STATE_COLUMNS:
+            if column not in columns:
+                conn.execute(f"ALTER TABLE videos ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_content_hash ON videos (content_hash)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_upload_time ON videos (upload_time, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_filename ON videos (filename)")
+        # 分片/断点续传的上传会话
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS uploads (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                size INTEGER,
+                transcribe INTEGER NOT NULL DEFAULT 1,
+                created_at TEXT NOT NULL
+            )
+        """)
+        # 端到端处理流水线：一个作业对应一个视频，每个阶段一行记录状态、耗时与产物
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pipeline_jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                options TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pipeline_stages (
+                job_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                state TEXT NOT NULL DEFAULT 'PENDING',
+                started_at REAL,
+                finished_at REAL,
+                artifacts TEXT,
+                error TEXT,
+                PRIMARY KEY (job_id, stage)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pipeline_jobs_filename ON pipeline_jobs (filename)")
+        # 批量导入：一个批次对应一个目录或清单，每个视频一行，记录导入与处理状态
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS batches (
+                id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                options TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                max_in_flight INTEGER NOT NULL,
+                dispatch_token TEXT,
+                created_at TEXT NOT NULL,
+                finished_at TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS batch_items (
+                batch_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                source_path TEXT NOT NULL,
+                filename TEXT,
+                job_id TEXT,
+                state TEXT NOT NULL DEFAULT 'PENDING',
+                dispatched_at REAL,
+                error TEXT,
+                PRIMARY KEY (batch_id, position)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_batches_source ON batches (source, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_batch_items_state ON batch_items (state, batch_id)")
+
+init_db()
+
+
+# 保存视频信息到数据库，返回新记录的 id
+def save_video_info(filename, size, upload_time, content_hash=None):
+    with get_db() as conn:
+        cursor = conn.execute("INSERT INTO videos (filename, size, upload_time, content_hash) VALUES (?, ?, ?, ?)",
+                              (filename, size, upload_time, content_hash))
+        return cursor.lastrowid
+
+
+# 查找内容相同的已上传视频
+def find_video_by_hash(content_hash):
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM videos WHERE content_hash = ? ORDER BY id LIMIT 1", (content_hash,)).fetchone()
+
+
+# 按文件名查找视频，filename 可以带或不带 .mp4 后缀
+def find_video_by_filename(filename):
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM videos WHERE filename IN (?, ?) ORDER BY id LIMIT 1",
+                            (filename, filename + ".mp4")).fetchone()
+
+
+# 更新视频的处理状态，例如 set_video_state(filename, transcript_ready=True)
+def set_video_state(filename, **states):
+    states = {column: int(bool(value)) for column, value in states.items() if column in VIDEO_STATE_COLUMNS}
+    if not states:
+        return
+    assignments = ", ".join(f"{column} = ?" for column in states)
+    with get_db() as conn:
+        conn.execute(f"UPDATE videos SET {assignments} WHERE filename IN (?, ?)",
+                     list(states.values()) + [filename, filename + ".mp4"])
+
+
+def create_upload(upload_id, filename, size, transcribe, created_at):
+    with get_db() as conn:
+        conn.execute("INSERT INTO uploads (id, filename, size, transcribe, created_at) VALUES (?, ?, ?, ?, ?)",
+                     (upload_id, filename, size, int(bool(transcribe)), created_at))
+
+
+def get_upload(upload_id):
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+
+
+def delete_upload(upload_id):
+    with get_db() as conn:
+        conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+
+
+def list_uploads_created_before(created_before):
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM uploads WHERE created_at < ?", (created_before,)).fetchall()
+
+
+def create_pipeline_job(job_id, filename, options, stages, created_at):
+    with get_db() as conn:
+        conn.execute("INSERT INTO pipeline_jobs (id, filename, options, created_at) VALUES (?, ?, ?, ?)",
+                     (job_id, filename, json.dumps(options), created_at))
+        conn.executemany("INSERT INTO pipeline_stages (job_id, stage, position) VALUES (?, ?, ?)",
+                         [(job_id, stage, position) for position, stage in enumerate(stages)])
+
+
+# 更新某个阶段的状态，例如 update_pipeline_stage(job_id, "transcribe", state="RUNNING", started_at=time.time())
+def update_pipeline_stage(job_id, stage, **fields):
+    if "artifacts" in fields:
+        fields["artifacts"] = json.dumps(fields["artifacts"], ensure_ascii=False)
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    with get_db() as conn:
+        conn.execute(f"UPDATE pipeline_stages SET {assignments} WHERE job_id = ? AND stage = ?",
+                     list(fields.values()) + [job_id, stage])
+
+
+# 删除视频时一并删除其流水线作业记录
+def delete_pipeline_jobs(filename):
+    with get_db() as conn:
+        conn.execute("DELETE FROM pipeline_stages WHERE job_id IN (SELECT id FROM pipeline_jobs WHERE filename = ?)", (filename,))
+        conn.execute("DELETE FROM pipeline_jobs WHERE filename = ?", (filename,))
+
+
+def get_pipeline_job(job_id):
+    with get_db() as conn:
+        job = conn.execute("SELECT * FROM pipeline_jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None, []
+        stages = conn.execute("SELECT * FROM pipeline_stages WHERE job_id = ? ORDER BY position", (job_id,)).fetchall()
+    return job, stages
+
+
+# ---------------- 批量导入 ----------------
+# 批次与其中所有视频在一个事务中写入
+def create_batch(batch_id, source, options, priority, max_in_flight, source_paths, created_at):
+    with get_db() as conn:
+        conn.execute("INSERT INTO batches (id, source, options, priority, max_in_flight, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                     (batch_id, source, json.dumps(options), priority, max_in_flight, created_at))
+        conn.executemany("INSERT INTO batch_items (batch_id, position, source_path) VALUES (?, ?, ?)",
+                         [(batch_id, position, path) for position, path in enumerate(source_paths)])
+
+
+def get_batch(batch_id):
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+
+
+# 同一来源最近的批次，命令行重新运行时从这里继续
+def find_latest_batch(source):
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM batches WHERE source = ? ORDER BY created_at DESC LIMIT 1", (source,)).fetchone()
+
+
+def list_batch_items(batch_id, states=None, limit=None):
+    query = "SELECT * FROM batch_items WHERE batch_id = ?"
+    params = [batch_id]
+    if states:
+        query += f" AND state IN ({', '.join('?' for _ in states)})"
+        params += list(states)
+    query += " ORDER BY position"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    with get_db() as conn:
+        return conn.execute(query, params).fetchall()
+
+
+def batch_state_counts(batch_id):
+    with get_db() as conn:
+        rows = conn.execute("SELECT state, COUNT(*) AS count FROM batch_items WHERE batch_id = ? GROUP BY state", (batch_id,))
+        return {row["state"]: row["count"] for row in rows}
+
+
+# 一个事务登记一组已导入的视频，rows 为 [(position, filename, size, content_hash)]
+# 只登记仍处于 PENDING 的条目，同一批次被并发导入时不会重复写入 videos
+def register_batch_videos(batch_id, rows, upload_time):
+    with get_db() as conn:
+        for position, filename, size, content_hash in rows:
+            cursor = conn.execute("UPDATE batch_items SET filename = ?, state = 'READY', error = NULL "
+                                  "WHERE batch_id = ? AND position = ? AND state = 'PENDING'", (filename, batch_id, position))
+            if cursor.rowcount:
+                conn.execute("INSERT INTO videos (filename, size, upload_time, content_hash) VALUES (?, ?, ?, ?)",
+                             (filename, size, upload_time, content_hash))
+
+
+# 更新一组条目，updates 为 [(position, {column: value})]
+def update_batch_items(batch_id, updates):
+    with get_db() as conn:
+        for position, fields in updates:
+            assignments = ", ".join(f"{column} = ?" for column in fields)
+            conn.execute(f"UPDATE batch_items SET {assignments} WHERE batch_id = ? AND position = ?",
+                         list(fields.values()) + [batch_id, position])
+
+
+# 领取可以开始处理的条目：本批次与所有批次正在处理的数量都不超过上限
+# BEGIN IMMEDIATE 先拿到写锁，多个调度任务同时运行时计数与领取不会交错
+def claim_batch_items(batch_id, max_in_flight, global_limit, claimed_at):
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        running_total = conn.execute("SELECT COUNT(*) FROM batch_items WHERE state = 'RUNNING'").fetchone()[0]
+        running = conn.execute("SELECT COUNT(*) FROM batch_items WHERE batch_id = ? AND state = 'RUNNING'", (batch_id,)).fetchone()[0]
+        capacity = min(max_in_flight - running, global_limit - running_total)
+        if capacity <= 0:
+            return []
+        items = conn.execute("SELECT * FROM batch_items WHERE batch_id = ? AND state = 'READY' ORDER BY position LIMIT ?",
+                             (batch_id, capacity)).fetchall()
+        conn.executemany("UPDATE batch_items SET state = 'RUNNING', job_id = NULL, dispatched_at = ? WHERE batch_id = ? AND position = ?",
+                         [(claimed_at, batch_id, item["position"]) for item in items])
+        return items
+
+
+# 重新处理失败的条目：已导入的从处理开始，未导入的从导入开始
+def retry_failed_batch_items(batch_id):
+    with get_db() as conn:
+        conn.execute("UPDATE batch_items SET state = CASE WHEN filename IS NULL THEN 'PENDING' ELSE 'READY' END, "
+                     "job_id = NULL, error = NULL WHERE batch_id = ? AND state = 'FAILURE'", (batch_id,))
+
+
+# 更换调度令牌：旧的调度任务发现令牌不一致后自行退出，保证每个批次只有一个调度循环
+def set_batch_dispatch_token(batch_id, token):
+    with get_db() as conn:
+        conn.execute("UPDATE batches SET dispatch_token = ?, finished_at = NULL WHERE id = ?", (token, batch_id))
+
+
+def finish_batch(batch_id, finished_at):
+    with get_db() as conn:
+        conn.execute("UPDATE batches SET finished_at = ? WHERE id = ?", (finished_at, batch_id))
@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import metrics
+
+# 大模型回复缓存：键为 模型 + 系统提示词 + 输入内容哈希，值为接口返回的完整 JSON
+# 默认存放在 SQLite，设置 llm_cache_url=redis://... 时改用 Redis，多台机器可共享
+LLM_CACHE_ENABLED = os.getenv("llm_cache_enabled", "1") != "0"
+LLM_CACHE_URL = os.getenv("llm_cache_url", "")
+LLM_CACHE_DB = os.getenv("llm_cache_db", "llm_cache.db")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("llm_cache_ttl_seconds", str(30 * 24 * 3600)))  # 过期时间
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("llm_cache_max_entries", "100000"))  # 条目上限，超出后淘汰最久未访问的
+
+REDIS_PREFIX = "llm_cache:"
+COUNTER_NAMES = ("hits", "misses", "shared", "errors")
+
+_redis = None
+# single-flight：(事件循环 id, key) -> Future，只合并同一事件循环（同一进程）内的相同请求，
+# 多个 uvicorn 进程或 celery 子进程之间不会合并，各自都可能调用一次接口
+_async_inflight = {}
+
+
+def make_key(model, system_prompt, user_content, response_format=None):
+    input_digest = hashlib.sha256(user_content.encode("utf-8")).hexdigest()
+    raw = json.dumps([model, system_prompt, input_digest, response_format], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(LLM_CACHE_URL)
+    return _redis
+
+
+def _get_db_connection():
+    conn = sqlite3.connect(LLM_CACHE_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def create_cache_tables():
+    if LLM_CACHE_URL:
+        return
+    conn = _get_db_connection()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS llm_cache_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+create_cache_tables()
+
+
+_STATS_UPSERT = ("INSERT INTO llm_cache_stats (name, value) VALUES (?, 1) "
+                 "ON CONFLICT(name) DO UPDATE SET value = value + 1")
+
+
+def _incr(name):
+    metrics.LLM_CACHE_EVENTS.labels(name).inc()
+    try:
+        if LLM_CACHE_URL:
+            _get_redis().hincrby(REDIS_PREFIX + "stats", name, 1)
+        else:
+            conn = _get_db_connection()
+            conn.execute(_STATS_UPSERT, (name,))
+            conn.commit()
+            conn.close()
+    except Exception as e:
+        print(f"llm cache counter update failed: {e}")
+
+
+# 读取缓存，未命中或已过期返回 None；命中时访问时间与命中计数在同一次提交中更新
+def lookup(key):
+    now = time.time()
+    if LLM_CACHE_URL:
+        client = _get_redis()
+        value = client.get(REDIS_PREFIX + key)
+        if value is None:
+            return None
+        pipe = client.pipeline(transaction=False)
+        pipe.zadd(REDIS_PREFIX + "access", {key: now})
+        pipe.hincrby(REDIS_PREFIX + "stats", "hits", 1)
+        pipe.execute()
+        metrics.LLM_CACHE_EVENTS.labels("hits").inc()
+        return json.loads(value)
+
+    conn = _get_db_connection()
+    row = conn.execute("SELECT response, created_at FROM llm_cache WHERE cache_key = ?", (key,)).fetchone()
+    if row is None:
+        conn.close()
+        return None
+    if now - row["created_at"] > LLM_CACHE_TTL_SECONDS:
+        conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (key,))
+        conn.commit()
+        conn.close()
+        return None
+    conn.execute("UPDATE llm_cache SET last_access = ? WHERE cache_key = ?", (now, key))
+    conn.execute(_STATS_UPSERT, ("hits",))
+    conn.commit()
+    conn.close()
+    metrics.LLM_CACHE_EVENTS.labels("hits").inc()
+    return json.loads(row["response"])
+
+
+def save(key, response):
+    now = time.time()
+    value = json.dumps(response, ensure_ascii=False)
+    if LLM_CACHE_URL:
+        client = _get_redis()
+        client.set(REDIS_PREFIX + key, value, ex=LLM_CACHE_TTL_SECONDS)
+        client.zadd(REDIS_PREFIX + "access", {key: now})
+        # 超出条目上限时淘汰最久未访问的键
+        overflow = client.zcard(REDIS_PREFIX + "access") - LLM_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            stale = client.zrange(REDIS_PREFIX + "access", 0, overflow - 1)
+            client.delete(*[REDIS_PREFIX + k.decode("utf-8") for k in stale])
+            client.zrem(REDIS_PREFIX + "access", *stale)
+        return
+
+    conn = _get_db_connection()
+    conn.execute("INSERT OR REPLACE INTO llm_cache (cache_key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                 (key, value, now, now))
+    conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - LLM_CACHE_TTL_SECONDS,))
+    count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+    if count > LLM_CACHE_MAX_ENTRIES:
+        conn.execute("DELETE FROM llm_cache WHERE cache_key IN "
+                     "(SELECT cache_key FROM llm_cache ORDER BY last_access LIMIT ?)", (count - LLM_CACHE_MAX_ENTRIES,))
+    conn.commit()
+    conn.close()
+
+
+# 缓存读写失败（Redis 不可用、SQLite 被锁等）不影响接口调用：读取失败按未命中处理，写入失败时跳过
+def _try_lookup(key):
+    try:
+        return lookup(key)
+    except Exception as e:
+        print(f"llm cache lookup failed: {e}")
+        return None
+
+
+def _try_save(key, response):
+    try:
+        save(key, response)
+    except Exception as e:
+        print(f"llm cache save failed: {e}")
+
+
+def forget(key):
+    try:
+        if LLM_CACHE_URL:
+            client = _get_redis()
+            client.delete(REDIS_PREFIX + key)
+            client.zrem(REDIS_PREFIX + "access", key)
+        else:
+            conn = _get_db_connection()
+            conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (key,))
+            conn.commit()
+            conn.close()
+    except Exception as e:
+        print(f"llm cache delete failed: {e}")
+
+
+def _is_valid(valid, response):
+    try:
+        return valid is None or bool(valid(response))
+    except Exception:
+        return False
+
+
+# call 为返回协程的函数；缓存读写都是同步的 SQLite/Redis 调用，放到线程池中执行，不阻塞事件循环
+# valid 检查回复能否被调用方使用（例如能否解析为 JSON），不通过的回复照常返回但不写入缓存，已缓存的视为未命中并删除
+async def aget_or_call(key, call, valid=None):
+    if not LLM_CACHE_ENABLED:
+        return await call()
+    cached = await asyncio.to_thread(_try_lookup, key)
+    if cached is not None:
+        if _is_valid(valid, cached):
+            return cached
+        await asyncio.to_thread(forget, key)
+
+    inflight_key = (id(asyncio.get_running_loop()), key)
+    future = _async_inflight.get(inflight_key)
+    if future is not None:
+        await asyncio.to_thread(_incr, "shared")
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    _async_inflight[inflight_key] = future
+    try:
+        await asyncio.to_thread(_incr, "misses")
+        response = await call()
+        if _is_valid(valid, response):
+            await asyncio.to_thread(_try_save, key, response)
+        future.set_result(response)
+        return response
+    except Exception as e:
+        await asyncio.to_thread(_incr, "errors")
+        future.set_exception(e)
+        # 没有其他等待者时避免 "exception was never retrieved" 警告
+        future.exception()
+        raise
+    finally:
+        _async_inflight.pop(inflight_key, None)
+
+
+def stats():
+    if LLM_CACHE_URL:
+        client = _get_redis()
+        raw = client.hgetall(REDIS_PREFIX + "stats")
+        counters = {name: int(raw.get(name.encode("utf-8"), 0)) for name in COUNTER_NAMES}
+        entries = client.zcard(REDIS_PREFIX + "access")
+    else:
+        conn = _get_db_connection()
+        rows = conn.execute("SELECT name, value FROM llm_cache_stats").fetchall()
+        entries = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        conn.close()
+        counters = {name: 0 for name in COUNTER_NAMES}
+        counters.update({row["name"]: row["value"] for row in rows})
+    lookups = counters["hits"] + counters["misses"] + counters["shared"]
+    return dict(counters, entries=entries,
+                hit_rate=round((counters["hits"] + counters["shared"]) / lookups, 4) if lookups else 0.0)
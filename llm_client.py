@@ -0,0 +1,374 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+import llm_cache
+import metrics
+
+# 加载环境变量
+load_dotenv()  # 加载 .env 文件中的变量
+API_KEY = os.getenv("api_key")  # 从环境变量读取 API 密钥
+API_URL = os.getenv("api_url")  # 从环境变量读取 API URL
+
+LLM_TIMEOUT_SECONDS = float(os.getenv("llm_timeout_seconds", "120"))  # 单次请求超时
+LLM_MAX_CONNECTIONS = int(os.getenv("llm_max_connections", "20"))  # 连接池大小
+LLM_MAX_RETRIES = int(os.getenv("llm_max_retries", "5"))  # 失败重试次数
+LLM_TOKENS_PER_MINUTE = int(os.getenv("llm_tokens_per_minute", "60000"))  # 每分钟 token 限额，0 表示不限制
+
+SUMMARY_CHUNK_CHARS = int(os.getenv("summary_chunk_chars", "12000"))  # 长文本分块总结时每块的最大字符数
+LLM_MAP_CONCURRENCY = int(os.getenv("llm_map_concurrency", "8"))  # 分块总结/评价时同时进行的请求数
+
+TRANSLATE_MODEL = "gpt-3.5-turbo"
+TRANSLATE_BATCH_SIZE = int(os.getenv("translate_batch_size", "20"))  # 每次请求打包的字幕行数
+TRANSLATE_CONCURRENCY = int(os.getenv("translate_concurrency", "8"))  # 同时进行的翻译请求数
+
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMRequestError(Exception):
+    pass
+
+
+# 创建带连接复用的异步 HTTP 客户端
+def create_http_client():
+    return httpx.AsyncClient(
+        headers={"Authorization": f"Bearer {API_KEY}"},
+        timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=10.0),
+        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+    )
+
+
+# 粗略估算 token 数，用于限速
+def estimate_tokens(messages):
+    return sum(len(message["content"]) for message in messages) // 2 + 16
+
+
+# 令牌桶限速：按每分钟 token 数匀速补充
+class TokenRateLimiter:
+    def __init__(self, tokens_per_minute=LLM_TOKENS_PER_MINUTE):
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = tokens_per_minute
+        self.tokens = tokens_per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens):
+        if self.rate <= 0:
+            return
+        tokens = min(tokens, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+def _retry_delay(attempt, response=None):
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after and retry_after.replace(".", "", 1).isdigit():
+            return float(retry_after)
+    return min(30.0, 2 ** attempt) + random.random()
+
+
+# 调用对话接口并返回回复内容，相同请求优先读取缓存；valid 检查回复内容，不通过的不写入缓存
+async def chat_completion(client, model, system_prompt, user_content, response_format=None, rate_limiter=None, valid=None):
+    valid_response = (lambda response: valid(response['choices'][0]['message']['content'])) if valid else None
+    response = await chat_completion_response(client, model, system_prompt, user_content, response_format, rate_limiter,
+                                              valid_response)
+    return response['choices'][0]['message']['content']
+
+
+# 调用对话接口并返回完整的响应 JSON，网络错误、限流和 5xx 按指数退避重试
+async def chat_completion_response(client, model, system_prompt, user_content, response_format=None, rate_limiter=None,
+                                   valid=None):
+    key = llm_cache.make_key(model, system_prompt, user_content, response_format)
+    return await llm_cache.aget_or_call(
+        key, lambda: _post_chat_completion(client, model, system_prompt, user_content, response_format, rate_limiter),
+        valid)
+
+
+async def _post_chat_completion(client, model, system_prompt, user_content, response_format, rate_limiter):
+    data = {
+        "model": model,
+        "messages": [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": user_content
+            }
+        ]
+    }
+    if response_format:
+        data["response_format"] = response_format
+
+    start = time.perf_counter()
+    error = None
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if rate_limiter:
+            await rate_limiter.acquire(estimate_tokens(data["messages"]))
+        response = None
+        try:
+            response = await client.post(API_URL, json=data)
+        except httpx.TransportError as e:
+            metrics.LLM_ERRORS.labels(model, "transport").inc()
+            error = LLMRequestError(f"API request failed: {e}")
+        else:
+            if response.status_code == 200:
+                result = response.json()
+                metrics.LLM_REQUEST_SECONDS.labels(model, "success").observe(time.perf_counter() - start)
+                usage = result.get("usage") or {}
+                for kind in ("prompt_tokens", "completion_tokens"):
+                    metrics.LLM_TOKENS.labels(model, kind).inc(usage.get(kind, 0))
+                return result
+            metrics.LLM_ERRORS.labels(model, str(response.status_code)).inc()
+            error = LLMRequestError(f"API request failed with status code {response.status_code}")
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+        if attempt < LLM_MAX_RETRIES:
+            await asyncio.sleep(_retry_delay(attempt, response))
+    metrics.LLM_REQUEST_SECONDS.labels(model, "error").observe(time.perf_counter() - start)
+    raise error
+
+
+# 在没有共享客户端的场景（如 celery 任务）中临时创建客户端执行
+async def run_with_client(func, *args):
+    async with create_http_client() as client:
+        return await func(client, *args)
+
+
+SUMMARY_MODEL = "gpt-3.5-turbo"
+SUMMARY_PROMPT = "你现在是一个文本总结接口，请使用中文总结这段文字:"
+
+EVALUATION_MODEL = "gpt-3.5-turbo"
+EVALUATION_PROMPT = """
+        我们的评分标准包括以下几个维度：
+        内容分析：研究演讲的主题，信息的详细程度，以及其传递的核心信息和观点。也可以考察其是否涉及特定的政治、社会或文化议题。
+        语言风格：分析演讲者使用的语言特点，如词汇的选择、句式结构、修辞手法（比如比喻、反问、排比）等，以及这些元素如何影响信息的传达。
+        逻辑结构：评估演讲的组织结构，包括论点的提出、论据的支持、结论的得出，以及这些元素如何协同工作以加强演讲的说服力。
+        情感表达：分析演讲中的情感色彩，例如热情、愤怒、同情等，以及这些情感如何与听众的共鸣和反应相联系。
+        目标受众：考虑演讲是如何针对特定听众群体的需求和期望进行定制的，包括使用的语言、内容的选择以及呈现方式。
+        文化和历史背景：考虑演讲在特定的文化和历史背景下的意义，以及它如何反映或影响当时的社会环境。
+        批判性分析：从批判性角度审视演讲的内容，包括其可能的偏见、误导性陈述或遗漏的重要视角。
+        
+        您需要在每个维度上进行0到10分的打分，并给出您的中文评语
+        
+        返回格式为json，示例如下
+        
+        {
+            “内容分析”:{
+                score:,
+                comments:
+            },
+            “语言风格”:{
+                score:,
+                comments:
+            },
+            “逻辑结构”:{
+                score:,
+                comments:
+            },
+            “情感表达”:{
+                score:,
+                comments:
+            },
+            “目标受众”:{
+                score:,
+                comments:
+            },
+            “文化和历史背景”:{
+                score:,
+                comments:
+            },
+            “批判性分析”:{
+                score:,
+                comments:
+            },		
+        }
+        """
+
+
+# 长文本分块处理时使用的提示词，{index}/{total} 会替换为块序号
+SUMMARY_MAP_PROMPT = "下面是一段演讲转录文本的第 {index}/{total} 部分，请使用中文总结这部分的内容要点:"
+SUMMARY_REDUCE_PROMPT = "下面是同一段演讲按顺序各部分的中文摘要，请把它们整合成一份连贯、完整的中文总结:"
+EVALUATION_MAP_PROMPT = "下面是一段演讲转录文本的第 {index}/{total} 部分，请只根据这部分内容评分。\n" + EVALUATION_PROMPT
+EVALUATION_REDUCE_PROMPT = EVALUATION_PROMPT + """
+        用户给出的是同一场演讲按顺序各部分的评价结果（json），请综合这些分段评价，对整场演讲给出最终评价，
+        分数应结合演讲整体表现，而不是简单平均，返回格式同上。
+        """
+
+
+async def summarize_text(client, text):
+    return await chat_completion(client, SUMMARY_MODEL, SUMMARY_PROMPT, text)
+
+
+def parse_evaluation(evaluation_str):
+    try:
+        # 尝试将字符串解析为 JSON 对象
+        return json.loads(evaluation_str)
+    except json.JSONDecodeError:
+        raise LLMRequestError("Failed to parse the evaluation string into JSON")
+
+
+# 不能解析的评价不写入缓存，下次请求会重新调用接口
+def _valid_json(content):
+    try:
+        json.loads(content)
+    except ValueError:
+        return False
+    return True
+
+
+async def evaluate_text(client, text):
+    return parse_evaluation(await chat_completion(client, EVALUATION_MODEL, EVALUATION_PROMPT, text, valid=_valid_json))
+
+
+# 按字幕边界把文本拼成不超过 max_chars 的块；单条字幕过长时按字符硬切
+def split_into_chunks(texts, max_chars):
+    chunks = []
+    current = []
+    size = 0
+    for text in texts:
+        text = text.strip()
+        if not text:
+            continue
+        while len(text) > max_chars:
+            if current:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            chunks.append(text[:max_chars])
+            text = text[max_chars:]
+        if current and size + len(text) > max_chars:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(text)
+        size += len(text) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+# 并发处理每个块，耗时取决于最慢的一块
+async def _map_chunks(client, model, prompt, chunks):
+    semaphore = asyncio.Semaphore(LLM_MAP_CONCURRENCY)
+
+    async def run(index, chunk):
+        system_prompt = prompt.replace("{index}", str(index + 1)).replace("{total}", str(len(chunks)))
+        async with semaphore:
+            return await chat_completion(client, model, system_prompt, chunk)
+
+    return await asyncio.gather(*(run(index, chunk) for index, chunk in enumerate(chunks)))
+
+
+# 分层归并：部分结果合起来仍超过块大小时，先分组归并，直到可以一次完成最终归并
+async def _reduce_partials(client, model, reduce_prompt, partials, valid=None):
+    for _ in range(8):
+        labeled = [f"第 {index + 1} 部分:\n{partial}" for index, partial in enumerate(partials)]
+        groups = split_into_chunks(labeled, SUMMARY_CHUNK_CHARS)
+        if len(groups) <= 1:
+            break
+        partials = await _map_chunks(client, model, reduce_prompt, groups)
+    return await chat_completion(client, model, reduce_prompt, "\n\n".join(groups), valid=valid)
+
+
+# 任意长度的演讲总结：短文本一次请求，长文本按字幕分块并行总结后归并
+async def summarize_segments(client, texts):
+    chunks = split_into_chunks(texts, SUMMARY_CHUNK_CHARS)
+    if len(chunks) <= 1:
+        return await summarize_text(client, chunks[0] if chunks else "")
+    partials = await _map_chunks(client, SUMMARY_MODEL, SUMMARY_MAP_PROMPT, chunks)
+    return await _reduce_partials(client, SUMMARY_MODEL, SUMMARY_REDUCE_PROMPT, partials)
+
+
+# 任意长度的演讲评价：长文本按字幕分块并行评分，再综合为七个维度的最终评价
+async def evaluate_segments(client, texts):
+    chunks = split_into_chunks(texts, SUMMARY_CHUNK_CHARS)
+    if len(chunks) <= 1:
+        return await evaluate_text(client, chunks[0] if chunks else "")
+    partials = await _map_chunks(client, EVALUATION_MODEL, EVALUATION_MAP_PROMPT, chunks)
+    return parse_evaluation(await _reduce_partials(client, EVALUATION_MODEL, EVALUATION_REDUCE_PROMPT, partials, _valid_json))
+
+
+TRANSLATE_BATCH_PROMPT = (
+    "你现在是一个翻译接口，请将用户给你的 JSON 中 lines 数组的每一项的 text 翻译成中文。"
+    "只返回 JSON 对象，格式为 {\"translations\": [{\"id\": 原 id, \"text\": 译文}]}，"
+    "每个 id 必须且只能出现一次，不要合并或拆分行。"
+)
+TRANSLATE_LINE_PROMPT = "你现在是一个翻译接口，请将用户给你的内容翻译成中文"
+
+
+def _parse_translations(content):
+    return {int(item["id"]): str(item["text"]) for item in json.loads(content)["translations"]}
+
+
+# 缺行或对不齐的回复不写入缓存，否则同一批字幕以后每次都会走拆分重试
+def _translations_complete(content, batch):
+    try:
+        translations = _parse_translations(content)
+    except (ValueError, KeyError, TypeError):
+        return False
+    return all(index in translations for index, _ in batch)
+
+
+async def _translate_batch(client, rate_limiter, semaphore, batch):
+    # 单行直接使用纯文本翻译
+    if len(batch) == 1:
+        index, text = batch[0]
+        async with semaphore:
+            return {index: await chat_completion(client, TRANSLATE_MODEL, TRANSLATE_LINE_PROMPT, text, rate_limiter=rate_limiter)}
+
+    payload = json.dumps({"lines": [{"id": index, "text": text} for index, text in batch]}, ensure_ascii=False)
+    translations = {}
+    try:
+        async with semaphore:
+            content = await chat_completion(client, TRANSLATE_MODEL, TRANSLATE_BATCH_PROMPT, payload,
+                                            response_format={"type": "json_object"}, rate_limiter=rate_limiter,
+                                            valid=lambda content: _translations_complete(content, batch))
+        translations.update(_parse_translations(content))
+    except (ValueError, KeyError, TypeError) as e:
+        # 只有回复缺行、对不齐或不能解析时才拆分；接口本身出错（LLMRequestError）直接抛出，不会拆成大量同样失败的请求
+        print(f"batch translation failed, splitting batch of {len(batch)}: {e}")
+
+    # 返回结果缺行或对不齐时，把缺失的行拆成两半重新翻译
+    missing = [(index, text) for index, text in batch if index not in translations]
+    if missing:
+        if len(missing) == len(batch):
+            middle = len(batch) // 2
+            parts = [missing[:middle], missing[middle:]]
+        else:
+            parts = [missing]
+        for result in await asyncio.gather(*(_translate_batch(client, rate_limiter, semaphore, part) for part in parts)):
+            translations.update(result)
+    return {index: translations[index] for index, _ in batch}
+
+
+# 并发、分批翻译字幕行，返回与输入顺序一致的译文列表；任意一行最终失败都会抛出异常，不会静默丢行
+async def translate_lines(lines, progress_callback=None):
+    rate_limiter = TokenRateLimiter()
+    semaphore = asyncio.Semaphore(TRANSLATE_CONCURRENCY)
+    indexed = list(enumerate(lines))
+    batches = [indexed[start:start + TRANSLATE_BATCH_SIZE] for start in range(0, len(indexed), TRANSLATE_BATCH_SIZE)]
+    translations = {}
+
+    async with create_http_client() as client:
+        async def run_batch(batch):
+            result = await _translate_batch(client, rate_limiter, semaphore, batch)
+            translations.update(result)
+            if progress_callback:
+                progress_callback(len(translations), len(lines))
+
+        await asyncio.gather(*(run_batch(batch) for batch in batches))
+
+    return [translations[index] for index in range(len(lines))]
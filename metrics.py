@@ -0,0 +1,129 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST, multiprocess
+
+# Prometheus 指标：API 与 celery worker 共用同一组指标
+# 多进程部署（uvicorn 多 worker、celery prefork）时设置 PROMETHEUS_MULTIPROC_DIR，各进程把指标写入该目录，由 /metrics 汇总
+# celery worker 在其他机器上时设置 worker_metrics_port，worker 主进程在该端口提供指标
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+WORKER_METRICS_PORT = int(os.getenv("worker_metrics_port", "0"))
+OTEL_ENABLED = os.getenv("otel_enabled", "0") != "0"  # 开启 OpenTelemetry 链路追踪，需要安装 opentelemetry 相关包
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TASK_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400)
+RTF_BUCKETS = (0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 4)
+
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "API request latency", ["method", "route", "status"],
+                                 buckets=LATENCY_BUCKETS)
+TASK_QUEUE_WAIT_SECONDS = Histogram("celery_task_queue_wait_seconds", "Time between publishing and starting a task",
+                                    ["task", "queue"], buckets=TASK_BUCKETS)
+TASK_RUN_SECONDS = Histogram("celery_task_run_seconds", "Task execution time", ["task", "queue", "state"], buckets=TASK_BUCKETS)
+TASKS_TOTAL = Counter("celery_tasks_total", "Finished tasks", ["task", "state"])
+PIPELINE_STAGE_SECONDS = Histogram("pipeline_stage_seconds", "Pipeline stage duration", ["stage", "state"], buckets=TASK_BUCKETS)
+
+MODEL_LOAD_SECONDS = Histogram("transcription_model_load_seconds", "Transcription model load time", ["backend", "model"],
+                               buckets=TASK_BUCKETS)
+TRANSCRIPTION_RTF = Histogram("transcription_real_time_factor", "Transcription time divided by audio duration",
+                              ["backend", "model"], buckets=RTF_BUCKETS)
+TRANSCRIBED_AUDIO_SECONDS = Counter("transcription_audio_seconds", "Seconds of audio transcribed", ["backend", "model"])
+MEDIA_COMMAND_SECONDS = Histogram("media_command_seconds", "ffmpeg command duration", ["kind"], buckets=TASK_BUCKETS)
+
+LLM_REQUEST_SECONDS = Histogram("llm_request_duration_seconds", "LLM API call latency including retries", ["model", "outcome"],
+                                buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the LLM API", ["model", "kind"])
+LLM_ERRORS = Counter("llm_errors_total", "Failed LLM API attempts", ["model", "reason"])
+LLM_CACHE_EVENTS = Counter("llm_cache_events_total", "LLM response cache lookups", ["event"])
+ARTIFACT_CACHE_EVENTS = Counter("artifact_cache_events_total", "Artifact cache lookups", ["kind", "event"])
+ARTIFACT_RECLAIMED_BYTES = Counter("artifact_reclaimed_bytes_total", "Disk space reclaimed by the disk quota job", ["reason"])
+
+
+def collect():
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# celery worker 主进程中调用，在 worker_metrics_port 上提供指标
+def start_worker_server():
+    if not WORKER_METRICS_PORT:
+        return
+    from prometheus_client import start_http_server
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(WORKER_METRICS_PORT, registry=registry)
+    else:
+        start_http_server(WORKER_METRICS_PORT)
+
+
+# 进程退出时清理多进程模式下该进程的 gauge 文件
+def mark_process_dead(pid):
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
+
+
+# ---------------- 链路追踪 ----------------
+_tracer = None
+
+
+# 开启后 FastAPI 请求与 celery 任务各自生成 span，任务消息头携带上下文，上传请求与之后的所有任务处于同一条链路
+def init_tracing(service_name, app=None, celery=False):
+    global _tracer
+    if not OTEL_ENABLED:
+        return
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        print(f"OpenTelemetry is not installed, tracing disabled: {e}")
+        return
+
+    if _tracer is None:
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+        _tracer = trace.get_tracer("visible-speech-system")
+    if app is not None:
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        FastAPIInstrumentor.instrument_app(app)
+    if celery:
+        from opentelemetry.instrumentation.celery import CeleryInstrumentor
+        CeleryInstrumentor().instrument()
+
+
+# 在当前链路中记录一个子阶段，未开启追踪时不做任何事
+@contextmanager
+def span(name, **attributes):
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+# 给当前 span 补充属性，例如上传请求对应的视频文件名，便于按视频查找整条链路
+def span_attributes(**attributes):
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+    current = trace.get_current_span()
+    for key, value in attributes.items():
+        if value is not None:
+            current.set_attribute(key, value)
+
+
+# 计时并记录到直方图
+@contextmanager
+def timed(histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
@@ -0,0 +1,141 @@
+import re
+
+import jieba
+
+import database
+import text_analysis
+
+# 字幕全文检索：每句字幕一行，分词结果写入 SQLite FTS5 索引
+# FTS5 自带的 unicode61 分词器不能切分中文，先用 jieba 分词后以空格连接再交给 FTS5
+TIME_PATTERN = re.compile(r"(?:(\d+):)?(\d+):(\d+)[,.](\d+)")
+SNIPPET_MAX_CHARS = 200
+
+
+def create_search_tables():
+    with database.get_db() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS transcript_segments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL,
+                language TEXT NOT NULL,
+                segment_index INTEGER NOT NULL,
+                start REAL NOT NULL,
+                end REAL NOT NULL,
+                text TEXT NOT NULL,
+                tokens TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_transcript_segments_file ON transcript_segments (filename, language)")
+        # 外部内容表：索引只保存倒排表，原文从 transcript_segments 读取，由触发器保持同步
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS transcript_search USING fts5(
+                tokens, content='transcript_segments', content_rowid='id'
+            )
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS transcript_segments_ai AFTER INSERT ON transcript_segments BEGIN
+                INSERT INTO transcript_search (rowid, tokens) VALUES (new.id, new.tokens);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS transcript_segments_ad AFTER DELETE ON transcript_segments BEGIN
+                INSERT INTO transcript_search (transcript_search, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+            END
+        """)
+
+create_search_tables()
+
+
+# 索引时使用搜索引擎模式分词，长词同时产生其中的短词，查询时按普通模式分词即可命中
+def tokenize(text, query=False):
+    text_analysis.init_jieba()
+    words = jieba.cut(text) if query else jieba.cut_for_search(text)
+    return [word.strip().lower() for word in words if text_analysis.WORD_PATTERN.search(word)]
+
+
+# 字幕时间：本项目写出的 srt 为秒数，兼容标准 srt 的 00:00:01,000 格式
+def parse_time(value):
+    value = value.strip()
+    match = TIME_PATTERN.fullmatch(value)
+    if match:
+        hours, minutes, seconds, millis = match.groups()
+        return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(millis) / 10 ** len(millis)
+    return float(value)
+
+
+# 将 {"time": "start --> end", "content": ...} 形式的字幕转换为带起止时间的字幕
+def entries_to_segments(entries):
+    segments = []
+    for entry in entries:
+        start, _, end = entry["time"].partition("-->")
+        try:
+            segments.append({"start": parse_time(start), "end": parse_time(end), "text": entry["content"]})
+        except ValueError:
+            continue
+    return segments
+
+
+# 重建某个视频某种语言的索引，只影响这一份字幕
+def index_segments(filename, language, segments):
+    rows = []
+    for index, segment in enumerate(segments):
+        tokens = tokenize(segment["text"])
+        if tokens:
+            rows.append((filename, language, index, segment["start"], segment["end"], segment["text"].strip(), " ".join(tokens)))
+    with database.get_db() as conn:
+        conn.execute("DELETE FROM transcript_segments WHERE filename = ? AND language = ?", (filename, language))
+        conn.executemany("INSERT INTO transcript_segments (filename, language, segment_index, start, end, text, tokens) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    return len(rows)
+
+
+def remove(filename, language=None):
+    with database.get_db() as conn:
+        if language:
+            conn.execute("DELETE FROM transcript_segments WHERE filename = ? AND language = ?", (filename, language))
+        else:
+            conn.execute("DELETE FROM transcript_segments WHERE filename = ?", (filename,))
+
+
+def _highlight(text, tokens):
+    if len(text) > SNIPPET_MAX_CHARS:
+        text = text[:SNIPPET_MAX_CHARS] + "…"
+    pattern = "|".join(re.escape(token) for token in sorted(set(tokens), key=len, reverse=True))
+    return re.sub(f"({pattern})", r"<b>\1</b>", text, flags=re.IGNORECASE) if pattern else text
+
+
+# 按 BM25 相关度排序分页检索，所有词都需出现（AND）
+# 返回 (结果列表, 是否还有下一页)
+def search(query, limit=20, offset=0, filename=None, language=None):
+    tokens = tokenize(query, query=True)
+    if not tokens:
+        return [], False
+    match = " ".join('"' + token.replace('"', '""') + '"' for token in tokens)
+
+    conditions = ["transcript_search MATCH ?"]
+    params = [match]
+    if filename:
+        conditions.append("s.filename = ?")
+        params.append(filename)
+    if language:
+        conditions.append("s.language = ?")
+        params.append(language)
+
+    with database.get_db() as conn:
+        rows = conn.execute(
+            "SELECT s.filename, s.language, s.segment_index, s.start, s.end, s.text, bm25(transcript_search) AS score "
+            "FROM transcript_search JOIN transcript_segments s ON s.id = transcript_search.rowid "
+            f"WHERE {' AND '.join(conditions)} ORDER BY score LIMIT ? OFFSET ?",
+            params + [limit + 1, offset]).fetchall()
+
+    results = [{
+        "filename": row["filename"],
+        "language": row["language"],
+        "segment_index": row["segment_index"],
+        "start": row["start"],
+        "end": row["end"],
+        "text": row["text"],
+        "snippet": _highlight(row["text"], tokens),
+        "score": round(-row["score"], 4)
+    } for row in rows[:limit]]
+    return results, len(rows) > limit
@@ -0,0 +1,247 @@
+import hashlib
+import os
+
+import numpy as np
+
+# 每个视频一份按列存储的字幕：起止时间、文本偏移、情感分数与翻译各为一列
+# 数值列为 .npy，可以内存映射读取；文本为 utf-8 拼接后的二进制文件加偏移数组，读取任意一段只需要一次 seek
+# txt / srt / 情感分析 json / 翻译 json 等旧格式都按需从这里生成
+SEGMENT_STORE_DIR = "output/segments"
+
+SENTIMENT_LABELS = {1: "positive", -1: "negative", 0: "neutral"}
+SENTIMENT_COLUMNS = ("sentiment.npy", "polarity.npy", "subjectivity.npy")
+TRANSLATION_COLUMNS = ("translation_offsets.npy", "translation.bin")
+SENTIMENT_SCORER_FILE = "sentiment_scorer.txt"  # 生成情感分析列的打分器名称
+
+
+def store_dir(filename):
+    return os.path.join(SEGMENT_STORE_DIR, filename)
+
+
+def column_path(filename, name):
+    return os.path.join(store_dir(filename), name)
+
+
+# start.npy 最后写入，存在即表示字幕已完整写入
+def exists(filename):
+    return os.path.exists(column_path(filename, "start.npy"))
+
+
+def has_sentiment(filename):
+    return all(os.path.exists(column_path(filename, name)) for name in SENTIMENT_COLUMNS)
+
+
+def has_translation(filename):
+    return all(os.path.exists(column_path(filename, name)) for name in TRANSLATION_COLUMNS)
+
+
+# 所有视频的字幕存储，按文件名排序
+def list_stores():
+    if not os.path.isdir(SEGMENT_STORE_DIR):
+        return []
+    return sorted(name for name in os.listdir(SEGMENT_STORE_DIR) if exists(name))
+
+
+def _save_array(path, array):
+    temp_path = path + ".part"
+    with open(temp_path, "wb") as file:
+        np.save(file, array)
+    os.replace(temp_path, path)
+
+
+def _save_bytes(path, data):
+    temp_path = path + ".part"
+    with open(temp_path, "wb") as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+
+def _encode_texts(texts):
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.array([len(data) for data in encoded], dtype=np.int64))
+    return offsets, b"".join(encoded)
+
+
+def _save_texts(filename, offsets_name, blob_name, texts):
+    offsets, blob = _encode_texts(texts)
+    _save_bytes(column_path(filename, blob_name), blob)
+    _save_array(column_path(filename, offsets_name), offsets)
+
+
+# 已保存的文本列与 texts 完全相同
+def _same_texts(filename, offsets_name, blob_name, texts):
+    blob_path = column_path(filename, blob_name)
+    offsets_path = column_path(filename, offsets_name)
+    if not (os.path.exists(blob_path) and os.path.exists(offsets_path)):
+        return False
+    offsets, blob = _encode_texts(texts)
+    if os.path.getsize(blob_path) != len(blob):
+        return False
+    with open(blob_path, "rb") as file:
+        if file.read() != blob:
+            return False
+    return np.array_equal(np.load(offsets_path), offsets)
+
+
+def _load(filename, name):
+    return np.load(column_path(filename, name), mmap_mode="r")
+
+
+# 只读取 [lo, hi) 范围内的文本
+def _read_texts(filename, offsets_name, blob_name, lo, hi):
+    offsets = _load(filename, offsets_name)
+    begin, finish = int(offsets[lo]), int(offsets[hi])
+    with open(column_path(filename, blob_name), "rb") as file:
+        file.seek(begin)
+        data = file.read(finish - begin)
+    return [data[int(offsets[i]) - begin:int(offsets[i + 1]) - begin].decode("utf-8") for i in range(lo, hi)]
+
+
+# 写入转录字幕，segments 为 [{"start", "end", "text"}]；文本变化后旧的情感分析与翻译随之失效
+# 文本不变时（例如只是从旧格式文件重新转换）保留文本列与情感分析、翻译列，文本列的修改时间也不变
+def write_segments(filename, segments):
+    os.makedirs(store_dir(filename), exist_ok=True)
+    texts = [segment["text"] for segment in segments]
+    same_texts = _same_texts(filename, "text_offsets.npy", "text.bin", texts)
+    stale = ("start.npy",) if same_texts else ("start.npy", SENTIMENT_SCORER_FILE) + SENTIMENT_COLUMNS + TRANSLATION_COLUMNS
+    for name in stale:
+        if os.path.exists(column_path(filename, name)):
+            os.remove(column_path(filename, name))
+    if not same_texts:
+        _save_texts(filename, "text_offsets.npy", "text.bin", texts)
+    _save_array(column_path(filename, "end.npy"), np.array([segment["end"] for segment in segments], dtype=np.float64))
+    _save_array(column_path(filename, "start.npy"), np.array([segment["start"] for segment in segments], dtype=np.float64))
+
+
+# scores 为 text_analysis.score_sentiment_batch 的结果；写入期间不标记打分器，写完后由调用方调用 set_sentiment_scorer
+def write_sentiment(filename, scores):
+    set_sentiment_scorer(filename, None)
+    labels = {label: value for value, label in SENTIMENT_LABELS.items()}
+    _save_array(column_path(filename, "sentiment.npy"), np.array([labels[score["sentiment"]] for score in scores], dtype=np.int8))
+    _save_array(column_path(filename, "polarity.npy"), np.array([score["polarity"] for score in scores], dtype=np.float32))
+    # 没有主观性分数的打分器记为 NaN
+    _save_array(column_path(filename, "subjectivity.npy"),
+                np.array([np.nan if score["subjectivity"] is None else score["subjectivity"] for score in scores], dtype=np.float32))
+
+
+# 记录情感分析列由哪个打分器生成，scorer 为 None 时清除记录
+def set_sentiment_scorer(filename, scorer):
+    path = column_path(filename, SENTIMENT_SCORER_FILE)
+    if scorer is None:
+        if os.path.exists(path):
+            os.remove(path)
+    else:
+        _save_bytes(path, scorer.encode("utf-8"))
+
+
+# 生成当前情感分析列的打分器，没有情感分析列或没有记录时返回 None
+def sentiment_scorer(filename):
+    path = column_path(filename, SENTIMENT_SCORER_FILE)
+    if not has_sentiment(filename) or not os.path.exists(path):
+        return None
+    with open(path, "rb") as file:
+        return file.read().decode("utf-8")
+
+
+def write_translation(filename, texts):
+    _save_texts(filename, "translation_offsets.npy", "translation.bin", texts)
+
+
+def count(filename):
+    return len(_load(filename, "start.npy"))
+
+
+# 字幕文本内容的哈希，情感分析与翻译的缓存以此为键
+def text_digest(filename):
+    digest = hashlib.sha256()
+    for name in ("text_offsets.npy", "text.bin"):
+        with open(column_path(filename, name), "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def texts(filename, lo=0, hi=None):
+    hi = count(filename) if hi is None else hi
+    return _read_texts(filename, "text_offsets.npy", "text.bin", lo, hi)
+
+
+# 与时间范围 [start, end) 有重叠的字幕下标范围，二分查找
+def time_range(filename, start=None, end=None):
+    starts = _load(filename, "start.npy")
+    ends = _load(filename, "end.npy")
+    lo, hi = 0, len(starts)
+    if start is not None:
+        lo = max(0, int(np.searchsorted(starts, start, side="right")) - 1)
+        while lo < hi and ends[lo] <= start:
+            lo += 1
+    if end is not None:
+        hi = int(np.searchsorted(starts, end, side="left"))
+    return lo, max(lo, hi)
+
+
+# 读取 [lo, hi) 范围内的字幕，包含已有的情感分析与翻译列
+def read_slice(filename, lo=0, hi=None):
+    total = count(filename)
+    hi = total if hi is None else min(hi, total)
+    lo = min(max(lo, 0), hi)
+    starts = _load(filename, "start.npy")[lo:hi]
+    ends = _load(filename, "end.npy")[lo:hi]
+    segments = [{"index": lo + i, "start": round(float(starts[i]), 2), "end": round(float(ends[i]), 2), "text": text}
+                for i, text in enumerate(texts(filename, lo, hi))]
+
+    if has_sentiment(filename):
+        labels = _load(filename, "sentiment.npy")[lo:hi]
+        polarity = _load(filename, "polarity.npy")[lo:hi]
+        subjectivity = _load(filename, "subjectivity.npy")[lo:hi]
+        for i, segment in enumerate(segments):
+            segment["sentiment"] = SENTIMENT_LABELS[int(labels[i])]
+            segment["polarity"] = round(float(polarity[i]), 4)
+            segment["subjectivity"] = None if np.isnan(subjectivity[i]) else round(float(subjectivity[i]), 4)
+    if has_translation(filename):
+        for segment, translation in zip(segments, _read_texts(filename, "translation_offsets.npy", "translation.bin", lo, hi)):
+            segment["translation"] = translation
+    return segments
+
+
+def read_range(filename, start=None, end=None):
+    return read_slice(filename, *time_range(filename, start, end))
+
+
+# ---------------- 旧格式 ----------------
+def _time_label(segment):
+    return f"{segment['start']} --> {segment['end']}"
+
+
+def format_txt(segments):
+    return "".join(segment["text"] for segment in segments)
+
+
+def format_srt(segments):
+    return "".join(f"{_time_label(segment)}\n{segment['text']}\n\n" for segment in segments)
+
+
+# 情感分析接口原来返回的字幕列表
+def sentiment_entries(segments):
+    return [{
+        "time": _time_label(segment),
+        "content": segment["text"].strip(),
+        "sentiment": segment.get("sentiment"),
+        "polarity": segment.get("polarity"),
+        "subjectivity": segment.get("subjectivity")
+    } for segment in segments]
+
+
+# 原来的 _chinese.json 内容
+def translation_entries(segments):
+    return [{
+        "time": _time_label(segment),
+        "content": segment.get("translation", ""),
+        "sentiment": segment.get("sentiment")
+    } for segment in segments]
+
+
+# 原来的 _chinese.txt 内容
+def format_translation_txt(segments):
+    return "".join(segment.get("translation", "") + "\n" for segment in segments)
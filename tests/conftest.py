@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# 各模块使用 sqlite.db、output/... 等相对路径，测试在临时目录中运行，并重新建立连接池与数据表
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import database
+    database.close_pool()
+    database.init_db()
+    yield tmp_path
+    database.close_pool()
@@ -0,0 +1,97 @@
+import errno
+import os
+
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+
+@pytest.fixture
+def cache(workdir):
+    import artifact_cache
+    artifact_cache.create_cache_table()
+    return artifact_cache
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(data)
+
+
+def read(path):
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+
+def test_fetch_misses_without_hash_or_entry(cache):
+    assert not cache.fetch(None, "audio", {}, {"audio.wav": "out/a.wav"})
+    assert not cache.fetch("ab" * 32, "audio", {}, {"audio.wav": "out/a.wav"})
+    assert not os.path.exists("out/a.wav")
+
+
+def test_store_then_fetch_copies_text_artifacts(cache):
+    write("out/a.txt", "transcript")
+    write("out/a.srt", "subtitles")
+    content_hash = "cd" * 32
+    cache.store(content_hash, "transcript", {"model": "medium"}, {"t.txt": "out/a.txt", "t.srt": "out/a.srt"})
+    os.utime("out/a.txt", (1, 1))
+
+    # 参数不同不命中；缺少任一文件也不命中
+    assert not cache.fetch(content_hash, "transcript", {"model": "small"}, {"t.txt": "out/b.txt"})
+    assert not cache.fetch(content_hash, "transcript", {"model": "medium"}, {"t.txt": "out/b.txt", "t.json": "out/b.json"})
+
+    assert cache.fetch(content_hash, "transcript", {"model": "medium"}, {"t.txt": "out/b.txt", "t.srt": "out/b.srt"})
+    assert read("out/b.txt") == "transcript"
+    assert read("out/b.srt") == "subtitles"
+    # 恢复出的文件是新文件，不会改动其他视频输出文件的修改时间
+    assert not os.path.samefile("out/a.txt", "out/b.txt")
+    assert os.path.getmtime("out/a.txt") == 1
+    assert os.path.getmtime("out/b.txt") > 1
+
+
+def test_media_artifacts_are_hardlinked(cache):
+    write("out/a.wav", "audio")
+    os.utime("out/a.wav", (1, 1))
+    cache.store("ab" * 32, "audio", {}, {"audio.wav": "out/a.wav"})
+    assert cache.fetch("ab" * 32, "audio", {}, {"audio.wav": "out/b.wav"})
+    assert os.path.samefile("out/a.wav", "out/b.wav")
+    assert os.path.getmtime("out/a.wav") == 1
+
+
+def test_copies_when_hardlink_is_not_possible(cache, monkeypatch):
+    def cross_device(src, dest):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    write("out/a.wav", "audio")
+    monkeypatch.setattr(os, "link", cross_device)
+    cache.store("ef" * 32, "audio", {}, {"audio.wav": "out/a.wav"})
+    assert cache.fetch("ef" * 32, "audio", {}, {"audio.wav": "out/b.wav"})
+    assert read("out/b.wav") == "audio"
+    assert not os.path.samefile("out/a.wav", "out/b.wav")
+
+
+def test_enforce_budget_evicts_least_recently_used(cache):
+    for index, name in enumerate(["first", "second", "third"]):
+        write(f"out/{name}.bin", "x" * 100)
+        cache.store(f"{index:02d}" * 32, "tokens", {}, {"tokens.json": f"out/{name}.bin"})
+    # 访问第一个条目后，最久未访问的是第二个
+    assert cache.fetch("00" * 32, "tokens", {}, {"tokens.json": "out/restored.bin"})
+
+    assert cache.enforce_budget(budget_bytes=250) == 100
+    assert not cache.fetch("01" * 32, "tokens", {}, {"tokens.json": "out/evicted.bin"})
+    assert cache.fetch("00" * 32, "tokens", {}, {"tokens.json": "out/restored.bin"})
+    assert cache.fetch("02" * 32, "tokens", {}, {"tokens.json": "out/restored.bin"})
+
+
+def test_enforce_budget_ignores_entries_shared_with_outputs(cache):
+    write("out/linked.wav", "x" * 100)
+    cache.store("aa" * 32, "audio", {}, {"audio.wav": "out/linked.wav"})
+    write("out/copied.txt", "x" * 100)
+    cache.store("bb" * 32, "tokens", {}, {"tokens.json": "out/copied.txt"})
+
+    # 音频仍被输出文件引用，只有词元缓存真正占用空间
+    assert cache.enforce_budget(budget_bytes=150) == 0
+    assert cache.enforce_budget(budget_bytes=50) == 100
+    assert cache.fetch("aa" * 32, "audio", {}, {"audio.wav": "out/linked.wav"})
+    assert not cache.fetch("bb" * 32, "tokens", {}, {"tokens.json": "out/copied.txt"})
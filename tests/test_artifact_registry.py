@@ -0,0 +1,107 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+
+DAY = 86400
+
+
+@pytest.fixture
+def registry(workdir):
+    import artifact_registry
+    artifact_registry.create_registry_table()
+    artifact_registry._last_touch.clear()
+    return artifact_registry
+
+
+def make_file(path, size, age=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def talk(registry):
+    make_file("output/videos/talk.mp4", 10)
+    make_file("output/audios/talk.wav", 1000, age=3 * DAY)
+    make_file("output/previews/talk_preview.mp4", 2000, age=2 * DAY)
+    make_file("output/transcripts/talk.txt", 100, age=2 * DAY)
+    make_file("output/transcripts/talk_summary.txt", 50, age=2 * DAY)
+    return "talk.mp4"
+
+
+def test_sync_registers_artifacts_by_kind(talk, registry):
+    assert registry.sync() == []
+    assert registry.usage() == {
+        "audio": {"files": 1, "bytes": 1000},
+        "preview": {"files": 1, "bytes": 2000},
+        "transcript": {"files": 1, "bytes": 100},
+        "summary": {"files": 1, "bytes": 50},
+    }
+
+
+def test_enforce_quota_evicts_least_recently_used(talk, registry):
+    report = registry.enforce_quota(quota_bytes=2500, compress_after_seconds=0, min_idle_seconds=60)
+    assert report["evicted"] == 1
+    assert report["reclaimed_bytes"]["evicted"] == 1000
+    assert report["total_bytes"] == 2150
+    assert not report["over_quota"]
+    assert not os.path.exists("output/audios/talk.wav")
+    assert os.path.exists("output/previews/talk_preview.mp4")
+
+
+def test_enforce_quota_keeps_transcripts_and_recent_files(talk, registry):
+    make_file("output/previews/talk_preview.mp4", 2000)
+    report = registry.enforce_quota(quota_bytes=1, compress_after_seconds=0, min_idle_seconds=60)
+    # 预览刚生成过，转录文本与总结不可淘汰
+    assert report["evicted"] == 1
+    assert report["over_quota"]
+    assert os.path.exists("output/previews/talk_preview.mp4")
+    assert os.path.exists("output/transcripts/talk.txt")
+    assert os.path.exists("output/transcripts/talk_summary.txt")
+
+
+def test_enforce_quota_keeps_audio_until_transcribed(talk, registry):
+    os.remove("output/transcripts/talk.txt")
+    report = registry.enforce_quota(quota_bytes=2000, compress_after_seconds=0, min_idle_seconds=60)
+    assert report["evicted"] == 1
+    assert os.path.exists("output/audios/talk.wav")
+    assert not os.path.exists("output/previews/talk_preview.mp4")
+
+
+def test_enforce_quota_removes_old_orphans(talk, registry):
+    make_file("output/previews/gone_preview.mp4", 300, age=DAY)
+    make_file("output/previews/fresh_preview.mp4", 300)
+    report = registry.enforce_quota(quota_bytes=0, compress_after_seconds=0, min_idle_seconds=60)
+    assert report["orphans_removed"] == 1
+    assert report["reclaimed_bytes"]["orphans"] == 300
+    assert not os.path.exists("output/previews/gone_preview.mp4")
+    assert os.path.exists("output/previews/fresh_preview.mp4")
+
+
+def test_enforce_quota_compresses_cold_transcripts(talk, registry):
+    path = "output/transcripts/talk.txt"
+    mtime = os.path.getmtime(path)
+    report = registry.enforce_quota(quota_bytes=0, compress_after_seconds=DAY, min_idle_seconds=60)
+    assert report["compressed"] == 1
+    assert report["reclaimed_bytes"]["compressed"] > 0
+    assert not os.path.exists(path)
+    assert registry.usage()["transcript_gz"]["files"] == 1
+
+    # 读取前解压回原位置，修改时间不变
+    assert registry.restore(path)
+    assert os.path.getsize(path) == 100
+    assert os.path.getmtime(path) == pytest.approx(mtime)
+    assert not os.path.exists(path + ".gz")
+    assert registry.usage()["transcript"]["files"] == 1
+
+
+def test_delete_video_artifacts(talk, registry):
+    registry.register_video(talk)
+    assert registry.delete_video_artifacts(talk) == (4, 3150)
+    assert registry.usage() == {}
+    assert not os.path.exists("output/audios/talk.wav")
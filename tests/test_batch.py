@@ -0,0 +1,85 @@
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture
+def db(workdir):
+    import database
+    return database
+
+
+def test_claim_batch_items_respects_batch_and_global_limits(db):
+    db.create_batch("a", "/src/a", {}, 5, 2, ["a0.mp4", "a1.mp4", "a2.mp4"], "2024-01-01")
+    db.create_batch("b", "/src/b", {}, 5, 2, ["b0.mp4", "b1.mp4"], "2024-01-01")
+    db.register_batch_videos("a", [(i, f"a{i}.mp4", 1, None) for i in range(3)], "2024-01-01")
+    db.register_batch_videos("b", [(i, f"b{i}.mp4", 1, None) for i in range(2)], "2024-01-01")
+
+    assert [item["position"] for item in db.claim_batch_items("a", 2, 3, 1.0)] == [0, 1]
+    assert db.claim_batch_items("a", 2, 3, 1.0) == []
+    assert [item["position"] for item in db.claim_batch_items("b", 2, 3, 1.0)] == [0]
+    assert db.batch_state_counts("a") == {"RUNNING": 2, "READY": 1}
+
+    db.update_batch_items("a", [(0, {"state": "FAILURE", "error": "ffmpeg failed"}), (1, {"state": "SUCCESS"})])
+    db.retry_failed_batch_items("a")
+    assert [item["position"] for item in db.claim_batch_items("a", 2, 3, 2.0)] == [0, 2]
+
+
+def test_register_batch_videos_is_idempotent(db):
+    db.create_batch("a", "/src/a", {}, 5, 2, ["a0.mp4"], "2024-01-01")
+    db.register_batch_videos("a", [(0, "a0.mp4", 1, None)], "2024-01-01")
+    db.register_batch_videos("a", [(0, "a0.mp4", 1, None)], "2024-01-01")
+    with db.get_db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0] == 1
+
+
+@pytest.fixture
+def server(db):
+    pytest.importorskip("celery")
+    pytest.importorskip("whisper")
+    import celery_server
+    return celery_server
+
+
+def test_import_batch_video_normalizes_extension(server, workdir):
+    source = workdir / "Lecture.MP4"
+    source.write_bytes(b"video")
+    filename, size, _ = server.import_batch_video("abcdef1234", 3, str(source))
+    assert filename == "abcdef12-00003-Lecture.mp4"
+    assert size == 5
+    assert os.path.exists(os.path.join(server.VIDEO_DIR, filename))
+
+
+def start_job(db, stages):
+    db.create_batch("a", "/src/a", {}, 5, 2, ["a0.mp4"], "2024-01-01")
+    db.register_batch_videos("a", [(0, "a0.mp4", 1, None)], "2024-01-01")
+    db.claim_batch_items("a", 2, 8, time.time())
+    db.create_pipeline_job("job", "a0", {}, stages, "2024-01-01")
+    db.update_batch_items("a", [(0, {"job_id": "job"})])
+
+
+def test_refresh_marks_finished_jobs(server, db):
+    start_job(db, ["extract", "freq"])
+    db.update_pipeline_stage("job", "extract", state="SUCCESS")
+    server.refresh_batch_items("a")
+    assert db.batch_state_counts("a") == {"RUNNING": 1}
+    db.update_pipeline_stage("job", "freq", state="SKIPPED")
+    server.refresh_batch_items("a")
+    assert db.batch_state_counts("a") == {"SUCCESS": 1}
+
+
+def test_refresh_fails_stages_left_running_by_a_lost_worker(server, db):
+    start_job(db, ["extract", "transcribe", "summary"])
+    db.update_pipeline_stage("job", "extract", state="SUCCESS")
+    db.update_pipeline_stage("job", "transcribe", state="RUNNING", started_at=time.time() - 60)
+    server.refresh_batch_items("a")
+    assert db.batch_state_counts("a") == {"RUNNING": 1}
+
+    db.update_pipeline_stage("job", "transcribe", started_at=time.time() - server.TRANSCRIBE_TIME_LIMIT - 3600)
+    server.refresh_batch_items("a")
+    item = db.list_batch_items("a")[0]
+    assert item["state"] == "FAILURE"
+    assert item["error"] == "transcribe: worker lost or time limit exceeded"
+    states = {stage["stage"]: stage["state"] for stage in db.get_pipeline_job("job")[1]}
+    assert states == {"extract": "SUCCESS", "transcribe": "FAILURE", "summary": "CANCELLED"}
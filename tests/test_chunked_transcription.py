@@ -0,0 +1,44 @@
+import pytest
+
+
+@pytest.fixture
+def server(workdir):
+    pytest.importorskip("celery")
+    pytest.importorskip("whisper")
+    import celery_server
+    return celery_server
+
+
+def _chunk(index, keep_start, keep_end, last, segments):
+    return {"chunk": {"index": index, "keep_start": keep_start, "keep_end": keep_end, "last": last},
+            "segments": [{"start": start, "end": end, "text": text} for start, end, text in segments]}
+
+
+def test_merge_segments_keeps_owned_segments_and_drops_overlap_duplicates(server):
+    first = _chunk(0, 0.0, 10.0, False, [(0.0, 4.0, "a"), (4.0, 9.0, "b"), (9.0, 10.4, " c"), (10.4, 11.0, "d")])
+    second = _chunk(1, 10.0, 20.0, True, [(8.0, 9.5, "b"), (9.5, 10.5, "c"), (10.4, 11.0, "d"), (19.0, 23.0, "e")])
+
+    # 片段结果可能乱序返回，合并时按序号排列
+    merged = server.merge_segments([second, first])
+    assert [(segment["start"], segment["text"]) for segment in merged] == [
+        (0.0, "a"), (4.0, "b"), (9.0, " c"), (10.4, "d"), (19.0, "e")]
+
+
+def test_find_silence_cuts_picks_quiet_frames_near_targets(server):
+    np = pytest.importorskip("numpy")
+    rate = server.SAMPLE_RATE
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, 30 * rate).astype(np.float32)
+    for quiet in (9.0, 21.0):
+        audio[int(quiet * rate):int((quiet + 0.3) * rate)] = 0
+
+    cuts = server.find_silence_cuts(audio, chunk_seconds=10, search_seconds=3)
+    assert len(cuts) == 2
+    assert 9.0 <= cuts[0] <= 9.3
+    assert 21.0 <= cuts[1] <= 21.3
+
+
+def test_find_silence_cuts_leaves_short_tail_in_last_chunk(server):
+    np = pytest.importorskip("numpy")
+    audio = np.ones(12 * server.SAMPLE_RATE, dtype=np.float32)
+    assert server.find_silence_cuts(audio, chunk_seconds=10) == []
+    assert server.find_silence_cuts(audio[:100], chunk_seconds=10) == []
@@ -0,0 +1,48 @@
+import pytest
+
+
+@pytest.fixture
+def db(workdir):
+    import database
+    return database
+
+
+def test_connections_use_wal_and_are_reused(db):
+    with db.get_db() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        first = conn
+    with db.get_db() as conn:
+        assert conn is first
+
+
+def test_get_db_commits_on_success_and_rolls_back_on_error(db):
+    with db.get_db() as conn:
+        conn.execute("INSERT INTO videos (filename, size, upload_time) VALUES ('kept.mp4', 1, '2024-01-01')")
+    with pytest.raises(RuntimeError):
+        with db.get_db() as conn:
+            conn.execute("INSERT INTO videos (filename, size, upload_time) VALUES ('lost.mp4', 1, '2024-01-01')")
+            raise RuntimeError("boom")
+    assert db.find_video_by_filename("kept") is not None
+    assert db.find_video_by_filename("lost") is None
+
+
+def test_video_lookup_and_state(db):
+    video_id = db.save_video_info("talk.mp4", 10, "2024-01-01 00:00:00", content_hash="abc")
+    assert db.find_video_by_hash("abc")["id"] == video_id
+    db.set_video_state("talk", transcript_ready=True, unknown=True)
+    video = db.find_video_by_filename("talk.mp4")
+    assert (video["audio_ready"], video["transcript_ready"]) == (0, 1)
+
+
+def test_init_db_migrates_old_video_table(db, workdir):
+    db.close_pool()
+    (workdir / "sqlite.db").unlink()
+    with db.get_db() as conn:
+        conn.execute("CREATE TABLE videos (id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT NOT NULL, "
+                     "size REAL NOT NULL, upload_time TEXT NOT NULL)")
+    db.init_db()
+    with db.get_db() as conn:
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(videos)")}
+        indexes = {row["name"] for row in conn.execute("PRAGMA index_list(videos)")}
+    assert {"content_hash", *db.VIDEO_STATE_COLUMNS} <= columns
+    assert {"idx_videos_content_hash", "idx_videos_upload_time", "idx_videos_filename"} <= indexes
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+
+@pytest.fixture
+def cache(workdir, monkeypatch):
+    import llm_cache
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_URL", "")
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", True)
+    llm_cache.create_cache_tables()
+    return llm_cache
+
+
+def counting_call(response, delay=0.0):
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return response
+    return call, calls
+
+
+def test_make_key_depends_on_every_input(cache):
+    key = cache.make_key("model", "system", "content")
+    assert key == cache.make_key("model", "system", "content")
+    assert key != cache.make_key("other", "system", "content")
+    assert key != cache.make_key("model", "other", "content")
+    assert key != cache.make_key("model", "system", "other")
+    assert key != cache.make_key("model", "system", "content", {"type": "json_object"})
+
+
+def test_second_call_is_served_from_cache(cache):
+    call, calls = counting_call({"choices": [{"message": {"content": "summary"}}]})
+    key = cache.make_key("model", "system", "content")
+    first = asyncio.run(cache.aget_or_call(key, call))
+    second = asyncio.run(cache.aget_or_call(key, call))
+    assert first == second == {"choices": [{"message": {"content": "summary"}}]}
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_concurrent_calls_share_one_request(cache):
+    call, calls = counting_call({"answer": 42}, delay=0.05)
+
+    async def run():
+        return await asyncio.gather(*[cache.aget_or_call("same", call) for _ in range(5)])
+
+    assert asyncio.run(run()) == [{"answer": 42}] * 5
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats["misses"], stats["shared"]) == (1, 4)
+
+
+def test_errors_are_not_cached(cache):
+    async def failing():
+        raise RuntimeError("rate limited")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.aget_or_call("flaky", failing))
+    call, calls = counting_call({"answer": "ok"})
+    assert asyncio.run(cache.aget_or_call("flaky", call)) == {"answer": "ok"}
+    assert len(calls) == 1
+    assert cache.stats()["errors"] == 1
+
+
+def test_expired_entries_are_refetched(cache, monkeypatch):
+    call, calls = counting_call({"answer": 1})
+    asyncio.run(cache.aget_or_call("old", call))
+    monkeypatch.setattr(cache, "LLM_CACHE_TTL_SECONDS", -1)
+    assert cache.lookup("old") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_disabled_cache_always_calls(cache, monkeypatch):
+    monkeypatch.setattr(cache, "LLM_CACHE_ENABLED", False)
+    call, calls = counting_call({"answer": 1})
+    asyncio.run(cache.aget_or_call("key", call))
+    asyncio.run(cache.aget_or_call("key", call))
+    assert len(calls) == 2
+
+
+def test_invalid_responses_are_returned_but_not_cached(cache):
+    call, calls = counting_call({"content": "not json"})
+    valid = lambda response: response["content"].startswith("{")
+    assert asyncio.run(cache.aget_or_call("eval", call, valid)) == {"content": "not json"}
+    assert asyncio.run(cache.aget_or_call("eval", call, valid)) == {"content": "not json"}
+    assert len(calls) == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_cached_entries_failing_validation_are_refetched(cache):
+    cache.save("eval", {"content": "stale"})
+    call, calls = counting_call({"content": "{}"})
+    valid = lambda response: response["content"] == "{}"
+    assert asyncio.run(cache.aget_or_call("eval", call, valid)) == {"content": "{}"}
+    assert cache.lookup("eval") == {"content": "{}"}
+    assert len(calls) == 1
+
+
+def test_cache_io_errors_do_not_fail_the_call(cache, monkeypatch):
+    def broken(*args):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(cache, "lookup", broken)
+    monkeypatch.setattr(cache, "save", broken)
+    call, calls = counting_call({"answer": 1})
+    assert asyncio.run(cache.aget_or_call("key", call)) == {"answer": 1}
+    assert len(calls) == 1
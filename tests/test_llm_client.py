@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import pytest
+
+for module in ("httpx", "dotenv", "prometheus_client"):
+    pytest.importorskip(module)
+
+
+@pytest.fixture
+def llm_client(workdir):
+    import llm_client
+    return llm_client
+
+
+# 按 id 返回译文的假接口，respond 可以改写返回的行
+def fake_api(llm_client, monkeypatch, respond=None):
+    requests = []
+
+    async def chat_completion(client, model, system_prompt, user_content, response_format=None, rate_limiter=None,
+                              valid=None):
+        requests.append(user_content)
+        if system_prompt == llm_client.TRANSLATE_LINE_PROMPT:
+            return "译:" + user_content
+        lines = json.loads(user_content)["lines"]
+        translations = [{"id": line["id"], "text": "译:" + line["text"]} for line in lines]
+        return json.dumps({"translations": respond(translations) if respond else translations}, ensure_ascii=False)
+
+    monkeypatch.setattr(llm_client, "chat_completion", chat_completion)
+    return requests
+
+
+def translate(llm_client, lines):
+    batch = list(enumerate(lines))
+    return asyncio.run(llm_client._translate_batch(None, None, asyncio.Semaphore(4), batch))
+
+
+def test_aligned_batch_uses_one_request(llm_client, monkeypatch):
+    requests = fake_api(llm_client, monkeypatch)
+    assert translate(llm_client, ["a", "b", "c"]) == {0: "译:a", 1: "译:b", 2: "译:c"}
+    assert len(requests) == 1
+
+
+def test_missing_lines_are_retried_alone(llm_client, monkeypatch):
+    requests = fake_api(llm_client, monkeypatch, respond=lambda items: [item for item in items if item["id"] != 1])
+    assert translate(llm_client, ["a", "b", "c"]) == {0: "译:a", 1: "译:b", 2: "译:c"}
+    # 第一次缺少第 2 行，只重新翻译这一行
+    assert requests[1:] == ["b"]
+
+
+def test_unparsable_reply_splits_batch(llm_client, monkeypatch):
+    requests = fake_api(llm_client, monkeypatch, respond=lambda items: items if len(items) < 4 else "oops")
+    assert translate(llm_client, ["a", "b", "c", "d"]) == {0: "译:a", 1: "译:b", 2: "译:c", 3: "译:d"}
+    assert len(requests) == 3
+
+
+def test_api_errors_are_not_split(llm_client, monkeypatch):
+    requests = []
+
+    async def chat_completion(*args, **kwargs):
+        requests.append(args)
+        raise llm_client.LLMRequestError("API request failed with status code 401")
+
+    monkeypatch.setattr(llm_client, "chat_completion", chat_completion)
+    with pytest.raises(llm_client.LLMRequestError):
+        translate(llm_client, ["a", "b", "c", "d"])
+    assert len(requests) == 1
+
+
+def test_translations_complete_checks_every_line(llm_client):
+    batch = [(0, "a"), (1, "b")]
+    assert llm_client._translations_complete('{"translations": [{"id": 0, "text": "x"}, {"id": "1", "text": "y"}]}', batch)
+    assert not llm_client._translations_complete('{"translations": [{"id": 0, "text": "x"}]}', batch)
+    assert not llm_client._translations_complete("not json", batch)
+
+
+def test_split_into_chunks_keeps_subtitle_boundaries(llm_client):
+    assert llm_client.split_into_chunks(["aaa", "bbb", "cc", " ", "dddd"], 8) == ["aaa\nbbb", "cc\ndddd"]
+    assert llm_client.split_into_chunks([], 8) == []
+
+
+def test_split_into_chunks_cuts_long_subtitles(llm_client):
+    chunks = llm_client.split_into_chunks(["ab", "x" * 10, "cd"], 4)
+    assert chunks == ["ab", "xxxx", "xxxx", "xx", "cd"]
+    assert all(len(chunk) <= 4 for chunk in chunks)
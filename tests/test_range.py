@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def backend(workdir):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("celery")
+    pytest.importorskip("whisper")
+    os.makedirs("output/wordclouds", exist_ok=True)
+    import backend
+    return backend
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("BYTES = 5-5", (5, 5)),
+])
+def test_parse_range(backend, header, expected):
+    assert backend._parse_range(header, 1000) == expected
+
+
+# 不支持的单位和多段范围按普通请求返回整个文件
+@pytest.mark.parametrize("header", ["items=0-1", "bytes=0-1,5-6"])
+def test_parse_range_ignores_unsupported_ranges(backend, header):
+    assert backend._parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=500-100", "bytes=-0"])
+def test_parse_range_rejects_unsatisfiable_ranges(backend, header):
+    with pytest.raises(ValueError):
+        backend._parse_range(header, 1000)
@@ -0,0 +1,55 @@
+import pytest
+
+for module in ("numpy", "jieba", "textblob", "wordcloud", "prometheus_client"):
+    pytest.importorskip(module)
+
+
+@pytest.fixture
+def index(workdir):
+    import search_index
+    search_index.create_search_tables()
+    search_index.index_segments("talk.mp4", "en", [
+        {"start": 0.0, "end": 2.0, "text": "Welcome to the lecture on databases."},
+        {"start": 2.0, "end": 4.0, "text": "Indexes make database queries fast."},
+        {"start": 4.0, "end": 6.0, "text": "  ...  "},
+    ])
+    search_index.index_segments("talk.mp4", "zh", [
+        {"start": 0.0, "end": 2.0, "text": "欢迎来到数据库课程。"},
+    ])
+    search_index.index_segments("other.mp4", "en", [
+        {"start": 10.0, "end": 12.0, "text": "Another lecture about compilers."},
+    ])
+    return search_index
+
+
+def test_parse_time_accepts_seconds_and_srt_timestamps(index):
+    assert index.parse_time("12.5") == 12.5
+    assert index.parse_time("00:01:02,500") == 62.5
+    assert index.parse_time("1:02.25") == 62.25
+    assert index.entries_to_segments([{"time": "1.0 --> 2.0", "content": "a"}, {"time": "bad", "content": "b"}]) == \
+        [{"start": 1.0, "end": 2.0, "text": "a"}]
+
+
+def test_search_matches_all_terms_with_timestamps(index):
+    results, more = index.search("database queries")
+    assert not more
+    assert [(result["filename"], result["segment_index"], result["start"]) for result in results] == [("talk.mp4", 1, 2.0)]
+    assert "<b>queries</b>" in results[0]["snippet"]
+
+
+def test_search_filters_and_pages(index):
+    results, more = index.search("lecture", limit=1)
+    assert len(results) == 1 and more
+    assert len(index.search("lecture", limit=1, offset=1)[0]) == 1
+    assert [result["filename"] for result in index.search("lecture", filename="other.mp4")[0]] == ["other.mp4"]
+    assert [result["language"] for result in index.search("数据库")[0]] == ["zh"]
+    assert index.search("...") == ([], False)
+
+
+def test_reindex_and_remove(index):
+    index.index_segments("talk.mp4", "en", [{"start": 0.0, "end": 1.0, "text": "Completely new text."}])
+    assert index.search("databases", language="en")[0] == []
+    assert len(index.search("数据库")[0]) == 1
+    index.remove("talk.mp4")
+    assert index.search("数据库")[0] == []
+    assert len(index.search("compilers")[0]) == 1
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import segment_store
+
+SEGMENTS = [
+    {"start": 0.0, "end": 2.5, "text": "Hello everyone."},
+    {"start": 2.5, "end": 5.0, "text": "今天讲列式存储。"},
+    {"start": 6.0, "end": 9.25, "text": "Thanks!"},
+]
+SCORES = [
+    {"sentiment": "positive", "polarity": 0.5, "subjectivity": 0.6},
+    {"sentiment": "neutral", "polarity": 0.0, "subjectivity": None},
+    {"sentiment": "negative", "polarity": -0.25, "subjectivity": 0.1},
+]
+
+
+@pytest.fixture
+def store(workdir):
+    segment_store.write_segments("talk", SEGMENTS)
+    return "talk"
+
+
+def test_round_trip(store):
+    assert segment_store.exists(store)
+    assert segment_store.list_stores() == [store]
+    assert segment_store.count(store) == 3
+    assert segment_store.texts(store, 1, 3) == ["今天讲列式存储。", "Thanks!"]
+    segments = segment_store.read_slice(store)
+    assert [segment["index"] for segment in segments] == [0, 1, 2]
+    assert [(segment["start"], segment["end"], segment["text"]) for segment in segments] == \
+        [(segment["start"], segment["end"], segment["text"]) for segment in SEGMENTS]
+    assert segment_store.format_txt(segments) == "Hello everyone.今天讲列式存储。Thanks!"
+
+
+def test_read_range_returns_overlapping_segments(store):
+    assert [segment["index"] for segment in segment_store.read_range(store, start=3.0, end=6.5)] == [1, 2]
+    assert [segment["index"] for segment in segment_store.read_range(store, start=5.0, end=5.5)] == []
+    assert [segment["index"] for segment in segment_store.read_range(store, end=2.5)] == [0]
+
+
+def test_empty_transcript(workdir):
+    segment_store.write_segments("silent", [])
+    assert segment_store.count("silent") == 0
+    assert segment_store.read_slice("silent") == []
+
+
+def test_sentiment_and_translation_columns(store):
+    segment_store.write_sentiment(store, SCORES)
+    segment_store.write_translation(store, ["大家好。", "Today: columnar storage.", "谢谢！"])
+    segments = segment_store.read_slice(store, 1, 3)
+    assert segments[0]["sentiment"] == "neutral"
+    assert segments[0]["subjectivity"] is None
+    assert segments[1]["polarity"] == -0.25
+    assert [segment["translation"] for segment in segments] == ["Today: columnar storage.", "谢谢！"]
+
+
+def test_rewriting_same_texts_keeps_derived_columns(store):
+    segment_store.write_sentiment(store, SCORES)
+    segment_store.write_translation(store, ["a", "b", "c"])
+    text_mtime = os.path.getmtime(segment_store.column_path(store, "text.bin"))
+    digest = segment_store.text_digest(store)
+
+    # 例如从旧格式的 srt 重新转换，只有时间精度不同
+    segment_store.write_segments(store, [dict(segment, end=segment["end"] + 0.001) for segment in SEGMENTS])
+    assert segment_store.has_sentiment(store)
+    assert segment_store.has_translation(store)
+    assert segment_store.text_digest(store) == digest
+    assert os.path.getmtime(segment_store.column_path(store, "text.bin")) == text_mtime
+
+
+def test_rewriting_changed_texts_drops_derived_columns(store):
+    segment_store.write_sentiment(store, SCORES)
+    segment_store.write_translation(store, ["a", "b", "c"])
+    digest = segment_store.text_digest(store)
+
+    segment_store.write_segments(store, [dict(segment, text=segment["text"].upper()) for segment in SEGMENTS])
+    assert not segment_store.has_sentiment(store)
+    assert not segment_store.has_translation(store)
+    assert segment_store.text_digest(store) != digest
+    assert segment_store.texts(store)[0] == "HELLO EVERYONE."
+
+
+def test_sentiment_scorer_is_cleared_with_the_columns(store):
+    assert segment_store.sentiment_scorer(store) is None
+    segment_store.write_sentiment(store, SCORES)
+    segment_store.set_sentiment_scorer(store, "textblob")
+    assert segment_store.sentiment_scorer(store) == "textblob"
+
+    # 重新写入情感分析列时先清除记录，由调用方写完后再标记
+    segment_store.write_sentiment(store, SCORES)
+    assert segment_store.sentiment_scorer(store) is None
+    segment_store.set_sentiment_scorer(store, "snownlp")
+
+    segment_store.write_segments(store, [dict(segment, text=segment["text"].upper()) for segment in SEGMENTS])
+    assert segment_store.sentiment_scorer(store) is None
@@ -0,0 +1,53 @@
+import pytest
+
+for module in ("numpy", "jieba", "textblob", "wordcloud", "prometheus_client"):
+    pytest.importorskip(module)
+
+
+@pytest.fixture
+def text_analysis(workdir):
+    import text_analysis
+    return text_analysis
+
+
+def test_score_sentiment_batch_scores_each_text_once(text_analysis, monkeypatch):
+    seen = []
+
+    def scorer(texts):
+        seen.append(list(texts))
+        return [(0.123456, None) if text == "ok" else (-0.5, 0.25) for text in texts]
+
+    monkeypatch.setitem(text_analysis.SENTIMENT_SCORERS, "test", scorer)
+    results = text_analysis.score_sentiment_batch(["ok", "bad", "ok"], scorer="test")
+    assert seen == [["ok", "bad"]]
+    assert results == [
+        {"sentiment": "positive", "polarity": 0.1235, "subjectivity": None},
+        {"sentiment": "negative", "polarity": -0.5, "subjectivity": 0.25},
+        {"sentiment": "positive", "polarity": 0.1235, "subjectivity": None},
+    ]
+
+
+def test_unknown_scorer_is_rejected(text_analysis):
+    with pytest.raises(ValueError):
+        text_analysis.score_sentiment_batch(["text"], scorer="missing")
+
+
+def test_textblob_scorer_matches_labels(text_analysis):
+    results = text_analysis.score_sentiment_batch(["This is a great talk.", "This is terrible.", "It is a table."])
+    assert [result["sentiment"] for result in results] == ["positive", "negative", "neutral"]
+    assert all(result["subjectivity"] is not None for result in results)
+
+
+def test_auto_scorer_routes_lines_by_language(text_analysis, monkeypatch):
+    pytest.importorskip("snownlp")
+    monkeypatch.setattr(text_analysis, "snownlp_scorer", lambda texts: [(1.0, None)] * len(texts))
+    monkeypatch.setattr(text_analysis, "textblob_scorer", lambda texts: [(-1.0, 0.5)] * len(texts))
+    assert text_analysis.auto_scorer(["你好", "hello", "再见"]) == [(1.0, None), (-1.0, 0.5), (1.0, None)]
+
+
+def test_read_srt_entries(text_analysis, workdir):
+    (workdir / "talk.srt").write_text("0.0 --> 1.5\nHello.\n\n1.5 --> 3.0\nWorld.\n\n", encoding="utf-8")
+    assert text_analysis.read_srt_entries(str(workdir / "talk.srt")) == [
+        {"time": "0.0 --> 1.5", "content": "Hello."},
+        {"time": "1.5 --> 3.0", "content": "World."},
+    ]
@@ -0,0 +1,48 @@
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def server(workdir):
+    pytest.importorskip("celery")
+    pytest.importorskip("whisper")
+    import celery_server
+    os.makedirs(celery_server.VIDEO_DIR, exist_ok=True)
+    return celery_server
+
+
+def _write(path, data, age):
+    with open(path, "wb") as file:
+        file.write(data)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def test_sweep_removes_abandoned_parts_and_sessions(server):
+    import database
+    video_dir = server.VIDEO_DIR
+    _write(os.path.join(video_dir, "old.mp4.part"), b"x" * 10, 7200)
+    _write(os.path.join(video_dir, "active.mp4.part"), b"x" * 5, 0)
+    _write(os.path.join(video_dir, "done.mp4"), b"x" * 20, 7200)
+    database.create_upload("old", "old.mp4", 100, True, datetime.fromtimestamp(time.time() - 7200).isoformat())
+    database.create_upload("active", "active.mp4", 100, True, datetime.fromtimestamp(time.time() - 7200).isoformat())
+
+    assert server.sweep_abandoned_uploads(ttl_seconds=3600) == 10
+    assert sorted(os.listdir(video_dir)) == ["active.mp4.part", "done.mp4"]
+    assert database.get_upload("old") is None
+    assert database.get_upload("active") is not None
+
+
+def test_unique_video_filename_requires_mp4_for_transcription(server):
+    pytest.importorskip("fastapi")
+    import backend
+    from fastapi import HTTPException
+
+    assert backend._unique_video_filename("../clip.MP4", True).endswith("-clip.mp4")
+    assert backend._unique_video_filename("notes.mkv", False).endswith("-notes.mkv")
+    with pytest.raises(HTTPException) as error:
+        backend._unique_video_filename("notes.mkv", True)
+    assert error.value.status_code == 400
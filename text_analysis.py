@@ -0,0 +1,202 @@
+import json
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import jieba
+import numpy as np
+from PIL import Image
+from textblob.en.sentiments import PatternAnalyzer
+from wordcloud import STOPWORDS, WordCloud
+
+import artifact_cache
+
+# 含有中文字符的字幕行
+CJK_PATTERN = re.compile(r"[\u4e00-\u9fff]")
+
+DEFAULT_SENTIMENT_SCORER = "textblob"
+
+_pattern_analyzer = None
+
+
+def sentiment_label(polarity):
+    return 'positive' if polarity > 0 else 'negative' if polarity < 0 else 'neutral'
+
+
+# TextBlob 默认的 pattern 词典打分：整批共用一个分析器，不再为每行创建 TextBlob 对象
+def textblob_scorer(texts):
+    global _pattern_analyzer
+    if _pattern_analyzer is None:
+        _pattern_analyzer = PatternAnalyzer()
+    results = []
+    for text in texts:
+        sentiment = _pattern_analyzer.analyze(text)
+        results.append((sentiment[0], sentiment[1]))
+    return results
+
+
+# 中文打分：SnowNLP 给出的是积极概率 [0, 1]，换算为 [-1, 1] 的极性，没有主观性分数
+def snownlp_scorer(texts):
+    from snownlp import SnowNLP
+    return [((SnowNLP(text).sentiments * 2 - 1) if text else 0.0, None) for text in texts]
+
+
+# 自动选择：中文行使用 SnowNLP（未安装时退回 TextBlob），其余使用 TextBlob
+def auto_scorer(texts):
+    try:
+        import snownlp  # noqa: F401
+    except ImportError:
+        return textblob_scorer(texts)
+    chinese = [index for index, text in enumerate(texts) if CJK_PATTERN.search(text)]
+    other = [index for index, text in enumerate(texts) if not CJK_PATTERN.search(text)]
+    results = [None] * len(texts)
+    for indexes, scorer in ((chinese, snownlp_scorer), (other, textblob_scorer)):
+        for index, result in zip(indexes, scorer([texts[i] for i in indexes])):
+            results[index] = result
+    return results
+
+
+# 可插拔的情感打分器：接收字幕文本列表，返回 (polarity, subjectivity) 列表
+SENTIMENT_SCORERS = {
+    "textblob": textblob_scorer,
+    "snownlp": snownlp_scorer,
+    "auto": auto_scorer,
+}
+
+
+# 一次性为整份字幕打分，相同的句子只计算一次
+def score_sentiment_batch(texts, scorer=DEFAULT_SENTIMENT_SCORER):
+    if scorer not in SENTIMENT_SCORERS:
+        raise ValueError(f"Unknown sentiment scorer '{scorer}'")
+    unique_texts = list(dict.fromkeys(texts))
+    scores = dict(zip(unique_texts, SENTIMENT_SCORERS[scorer](unique_texts)))
+
+    results = []
+    for text in texts:
+        polarity, subjectivity = scores[text]
+        results.append({
+            "sentiment": sentiment_label(polarity),
+            "polarity": round(polarity, 4),
+            "subjectivity": round(subjectivity, 4) if subjectivity is not None else None
+        })
+    return results
+
+
+# 读取 srt 字幕，每个字幕块的第一行为时间，第二行为内容
+def read_srt_entries(srt_path):
+    with open(srt_path, 'r', encoding='utf-8') as file:
+        blocks = file.read().split("\n\n")
+    entries = []
+    for block in blocks:
+        lines = block.strip("\n").split("\n")
+        if len(lines) >= 2:
+            entries.append({"time": lines[0].strip(), "content": lines[1].strip()})
+    return entries
+
+
+JIEBA_PARALLEL = int(os.getenv("jieba_parallel", "0"))  # jieba 并行分词进程数，0 表示不开启（Windows 不支持）
+STOPWORDS_PATH = os.getenv("stopwords_path", "")  # 额外的停用词文件，每行一个词
+WORDCLOUD_FONT_PATH = os.getenv("wordcloud_font_path", 'C:/Windows/Fonts/simhei.ttf')  # 根据实际情况调整字体路径
+
+CHINESE_STOPWORDS = set("""
+的 了 和 是 就 都 而 及 与 着 或 一个 没有 我们 你们 他们 她们 它们 这个 那个 这些 那些 这样 那样 因为 所以
+但是 如果 虽然 然后 还是 已经 可以 自己 什么 怎么 这里 那里 不是 就是 也是 还有 之 其 以 于 被 把 让 在 有 也 很 吗 呢 吧 啊
+""".split())
+
+# 只含空白或标点的分词结果
+WORD_PATTERN = re.compile(r"\w")
+
+_jieba_lock = threading.Lock()
+_jieba_ready = False
+_stopwords = None
+_token_memo = OrderedDict()
+TOKEN_MEMO_SIZE = 64
+
+
+# 启动时预先加载 jieba 词典，避免第一个请求承担数秒的冷启动
+def init_jieba(parallel=None):
+    global _jieba_ready
+    with _jieba_lock:
+        if _jieba_ready:
+            return
+        jieba.initialize()
+        parallel = JIEBA_PARALLEL if parallel is None else parallel
+        if parallel > 0 and os.name != "nt":
+            jieba.enable_parallel(parallel)
+        _jieba_ready = True
+
+
+def get_stopwords():
+    global _stopwords
+    if _stopwords is None:
+        stopwords = set(STOPWORDS) | CHINESE_STOPWORDS
+        if STOPWORDS_PATH and os.path.exists(STOPWORDS_PATH):
+            with open(STOPWORDS_PATH, "r", encoding="utf-8") as file:
+                stopwords |= {line.strip() for line in file if line.strip()}
+        _stopwords = stopwords
+    return _stopwords
+
+
+def _read_token_artifact(token_path):
+    with open(token_path, "r", encoding="utf-8") as file:
+        return Counter(dict(json.load(file)["tokens"]))
+
+
+# 对转录文本分词一次并保存为紧凑的 词/次数 文件，词频与词云都基于这份结果生成
+# 分词文件比转录文本新时直接读取；内容相同的转录文本从产物缓存恢复
+def get_token_counts(transcript_path, token_path):
+    stat = os.stat(transcript_path)
+    memo_key = (transcript_path, stat.st_mtime_ns, stat.st_size)
+    if memo_key in _token_memo:
+        _token_memo.move_to_end(memo_key)
+        return _token_memo[memo_key]
+
+    if os.path.exists(token_path) and os.path.getmtime(token_path) >= stat.st_mtime:
+        counts = _read_token_artifact(token_path)
+    else:
+        content_hash = artifact_cache.file_digest(transcript_path)
+        if artifact_cache.fetch(content_hash, "tokens", {"tokenizer": "jieba"}, {"tokens.json": token_path}):
+            counts = _read_token_artifact(token_path)
+        else:
+            init_jieba()
+            with open(transcript_path, "r", encoding="utf-8") as file:
+                counts = Counter(jieba.cut(file.read()))
+            os.makedirs(os.path.dirname(token_path), exist_ok=True)
+            with open(token_path, "w", encoding="utf-8") as file:
+                json.dump({"source_hash": content_hash, "tokens": counts.most_common()}, file, ensure_ascii=False, separators=(",", ":"))
+            artifact_cache.store(content_hash, "tokens", {"tokenizer": "jieba"}, {"tokens.json": token_path})
+
+    _token_memo[memo_key] = counts
+    while len(_token_memo) > TOKEN_MEMO_SIZE:
+        _token_memo.popitem(last=False)
+    return counts
+
+
+# 按需过滤停用词、标点和过短的词，并只保留出现次数最多的 top_n 个
+def filter_counts(counts, stopwords=False, top_n=None, min_length=1):
+    stopword_set = get_stopwords() if stopwords else ()
+    filtered = Counter()
+    for word, count in counts.items():
+        if stopwords and (not WORD_PATTERN.search(word) or word.strip().lower() in stopword_set):
+            continue
+        if len(word.strip()) < min_length:
+            continue
+        filtered[word] = count
+    if top_n:
+        return dict(filtered.most_common(top_n))
+    return dict(filtered)
+
+
+# 渲染词云图片，返回 PIL Image；缩略图等其他尺寸直接从这张图缩放，无需重新排版
+def render_wordcloud(frequencies, width=800, height=600, background_color='white', mask_path=None):
+    mask = np.array(Image.open(mask_path)) if mask_path else None
+    wordcloud = WordCloud(
+        font_path=WORDCLOUD_FONT_PATH,
+        background_color=background_color,
+        width=width,
+        height=height,
+        margin=2,
+        mask=mask
+    ).generate_from_frequencies(frequencies)
+    return wordcloud.to_image()